@@ -1,11 +1,14 @@
 # zip and upload file to gcp
+# (STORAGE_URL can be a local directory used as a bucket, to test offline)
+STORAGE_URL=${STORAGE_URL:-gs://meteofrance-preprocess}
+
 #zip -r groundstation_npz.zip groundstation_npz/
 #zip -r h5.zip h5/
 zip -r hf_dataset.zip hf_dataset/
 
-#gsutil cp groundstation_npz.zip gs://meteofrance-preprocess/
-#gsutil cp h5.zip gs://meteofrance-preprocess/
-gsutil cp hf_dataset.zip gs://meteofrance-preprocess/hf_dataset_v3.zip
+#python3 -m meteolibre_dataset.storage cp groundstation_npz.zip $STORAGE_URL/groundstation_npz.zip
+#python3 -m meteolibre_dataset.storage cp h5.zip $STORAGE_URL/h5.zip
+python3 -m meteolibre_dataset.storage cp hf_dataset.zip $STORAGE_URL/hf_dataset_v3.zip
 
 # also push index
-#gsutil cp index.parquet gs://meteofrance-preprocess/
+#python3 -m meteolibre_dataset.storage cp index.parquet $STORAGE_URL/index.parquet
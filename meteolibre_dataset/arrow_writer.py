@@ -0,0 +1,229 @@
+"""
+Module to stream the HF dataset samples directly into Parquet shards.
+
+Instead of one npz file per array + an index + zip, the samples are written as
+Arrow record batches into Parquet shards (data/train-xxxxx.parquet) that can be
+read with datasets.load_dataset (and memory mapped by datasets once cached).
+
+The arrays are stored as fixed shape tensor columns: the schema is built from the
+Hugging Face features (Array3D / Array4D with their shape), which are also stored in
+the Parquet schema metadata, so datasets decodes them directly into arrays of the
+right shape.
+
+Every writer thread has its own shard, a shard is written under a temporary hidden
+name (.train-xxxxx.parquet.tmp, not matched by the train-* data files pattern) and
+renamed when it is closed, so an interrupted run never leaves a truncated shard
+behind; the temporary files left by an interrupted run are removed when the writer
+is opened. The on_commit callbacks given with the records are called once the
+shard containing them is closed (used to update the completion journal).
+"""
+
+import os
+import threading
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datasets import Array2D, Array3D, Array4D, Array5D, Features, Sequence, Value
+
+DATA_DIR = "data"
+SHARD_PREFIX = "train-"
+
+_ARRAY_FEATURES = {2: Array2D, 3: Array3D, 4: Array4D, 5: Array5D}
+
+
+def tensor_to_arrow(array):
+    """
+    Convert a batch of arrays (N, *shape) into an Arrow nested list array (zero copy).
+
+    Args:
+        array (np.ndarray): Batch of arrays, every row has the same shape.
+
+    Returns:
+        pa.Array: Nested list array of length N (one nesting level per dimension of shape).
+    """
+    array = np.ascontiguousarray(array)
+    arrow_array = pa.array(array.reshape(-1))
+
+    # build the offsets from the innermost dimension to the outermost one
+    shape = array.shape
+    for k in range(len(shape) - 1, 0, -1):
+        nb_lists = int(np.prod(shape[:k]))
+        offsets = pa.array(np.arange(0, nb_lists * shape[k] + 1, shape[k], dtype=np.int32))
+        arrow_array = pa.ListArray.from_arrays(offsets, arrow_array)
+
+    return arrow_array
+
+
+def hf_features(tensor_shapes, scalar_types):
+    """
+    Get the Hugging Face features of the dataset.
+
+    Args:
+        tensor_shapes (dict): Column name -> shape of the float32 array of a sample (2 to 5 dimensions).
+        scalar_types (dict): Column name -> Hugging Face dtype (e.g. "int32") of the other columns,
+                             a list [dtype] for a sequence.
+
+    Returns:
+        Features: The features.
+    """
+    features = {}
+
+    for name, dtype in scalar_types.items():
+        if isinstance(dtype, list):
+            features[name] = Sequence(Value(dtype[0]))
+        else:
+            features[name] = Value(dtype)
+
+    for name, shape in tensor_shapes.items():
+        features[name] = _ARRAY_FEATURES[len(shape)](shape=tuple(shape), dtype="float32")
+
+    return Features(features)
+
+
+class ParquetShardWriter:
+    """
+    Write samples into Parquet shards, one shard sequence per writer thread.
+
+    Args:
+        output_dir (str): Dataset folder (the shards are written in output_dir/data).
+        tensor_shapes (dict): Column name -> shape of the float32 array of a sample.
+        scalar_types (dict): Column name -> Hugging Face dtype of the other columns
+                             ("string", "int32", "float32", "timestamp[ms]", or [dtype] for a list).
+        rows_per_row_group (int, optional): Number of samples per row group. Defaults to 8.
+        rows_per_shard (int, optional): Number of samples per shard. Defaults to 256.
+        compression (str, optional): Parquet compression. Defaults to "zstd".
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        tensor_shapes,
+        scalar_types,
+        rows_per_row_group=8,
+        rows_per_shard=256,
+        compression="zstd",
+    ):
+        self.data_dir = os.path.join(output_dir, DATA_DIR)
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        self.tensor_shapes = tensor_shapes
+        self.scalar_types = scalar_types
+        self.rows_per_row_group = rows_per_row_group
+        self.rows_per_shard = rows_per_shard
+        self.compression = compression
+
+        self.features = hf_features(tensor_shapes, scalar_types)
+        self.schema = self.features.arrow_schema
+
+        self.local = threading.local()
+        self.states = []
+        self.lock = threading.Lock()
+
+        # temporary shards of a previous (interrupted) run, their samples are not in the journal
+        for f in os.listdir(self.data_dir):
+            if f.endswith(".tmp"):
+                print(f"Removing the unfinished shard {f}")
+                os.remove(os.path.join(self.data_dir, f))
+
+        # new shards never overwrite the shards of a previous (interrupted) run
+        existing = [
+            int(f[len(SHARD_PREFIX) : -len(".parquet")])
+            for f in os.listdir(self.data_dir)
+            if f.startswith(SHARD_PREFIX) and f.endswith(".parquet")
+        ]
+        self.next_shard = max(existing) + 1 if existing else 0
+
+    def _state(self):
+        state = getattr(self.local, "state", None)
+        if state is None:
+            state = {"rows": [], "writer": None, "path": None, "nb_rows": 0, "commits": []}
+            self.local.state = state
+            with self.lock:
+                self.states.append(state)
+        return state
+
+    def _open_shard(self, state):
+        with self.lock:
+            shard = self.next_shard
+            self.next_shard += 1
+
+        name = f"{SHARD_PREFIX}{shard:05d}.parquet"
+        state["path"] = os.path.join(self.data_dir, name)
+        state["tmp_path"] = os.path.join(self.data_dir, f".{name}.tmp")
+        state["writer"] = pq.ParquetWriter(
+            state["tmp_path"], self.schema, compression=self.compression
+        )
+        state["nb_rows"] = 0
+
+    def _flush_rows(self, state):
+        rows = state["rows"]
+        if not rows:
+            return
+
+        if state["writer"] is None:
+            self._open_shard(state)
+
+        columns = []
+        for name, dtype in self.scalar_types.items():
+            columns.append(
+                pa.array([row[name] for row in rows], type=self.schema.field(name).type)
+            )
+        for name in self.tensor_shapes:
+            storage = tensor_to_arrow(
+                np.stack([row[name] for row in rows]).astype(np.float32)
+            )
+            columns.append(
+                pa.ExtensionArray.from_storage(self.schema.field(name).type, storage)
+            )
+
+        batch = pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        state["writer"].write_batch(batch, row_group_size=self.rows_per_row_group)
+        state["nb_rows"] += len(rows)
+        state["rows"] = []
+
+        if state["nb_rows"] >= self.rows_per_shard:
+            self._close_shard(state)
+
+    def _close_shard(self, state):
+        if state["writer"] is None:
+            return
+
+        state["writer"].close()
+        os.replace(state["tmp_path"], state["path"])
+        state["writer"] = None
+
+        commits = state["commits"]
+        state["commits"] = []
+        for on_commit in commits:
+            on_commit()
+
+    def write(self, records, on_commit=None):
+        """
+        Add samples to the shard of the current thread.
+
+        Args:
+            records (list): Samples (dict column name -> value / array).
+            on_commit (callable, optional): Called once the shard containing those
+                                            samples is closed (persisted).
+        """
+        state = self._state()
+        state["rows"].extend(records)
+        if on_commit is not None:
+            state["commits"].append(on_commit)
+
+        if len(state["rows"]) >= self.rows_per_row_group:
+            self._flush_rows(state)
+
+    def close(self):
+        """
+        Flush and close the shards of every thread (call it once all the writes are done).
+        """
+        for state in self.states:
+            self._flush_rows(state)
+            if state["writer"] is None and state["commits"]:
+                # nothing left to write (e.g. only empty records), commit directly
+                for on_commit in state["commits"]:
+                    on_commit()
+                state["commits"] = []
+            self._close_shard(state)
@@ -0,0 +1,272 @@
+"""
+Module to keep an incremental manifest of the files of a bucket.
+
+The Météo-France bucket holds millions of files named
+T_<product>_C_LFPW_YYYYMMDDhhmmss.<ext>. Listing the whole bucket into one list
+at each run is slow, so here:
+
+- the listing is sharded by time prefix, one prefix per product and per day
+  (e.g. "T_IPRN20_C_LFPW_20250103"), and the shards are listed in parallel, each
+  one streamed page by page from the storage.
+- the result is persisted as a Parquet manifest (name, size, generation, date),
+  with the list of the shards already listed in its metadata.
+- on re-run, only the shards never listed and the last days (which can still
+  receive files) are listed again, the other rows are taken from the manifest.
+- periodically (full_relist_days, or relist_days=None), the whole bucket is listed
+  again in one stream: the old shards are refreshed (late or rewritten files) and
+  the names that match no shard (other products, days before start) are logged.
+- the delta (new files, files with a new generation, removed files) is returned,
+  and the downloads compare the manifest with the manifest of the files already
+  downloaded (manifest_diff) instead of checking the files one by one.
+
+Between two full listings, the files whose name does not start with one of the
+product prefixes are not listed.
+"""
+
+import os
+import json
+import datetime
+import concurrent.futures
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATE_PATTERN = r"(\d{12})"
+DATE_FORMAT = "%Y%m%d%H%M"
+
+MANIFEST_SCHEMA = pa.schema(
+    [
+        pa.field("name", pa.string()),
+        pa.field("size", pa.int64()),
+        pa.field("generation", pa.int64()),
+        pa.field("date", pa.timestamp("ms")),
+        pa.field("prefix", pa.string()),
+    ]
+)
+
+_SHARDS_KEY = b"shards"
+_FULL_LISTING_KEY = b"full_listing"
+_NB_LOGGED_NAMES = 20
+
+
+def time_prefixes(products, start, end):
+    """
+    Time prefixes of the listing shards: one per product and per day.
+
+    Args:
+        products (list): Product prefixes (e.g. "T_IPRN20_C_LFPW_").
+        start (datetime.date): First day.
+        end (datetime.date): Last day (included).
+
+    Returns:
+        list: The prefixes (e.g. "T_IPRN20_C_LFPW_20250103").
+    """
+    days = pd.date_range(start, end, freq="D")
+    return [f"{product}{day:%Y%m%d}" for product in products for day in days]
+
+
+def load_manifest(path):
+    """
+    Load a manifest saved with update_manifest.
+
+    Args:
+        path (str): Path of the Parquet manifest.
+
+    Returns:
+        tuple: A tuple containing:
+            - df (pd.DataFrame): The manifest (empty if the file does not exist).
+            - shards (list): Time prefixes already listed.
+    """
+    if not os.path.exists(path):
+        return MANIFEST_SCHEMA.empty_table().to_pandas(), []
+
+    table = pq.read_table(path, schema=MANIFEST_SCHEMA)
+    metadata = pq.read_schema(path).metadata or {}
+    shards = json.loads(metadata.get(_SHARDS_KEY, b"[]"))
+
+    return table.to_pandas(), shards
+
+
+def last_full_listing(path):
+    """
+    Get the day of the last full listing of the bucket recorded in a manifest.
+
+    Args:
+        path (str): Path of the Parquet manifest.
+
+    Returns:
+        datetime.date: The day, None if the bucket was never fully listed.
+    """
+    if not os.path.exists(path):
+        return None
+
+    metadata = pq.read_schema(path).metadata or {}
+    if _FULL_LISTING_KEY not in metadata:
+        return None
+    return datetime.date.fromisoformat(metadata[_FULL_LISTING_KEY].decode())
+
+
+def save_manifest(df, path, shards=(), full_listing=None):
+    """
+    Save a manifest (temporary file renamed once written).
+
+    Args:
+        df (pd.DataFrame): The manifest.
+        path (str): Path of the Parquet manifest.
+        shards (list, optional): Time prefixes listed. Defaults to ().
+        full_listing (datetime.date, optional): Day of the last full listing of the bucket.
+                                                Defaults to None.
+    """
+    table = pa.Table.from_pandas(
+        df[MANIFEST_SCHEMA.names], schema=MANIFEST_SCHEMA, preserve_index=False
+    )
+    metadata = {_SHARDS_KEY: json.dumps(sorted(shards)).encode()}
+    if full_listing is not None:
+        metadata[_FULL_LISTING_KEY] = full_listing.isoformat().encode()
+    table = table.replace_schema_metadata(metadata)
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _list_shard(storage, prefix):
+    return [dict(blob, prefix=prefix) for blob in storage.list(prefix)]
+
+
+def _list_all(storage, shards):
+    """
+    List the whole bucket, every file is assigned to its shard.
+
+    Returns:
+        tuple: (files of the shards, names that match no shard).
+    """
+    shards = set(shards)
+    lengths = sorted({len(prefix) for prefix in shards})
+
+    listed = []
+    unmatched = []
+    for blob in storage.list(""):
+        name = blob["name"]
+        prefix = next((name[:n] for n in lengths if name[:n] in shards), None)
+        if prefix is None:
+            unmatched.append(name)
+        else:
+            listed.append(dict(blob, prefix=prefix))
+
+    return listed, unmatched
+
+
+def manifest_diff(manifest, reference):
+    """
+    Rows of a manifest that are not in a reference manifest, or with another generation.
+
+    Args:
+        manifest (pd.DataFrame): The manifest (e.g. the bucket).
+        reference (pd.DataFrame): The reference (e.g. the files already downloaded).
+
+    Returns:
+        pd.DataFrame: The new or changed rows of manifest.
+    """
+    merged = manifest.merge(
+        reference[["name", "generation"]].rename(columns={"generation": "reference_generation"}),
+        on="name",
+        how="left",
+    )
+    changed = merged["reference_generation"].isna() | (
+        merged["generation"] != merged["reference_generation"]
+    )
+    return manifest[changed.to_numpy()]
+
+
+def update_manifest(
+    storage,
+    path,
+    products,
+    start,
+    end=None,
+    num_workers=16,
+    relist_days=2,
+    full_relist_days=None,
+):
+    """
+    Update (or create) the manifest of a bucket by listing the shards that may have changed.
+
+    The whole bucket is listed instead (one stream, every shard refreshed and the
+    names that match no shard logged) if relist_days is None, or if the last full
+    listing is older than full_relist_days days.
+
+    Args:
+        storage (Storage): The storage (see meteolibre_dataset.storage.open_storage).
+        path (str): Path of the Parquet manifest.
+        products (list): Product prefixes (e.g. "T_IPRN20_C_LFPW_").
+        start (datetime.date): First day listed.
+        end (datetime.date, optional): Last day listed. Defaults to today (UTC).
+        num_workers (int, optional): Number of listing threads. Defaults to 16.
+        relist_days (int, optional): The shards of the last relist_days days are always
+                                     listed again, None to list the whole bucket. Defaults to 2.
+        full_relist_days (int, optional): The whole bucket is listed again when the last
+                                          full listing is older than full_relist_days days,
+                                          None to never do it. Defaults to None.
+
+    Returns:
+        tuple: A tuple containing:
+            - df (pd.DataFrame): The manifest, sorted by date (name, size, generation, date, prefix).
+            - added (pd.DataFrame): Rows new or with a new generation since the last run.
+            - removed (pd.DataFrame): Rows no longer in the bucket.
+    """
+    if end is None:
+        end = datetime.datetime.now(datetime.timezone.utc).date()
+
+    previous, known_shards = load_manifest(path)
+    known_shards = set(known_shards)
+    full_listing = last_full_listing(path)
+
+    shards = time_prefixes(products, start, end)
+
+    full = relist_days is None or (
+        full_relist_days is not None
+        and (full_listing is None or (end - full_listing).days >= full_relist_days)
+    )
+    if full:
+        to_list = shards
+        listed, unmatched = _list_all(storage, shards)
+        full_listing = end
+        print(f"Full listing of the bucket: {len(unmatched)} files match no shard.")
+        if unmatched:
+            print("\n".join(unmatched[:_NB_LOGGED_NAMES]))
+            if len(unmatched) > _NB_LOGGED_NAMES:
+                print(f"... and {len(unmatched) - _NB_LOGGED_NAMES} more")
+    else:
+        recent = set(
+            time_prefixes(products, pd.Timestamp(end) - pd.Timedelta(days=relist_days), end)
+        )
+        to_list = [p for p in shards if p not in known_shards or p in recent]
+
+        listed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for blobs in executor.map(lambda p: _list_shard(storage, p), to_list):
+                listed += blobs
+
+    df_listed = pd.DataFrame(listed, columns=["name", "size", "generation", "prefix"])
+    df_listed["date"] = pd.to_datetime(
+        df_listed["name"].str.extract(DATE_PATTERN)[0], format=DATE_FORMAT, errors="coerce"
+    )
+
+    # shards not listed again: rows from the previous manifest
+    to_list_set = set(to_list)
+    kept = previous[~previous["prefix"].isin(to_list_set)]
+    df = pd.concat([kept, df_listed], ignore_index=True)
+    df = df.sort_values(["date", "name"], ignore_index=True)
+
+    previous_listed = previous[previous["prefix"].isin(to_list_set)]
+    added = manifest_diff(df_listed, previous_listed)
+    removed = previous_listed[~previous_listed["name"].isin(df_listed["name"])]
+
+    print(
+        f"Manifest of the bucket: {len(df)} files, {len(to_list)} / {len(shards)} shards listed, "
+        f"{len(added)} new or changed, {len(removed)} removed."
+    )
+
+    save_manifest(df, path, known_shards | set(shards), full_listing=full_listing)
+
+    return df, added, removed
@@ -0,0 +1,267 @@
+"""
+Module to compute the normalisation statistics (mean, std) of the ground station channels.
+
+The statistics are computed in one streaming pass over the Parquet file (batches
+of rows, never the whole table in memory): the count, mean and sum of squared
+deviations of every batch are merged into the running ones with the parallel
+form of Welford's algorithm (Chan et al.), which is numerically stable and lets
+partial results be merged.
+
+They can be computed for the whole data, per month or per station, and are saved
+next to the dataset (groundstation_npz/groundstation_stats.parquet) with the
+version of the data they come from (size and mtime of the source file), so they
+are only recomputed when the data changes. The normalisation itself is applied at
+rasterisation time, on the rows of one timestamp, instead of on a copy of the table.
+"""
+
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+STATS_FILE = "groundstation_stats.parquet"
+GROUP_BY = (None, "month", "station")
+
+_VERSION_KEY = b"version"
+
+
+class ChannelStats:
+    """
+    Running count, mean and sum of squared deviations (M2) of every channel (NaN ignored).
+
+    Args:
+        nb_channels (int): Number of channels.
+    """
+
+    def __init__(self, nb_channels):
+        self.count = np.zeros(nb_channels, dtype=np.int64)
+        self.mean = np.zeros(nb_channels, dtype=np.float64)
+        self.m2 = np.zeros(nb_channels, dtype=np.float64)
+
+    def merge_moments(self, count, mean, m2):
+        """
+        Merge the moments of another set of values (parallel Welford update).
+        """
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(total > 0, count / total, 0.0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + m2 + delta**2 * self.count * ratio
+        self.count = total
+
+    def merge(self, other):
+        """
+        Merge another ChannelStats.
+        """
+        self.merge_moments(other.count, other.mean, other.m2)
+
+    def update(self, values):
+        """
+        Add values.
+
+        Args:
+            values (np.ndarray): Values of shape (N, nb_channels), NaN for the missing ones.
+        """
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        mean = np.nansum(values, axis=0, dtype=np.float64) / np.maximum(count, 1)
+        m2 = np.nansum((values - mean) ** 2, axis=0, dtype=np.float64)
+        self.merge_moments(count, mean, m2)
+
+    @property
+    def std(self):
+        """
+        Standard deviation (ddof=1, as the polars std).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self.m2 / (self.count - 1))
+
+
+def group_keys(batch, group_by):
+    """
+    Group key of every row of a batch.
+
+    Args:
+        batch (pa.RecordBatch): Rows with a datetime (month) or NUM_POSTE (station) column.
+        group_by (str): None, "month" or "station".
+
+    Returns:
+        np.ndarray: Keys (YYYYMM for the months, station number for the stations), None for
+                    group_by None.
+    """
+    if group_by is None:
+        return None
+    if group_by == "month":
+        datetimes = batch.column("datetime")
+        return (
+            pc.year(datetimes).to_numpy().astype(np.int64) * 100
+            + pc.month(datetimes).to_numpy()
+        )
+    if group_by == "station":
+        return batch.column("NUM_POSTE").to_numpy()
+    raise ValueError(f"Unknown group_by {group_by}, expected one of {GROUP_BY}")
+
+
+def _group_sums(inverse, values, nb_groups):
+    # per group sum of every channel, values of shape (N, nb_channels)
+    return np.stack(
+        [np.bincount(inverse, weights=values[:, c], minlength=nb_groups) for c in range(values.shape[1])],
+        axis=1,
+    )
+
+
+def compute_channel_stats(path, columns, group_by=None, batch_size=1 << 20):
+    """
+    Compute the statistics of channels in one streaming pass over a Parquet file.
+
+    Args:
+        path (str): Path of the Parquet file.
+        columns (list): Channel columns.
+        group_by (str, optional): None (whole data), "month" or "station". Defaults to None.
+        batch_size (int, optional): Rows per batch. Defaults to 1 << 20.
+
+    Returns:
+        dict: Group key -> ChannelStats, with the key None for the whole data.
+    """
+    key_columns = {None: [], "month": ["datetime"], "station": ["NUM_POSTE"]}[group_by]
+
+    stats = {}
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns + key_columns):
+        values = np.stack(
+            [batch.column(col).to_numpy(zero_copy_only=False) for col in columns], axis=1
+        ).astype(np.float64)
+        stats.setdefault(None, ChannelStats(len(columns))).update(values)
+
+        keys = group_keys(batch, group_by)
+        if keys is None:
+            continue
+
+        # moments of every group of the batch at once
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        nb_groups = len(unique_keys)
+
+        count = _group_sums(inverse, valid, nb_groups).astype(np.int64)
+        mean = _group_sums(inverse, filled, nb_groups) / np.maximum(count, 1)
+        deviations = np.where(valid, values - mean[inverse], 0.0) ** 2
+        m2 = _group_sums(inverse, deviations, nb_groups)
+
+        for g, key in enumerate(unique_keys.tolist()):
+            stats.setdefault(key, ChannelStats(len(columns))).merge_moments(
+                count[g], mean[g], m2[g]
+            )
+
+    return stats
+
+
+def data_version(path):
+    """
+    Version of a data file (size and mtime), stored with the statistics computed from it.
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def save_channel_stats(stats, columns, path, version=""):
+    """
+    Save statistics (one row per group and channel: key, channel, count, mean, std).
+
+    Args:
+        stats (dict): Group key -> ChannelStats.
+        columns (list): Channel columns.
+        path (str): Path of the Parquet file.
+        version (str, optional): Version of the data (see data_version). Defaults to "".
+    """
+    keys = list(stats)
+    table = pa.table(
+        {
+            "key": pa.array([key for key in keys for _ in columns], type=pa.int64()),
+            "channel": [col for _ in keys for col in columns],
+            "count": np.concatenate([stats[key].count for key in keys]),
+            "mean": np.concatenate([stats[key].mean for key in keys]),
+            "std": np.concatenate([stats[key].std for key in keys]),
+        }
+    )
+    table = table.replace_schema_metadata({_VERSION_KEY: version.encode()})
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def load_channel_stats(path, columns, version=None):
+    """
+    Load statistics saved with save_channel_stats.
+
+    Args:
+        path (str): Path of the Parquet file.
+        columns (list): Channel columns (order of the returned arrays).
+        version (str, optional): Expected version of the data, None to skip the check.
+
+    Returns:
+        dict: Group key -> (mean, std) arrays of shape (nb_channels,), or None if the file
+              does not exist or was computed from another version of the data.
+    """
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if version is not None and metadata.get(_VERSION_KEY, b"").decode() != version:
+        return None
+
+    df = pq.read_table(path).to_pandas()
+    stats = {}
+    for key, group in df.groupby("key", dropna=False, sort=False):
+        group = group.set_index("channel").loc[columns]
+        key = None if key is None or key != key else int(key)
+        stats[key] = (group["mean"].to_numpy(), group["std"].to_numpy())
+    return stats
+
+
+def normalization_table(stats):
+    """
+    Lookup table of the statistics, for normalization_arrays.
+
+    Args:
+        stats (dict): Group key -> (mean, std), from load_channel_stats.
+
+    Returns:
+        tuple: A tuple containing:
+            - keys (np.ndarray): Sorted group keys (int64).
+            - means (np.ndarray): Mean of every key (nb_keys + 1, nb_channels), row 0 for
+                                  the whole data and row k + 1 for keys[k].
+            - stds (np.ndarray): Std of every key, same layout.
+    """
+    keys = np.array(sorted(key for key in stats if key is not None), dtype=np.int64)
+    rows = [stats[None]] + [stats[key] for key in keys.tolist()]
+    return keys, np.stack([m for m, _ in rows]), np.stack([s for _, s in rows])
+
+
+def normalization_arrays(table, keys):
+    """
+    Mean and std of every row, from its group (rows of an unknown group use the whole data).
+
+    The rows are matched to their group by a binary search in the sorted keys
+    (np.searchsorted) and the statistics gathered with one indexing per array.
+
+    Args:
+        table (tuple): Lookup table of the statistics, from normalization_table.
+        keys (np.ndarray): Group key of every row, None for the whole data.
+
+    Returns:
+        tuple: mean and std arrays of shape (nb_rows, nb_channels), or (1, nb_channels)
+               for the whole data.
+    """
+    sorted_keys, means, stds = table
+    if keys is None or len(keys) == 0:
+        return means[:1], stds[:1]
+
+    keys = np.asarray(keys, dtype=np.int64)
+    positions = np.searchsorted(sorted_keys, keys)
+    found = positions < len(sorted_keys)
+    found[found] = sorted_keys[positions[found]] == keys[found]
+    rows = np.where(found, positions + 1, 0)
+
+    return means[rows], stds[rows]
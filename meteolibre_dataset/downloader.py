@@ -0,0 +1,54 @@
+"""
+Module to download many files from a bucket concurrently.
+
+- one storage (and client) is used for the whole run (credentials resolved once,
+  HTTP connection pool sized for the number of workers) instead of one per file.
+- the files are downloaded by a thread pool, with retries and exponential backoff.
+- every file is downloaded under a temporary name and renamed once complete, so
+  an interrupted run never leaves a truncated file behind.
+- the files already downloaded are found with a single listing of the output
+  directory instead of one os.path.exists per file.
+
+The files come from any storage of meteolibre_dataset.storage, so the downloader
+can run against a local directory as well as GCS.
+"""
+
+import os
+
+
+def download_files(storage, names, output_dir, num_workers=16, overwrite=False):
+    """
+    Download files into a directory concurrently (files already present are skipped,
+    unless overwrite is True).
+
+    Args:
+        storage (Storage): The storage (see meteolibre_dataset.storage.open_storage).
+        names (list): Names of the files in the storage, saved as output_dir/basename(name).
+        output_dir (str): Output directory.
+        num_workers (int, optional): Number of download threads. Defaults to 16.
+        overwrite (bool, optional): Download the files even if present (e.g. names from
+                                    a manifest diff, with a new generation). Defaults to False.
+
+    Returns:
+        tuple: A tuple containing:
+            - nb_downloaded (int): Number of files downloaded.
+            - failed (list): List of (name, error) of the files that could not be downloaded.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    # one listing of the output directory instead of one exists() per file
+    existing = set()
+    if not overwrite:
+        with os.scandir(output_dir) as entries:
+            existing = {entry.name for entry in entries}
+    todo = [name for name in names if os.path.basename(name) not in existing]
+
+    print(f"{len(todo)} files to download ({len(names) - len(todo)} already present).")
+
+    failed = storage.get_many(
+        todo,
+        [os.path.join(output_dir, os.path.basename(name)) for name in todo],
+        num_workers=num_workers,
+    )
+
+    return len(todo) - len(failed), failed
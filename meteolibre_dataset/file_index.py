@@ -0,0 +1,192 @@
+"""
+Module to keep an incremental, persisted index of the files of a data directory.
+
+The data directories (h5/, groundstation_npz/) reach hundreds of thousands of
+files, listing them and parsing every name again at each run is slow. Here:
+
+- the directory tree is scanned with os.scandir, level by level, the directories
+  of a level in parallel.
+- the index (relative path, size, mtime and datetime parsed from the name) is
+  persisted as a Parquet file, with the mtime of every scanned directory.
+- on re-run, a directory whose mtime did not change is not listed again (its
+  files are taken from the persisted index), and only the new files of a listed
+  directory are stat'ed and have their name parsed (files are written under a
+  temporary name and renamed by the download scripts, which updates the mtime of
+  their directory).
+"""
+
+import os
+import json
+import concurrent.futures
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATE_PATTERN = r"(\d{12})"
+DATE_FORMAT = "%Y%m%d%H%M"
+
+FILE_INDEX_SCHEMA = pa.schema(
+    [
+        pa.field("file_path", pa.string()),
+        pa.field("directory", pa.string()),
+        pa.field("size", pa.int64()),
+        pa.field("mtime_ns", pa.int64()),
+        pa.field("datetime", pa.timestamp("ms")),
+    ]
+)
+
+_DIRECTORIES_KEY = b"directories"
+
+
+def _scan_directory(root, relative_dir, suffix, known):
+    """
+    List a directory with os.scandir, only the files not in known are stat'ed.
+
+    Args:
+        known (dict): Relative path -> (size, mtime_ns) of the files already indexed.
+
+    Returns:
+        tuple: (files [(relative path, directory, size, mtime_ns)], subdirectories).
+    """
+    directory = os.path.join(root, relative_dir)
+
+    files = []
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(os.path.normpath(os.path.join(relative_dir, entry.name)))
+            elif entry.name.endswith(suffix):
+                file_path = os.path.normpath(os.path.join(relative_dir, entry.name))
+                if file_path in known:
+                    size, mtime_ns = known[file_path]
+                else:
+                    stat = entry.stat()
+                    size, mtime_ns = stat.st_size, stat.st_mtime_ns
+                files.append((file_path, relative_dir, size, mtime_ns))
+
+    return files, subdirectories
+
+
+def load_file_index(index_path):
+    """
+    Load a file index saved with update_file_index.
+
+    Args:
+        index_path (str): Path of the Parquet file index.
+
+    Returns:
+        tuple: A tuple containing:
+            - df (pd.DataFrame): The file index (empty if the file does not exist).
+            - directories (dict): Relative directory -> mtime_ns at the last scan.
+    """
+    if not os.path.exists(index_path):
+        return FILE_INDEX_SCHEMA.empty_table().to_pandas(), {}
+
+    table = pq.read_table(index_path, schema=FILE_INDEX_SCHEMA)
+    metadata = pq.read_schema(index_path).metadata or {}
+    directories = json.loads(metadata.get(_DIRECTORIES_KEY, b"{}"))
+
+    return table.to_pandas(), directories
+
+
+def update_file_index(root, suffix, index_path, num_workers=8, date_pattern=DATE_PATTERN):
+    """
+    Update (or create) the persisted index of the files of a directory tree.
+
+    Args:
+        root (str): Root data directory to scan (e.g. ../data/h5).
+        suffix (str): Suffix of the indexed files (e.g. ".h5").
+        index_path (str): Path of the Parquet file index.
+        num_workers (int, optional): Number of scanning threads. Defaults to 8.
+        date_pattern (str, optional): Regex with one group capturing the YYYYmmddHHMM
+                                      datetime in the file names. Defaults to DATE_PATTERN.
+
+    Returns:
+        pd.DataFrame: The file index, one row per file (file_path relative to root,
+                      directory, size, mtime_ns, datetime parsed from the name).
+    """
+    cached, known_directories = load_file_index(index_path)
+    cached_by_directory = {d: group for d, group in cached.groupby("directory")}
+
+    def scan(relative_dir):
+        group = cached_by_directory.get(relative_dir)
+        known = (
+            {}
+            if group is None
+            else dict(
+                zip(group["file_path"], zip(group["size"].tolist(), group["mtime_ns"].tolist()))
+            )
+        )
+        return _scan_directory(root, relative_dir, suffix, known)
+
+    frames = []
+    scanned = []
+    directories = {}
+    nb_listed = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        level = ["."]
+        while level:
+            # the mtime is read before listing, so a file added during the scan
+            # makes the directory listed again at the next run
+            mtimes = executor.map(lambda d: os.stat(os.path.join(root, d)).st_mtime_ns, level)
+
+            to_scan = []
+            next_level = []
+            for relative_dir, mtime in zip(level, mtimes):
+                directories[relative_dir] = mtime
+                if known_directories.get(relative_dir) != mtime:
+                    to_scan.append(relative_dir)
+                    continue
+
+                # unchanged directory: files and subdirectories from the cache
+                if relative_dir in cached_by_directory:
+                    frames.append(cached_by_directory[relative_dir])
+                parent = "" if relative_dir == "." else relative_dir
+                next_level += [
+                    d for d in known_directories if d != "." and os.path.dirname(d) == parent
+                ]
+
+            for files, subdirectories in executor.map(scan, to_scan):
+                scanned += files
+                next_level += subdirectories
+            nb_listed += len(to_scan)
+
+            level = [d for d in next_level if os.path.isdir(os.path.join(root, d))]
+
+    # files of the listed directories: the datetime is parsed for the new files only
+    # int64 even when no file was scanned (an empty frame would give object columns)
+    df_scanned = pd.DataFrame(scanned, columns=FILE_INDEX_SCHEMA.names[:4]).astype(
+        {"size": "int64", "mtime_ns": "int64"}
+    )
+    df_scanned = df_scanned.merge(
+        cached[["file_path", "datetime"]], on="file_path", how="left"
+    )
+    new = df_scanned["datetime"].isna()
+    df_scanned.loc[new, "datetime"] = pd.to_datetime(
+        df_scanned.loc[new, "file_path"].map(os.path.basename).str.extract(date_pattern)[0],
+        format=DATE_FORMAT,
+        errors="raise",
+    )
+    frames.append(df_scanned)
+
+    df = pd.concat(frames, ignore_index=True)
+    df["datetime"] = pd.to_datetime(df["datetime"])
+
+    print(
+        f"File index of {root}: {len(df)} files ({int(new.sum())} new), "
+        f"{nb_listed} / {len(directories)} directories listed."
+    )
+
+    table = pa.Table.from_pandas(
+        df[FILE_INDEX_SCHEMA.names], schema=FILE_INDEX_SCHEMA, preserve_index=False
+    )
+    table = table.replace_schema_metadata(
+        {_DIRECTORIES_KEY: json.dumps(directories).encode()}
+    )
+    pq.write_table(table, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+    return df
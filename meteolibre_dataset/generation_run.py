@@ -0,0 +1,168 @@
+"""
+Module to make the HF dataset generation deterministic and resumable.
+
+- every (datetime, pass) gets its own random generator derived from the run seed,
+  so a sample does not depend on the order in which the threads process the data,
+  nor on its row in index.parquet (rebuilt incrementally, rows shift when gaps are
+  backfilled).
+- sample ids are derived from the datetime of the data point and the pass number,
+  so two runs (or two machines) with the same seed produce the same ids.
+- a completion journal records the datetimes already written, so a restarted run
+  skips them. Its first line is a hash of the seed and of the sampling configuration
+  of the run, a run with another configuration refuses to resume it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+JOURNAL_FILE = "journal.txt"
+
+_CONFIG_PREFIX = "# config "
+
+
+def datetime_key(data_datetime):
+    """
+    Key of a data point in the journal and in the random generators (e.g. 202501031200).
+    """
+    return data_datetime.strftime("%Y%m%d%H%M")
+
+
+def sample_rng(seed, data_datetime, pass_index):
+    """
+    Get the random generator of a (datetime, pass).
+
+    Args:
+        seed (int): Seed of the generation run.
+        data_datetime (datetime.datetime): Datetime of the data point.
+        pass_index (int): Pass number for this datetime.
+
+    Returns:
+        np.random.Generator: The random generator.
+    """
+    return np.random.default_rng([seed, int(datetime_key(data_datetime)), int(pass_index)])
+
+
+def config_hash(config):
+    """
+    Hash of the configuration of a generation run (seed, sampling parameters).
+
+    Args:
+        config (dict): JSON serialisable configuration.
+
+    Returns:
+        str: Hex digest of the configuration.
+    """
+    encoded = json.dumps(config, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def sample_id(data_datetime, pass_index):
+    """
+    Get the deterministic id of a sample.
+
+    Args:
+        data_datetime (datetime.datetime): Datetime of the data point.
+        pass_index (int): Pass number for this time index.
+
+    Returns:
+        str: The sample id (e.g. 202501031200_03).
+    """
+    return data_datetime.strftime("%Y%m%d%H%M") + f"_{pass_index:02d}"
+
+
+def index_permutation(seed, start, end):
+    """
+    Get the processing order of the time indices of a run.
+
+    Args:
+        seed (int): Seed of the generation run.
+        start (int): First time index (inclusive).
+        end (int): Last time index (exclusive).
+
+    Returns:
+        np.ndarray: The shuffled time indices.
+    """
+    return np.random.default_rng(seed).permutation(np.arange(start, end))
+
+
+class GenerationJournal:
+    """
+    Append only journal of the datetimes already processed by a generation run.
+
+    Args:
+        save_dir (str): Directory of the generated dataset.
+        config (dict): Configuration of the run (seed, sampling parameters), see config_hash.
+
+    Raises:
+        ValueError: If the journal was written by a run with another configuration.
+    """
+
+    def __init__(self, save_dir, config):
+        self.path = os.path.join(save_dir, JOURNAL_FILE)
+        self.lock = threading.Lock()
+        self.completed = set()
+        self.config_hash = config_hash(config)
+
+        lines = []
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                lines = [line.strip() for line in f if line.strip()]
+
+        if not lines:
+            # new run
+            with open(self.path, "w") as f:
+                f.write(f"{_CONFIG_PREFIX}{self.config_hash}\n")
+            return
+
+        if lines[0] != f"{_CONFIG_PREFIX}{self.config_hash}":
+            raise ValueError(
+                f"{self.path} was written by a run with another seed / configuration "
+                f"({lines[0]}, expected {_CONFIG_PREFIX}{self.config_hash}), "
+                "use another output directory or remove it to start a new run"
+            )
+        self.completed = set(lines[1:])
+
+    def is_done(self, data_datetime):
+        """
+        Check if a datetime has already been processed.
+        """
+        return datetime_key(data_datetime) in self.completed
+
+    def mark_done(self, data_datetime):
+        """
+        Record that a datetime has been processed (flushed to disk).
+        """
+        key = datetime_key(data_datetime)
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(f"{key}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.completed.add(key)
+
+    def commit_callback(self, data_datetime, nb_writers=1):
+        """
+        Get the on_commit callback of a datetime written by several writers (e.g. one
+        per output resolution): the datetime is recorded once all of them committed it.
+
+        Args:
+            data_datetime (datetime.datetime): Datetime of the data point.
+            nb_writers (int, optional): Number of writers of the datetime. Defaults to 1.
+
+        Returns:
+            callable: The callback, to give to every writer.
+        """
+        remaining = [nb_writers]
+
+        def on_commit():
+            with self.lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                self.mark_done(data_datetime)
+
+        return on_commit
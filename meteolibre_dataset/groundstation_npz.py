@@ -0,0 +1,403 @@
+"""
+Module with the engine writing the ground station NPZ files (one image per timestamp).
+
+For every timestamp, the measurements of the stations are normalised and rasterised
+on the radar grid (3472 x 3472 pixels of 500 m, nodata -100, see
+meteolibre_dataset.station_raster) and saved as ground_stations_YYYYmmddHHMM.npz.
+The normalised rows of a timestamp come from StationFrames, also used to rasterise
+the crops on the fly during the dataset generation. The engine:
+
+- loads the station data once, sorted by datetime, so the rows of a timestamp are a
+  slice (no filter over the whole table per timestamp),
+- takes its time axis from the station data (or an explicit range and frequency,
+  see time_axis), so it does not depend on the radar files being downloaded,
+- loads (or computes in one streaming pass) the normalisation statistics, see
+  meteolibre_dataset.channel_stats,
+- runs the rasterisation + compression tasks with a pluggable executor: "serial",
+  "thread" (ThreadPoolExecutor) or "process" (ProcessPoolExecutor, the tasks only
+  receive the numpy arrays of their rows),
+- reports the time spent per task phase (prepare, rasterize, save), so the
+  executors can be compared on the same workload.
+
+The files are written under a temporary name and renamed once complete, the
+timestamps whose file already exists are skipped.
+"""
+
+import os
+import time
+import concurrent.futures
+
+import numpy as np
+import polars as pl
+from tqdm import tqdm
+
+from meteolibre_dataset.channel_stats import (
+    STATS_FILE,
+    compute_channel_stats,
+    data_version,
+    load_channel_stats,
+    normalization_arrays,
+    normalization_table,
+    save_channel_stats,
+)
+from meteolibre_dataset.station_raster import rasterize_stations
+
+EXECUTORS = ("serial", "thread", "process")
+
+
+def npz_file_name(data_datetime):
+    """
+    Name of the NPZ file of a timestamp (ground_stations_YYYYmmddHHMM.npz).
+    """
+    return "ground_stations_" + data_datetime.strftime("%Y%m%d%H%M") + ".npz"
+
+
+def write_station_npz(path, position_x, position_y, measurements, raster_options):
+    """
+    Rasterise and save the NPZ file of one timestamp (task of the executors).
+
+    Args:
+        path (str): Path of the NPZ file.
+        position_x (np.ndarray): Column of every station in the grid.
+        position_y (np.ndarray): Row of every station in the grid.
+        measurements (np.ndarray): Normalised measurements (nb_stations, nb_channels).
+        raster_options (dict): Parameters of meteolibre_dataset.station_raster.rasterize_stations.
+
+    Returns:
+        dict: Duration of the rasterize and save phases in seconds.
+    """
+    start = time.perf_counter()
+    image = rasterize_stations(position_x, position_y, measurements, **raster_options)
+    rasterized = time.perf_counter()
+
+    # NPZ files are more efficient than HDF5 files where handling sparse data
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, image=image)
+    os.replace(path + ".tmp", path)
+
+    return {"rasterize": rasterized - start, "save": time.perf_counter() - rasterized}
+
+
+def time_axis(station_datetimes, start=None, end=None, frequency=None, intersect_with=None):
+    """
+    Timestamps of the NPZ files.
+
+    Args:
+        station_datetimes (np.ndarray): Sorted distinct datetimes of the station data.
+        start (datetime.datetime, optional): First timestamp. Defaults to the first station datetime.
+        end (datetime.datetime, optional): Last timestamp. Defaults to the last station datetime.
+        frequency (str, optional): Frequency of the timestamps (polars duration, e.g. "30m"), None for the
+                                   datetimes of the station data. Defaults to None.
+        intersect_with (list, optional): Only keep these timestamps (e.g. the datetimes of an
+                                         index). Defaults to None.
+
+    Returns:
+        list: The timestamps (datetime.datetime), sorted.
+    """
+    datetimes = pl.Series("datetime", station_datetimes)
+    if len(datetimes) == 0:
+        return []
+
+    start = start if start is not None else datetimes[0]
+    end = end if end is not None else datetimes[-1]
+
+    if frequency is None:
+        datetimes = datetimes.filter((datetimes >= start) & (datetimes <= end))
+    else:
+        datetimes = pl.datetime_range(start, end, frequency, eager=True, time_unit="us")
+
+    if intersect_with is not None:
+        datetimes = datetimes.filter(
+            datetimes.is_in(pl.Series(intersect_with).cast(datetimes.dtype))
+        )
+
+    return datetimes.to_list()
+
+
+class TimingReport:
+    """
+    Per task timings of a run of the NPZ writer.
+
+    Args:
+        executor (str): Name of the executor.
+        num_workers (int): Number of workers.
+    """
+
+    PHASES = ("prepare", "rasterize", "save")
+
+    def __init__(self, executor, num_workers):
+        self.executor = executor
+        self.num_workers = num_workers
+        self.timings = {phase: [] for phase in self.PHASES}
+        self.written = 0
+        self.skipped = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def add(self, timings):
+        self.written += 1
+        for phase, duration in timings.items():
+            self.timings[phase].append(duration)
+
+    def report(self):
+        """
+        Get the report of the run (one line per phase).
+
+        Returns:
+            str: The report.
+        """
+        lines = [
+            f"NPZ writing ({self.executor}, {self.num_workers} workers) in {self.elapsed:.1f}s: "
+            f"{self.written} written, {self.skipped} skipped, {self.errors} errors, "
+            f"{self.written / max(self.elapsed, 1e-9):.2f} files/s"
+        ]
+        for phase in self.PHASES:
+            durations = np.array(self.timings[phase])
+            if len(durations) == 0:
+                continue
+            lines.append(
+                f"{phase:>10s}: total {durations.sum():.1f}s, mean {durations.mean() * 1000:.1f}ms, "
+                f"p50 {np.percentile(durations, 50) * 1000:.1f}ms, "
+                f"p95 {np.percentile(durations, 95) * 1000:.1f}ms, max {durations.max() * 1000:.1f}ms"
+            )
+        return "\n".join(lines)
+
+
+class StationFrames:
+    """
+    Normalised station measurements of every timestamp.
+
+    Args:
+        groundstations_info_path (str): Path to the Parquet file containing ground station information.
+        stats_dir (str): Directory of the normalisation statistics (the NPZ directory).
+        columns_measurements (list): Measurement columns (channels of the images).
+        columns_positions (list, optional): Position columns. Defaults to ["position_x", "position_y"].
+        stats_group_by (str, optional): Normalisation statistics of the whole data (None), per
+                                        "month" or per "station". Defaults to None.
+    """
+
+    def __init__(
+        self,
+        groundstations_info_path,
+        stats_dir,
+        columns_measurements,
+        columns_positions=("position_x", "position_y"),
+        stats_group_by=None,
+    ):
+        self.groundstations_info_path = groundstations_info_path
+        self.stats_dir = stats_dir
+        self.columns_measurements = list(columns_measurements)
+        self.columns_positions = list(columns_positions)
+        self.stats_group_by = stats_group_by
+
+        os.makedirs(stats_dir, exist_ok=True)
+        self.stats = self.load_stats()
+        self.normalization = normalization_table(self.stats)
+        self._load_stations()
+
+    def load_stats(self):
+        """
+        Load the normalisation statistics saved with the npz files, computed in one streaming
+        pass (and saved) if missing or computed from another version of the station data.
+
+        Returns:
+            dict: Group key -> (mean, std) arrays (key None for the whole data).
+        """
+        stats_path = os.path.join(self.stats_dir, STATS_FILE)
+        version = f"{data_version(self.groundstations_info_path)}-{self.stats_group_by}"
+
+        stats = load_channel_stats(stats_path, self.columns_measurements, version)
+        if stats is None:
+            print("Computing the normalisation statistics...")
+            save_channel_stats(
+                compute_channel_stats(
+                    self.groundstations_info_path, self.columns_measurements, self.stats_group_by
+                ),
+                self.columns_measurements,
+                stats_path,
+                version,
+            )
+            stats = load_channel_stats(stats_path, self.columns_measurements)
+
+        mean, std = stats[None]
+        print("Mean / std of the measurements:")
+        for col, m, sd in zip(self.columns_measurements, mean, std):
+            print(f"  {col}: {m:.3f} / {sd:.3f}")
+
+        return stats
+
+    def _load_stations(self):
+        key_columns = ["NUM_POSTE"] if self.stats_group_by == "station" else []
+        df = pl.read_parquet(
+            self.groundstations_info_path,
+            columns=self.columns_measurements + self.columns_positions + ["datetime"] + key_columns,
+        ).sort("datetime")
+
+        print("\nFirst few rows of ground station info:")
+        print(df.head())
+
+        # the rows of a timestamp are the slice [start, end) of the sorted arrays
+        self.datetimes = df["datetime"].to_numpy()
+        self.position_x = df[self.columns_positions[0]].to_numpy().astype(np.int64)
+        self.position_y = df[self.columns_positions[1]].to_numpy().astype(np.int64)
+        self.measurements = df[self.columns_measurements].to_numpy().astype(np.float32)
+
+        if self.stats_group_by == "month":
+            self.keys = (df["datetime"].dt.year() * 100 + df["datetime"].dt.month()).to_numpy()
+        elif self.stats_group_by == "station":
+            self.keys = df["NUM_POSTE"].to_numpy()
+        else:
+            self.keys = None
+
+    def station_datetimes(self):
+        """
+        Sorted distinct datetimes of the station data.
+
+        Returns:
+            np.ndarray: The datetimes.
+        """
+        return np.unique(self.datetimes)
+
+    def rows(self, data_datetime):
+        """
+        Positions and normalised measurements of the stations at a timestamp.
+
+        Args:
+            data_datetime (datetime.datetime): The timestamp.
+
+        Returns:
+            tuple: (position_x, position_y, measurements (nb_stations, nb_channels)).
+        """
+        key = np.datetime64(data_datetime, "us").astype(self.datetimes.dtype)
+        start = np.searchsorted(self.datetimes, key, side="left")
+        end = np.searchsorted(self.datetimes, key, side="right")
+
+        keys = self.keys[start:end] if self.keys is not None else None
+        mean, std = normalization_arrays(self.normalization, keys)
+        measurements = ((self.measurements[start:end] - mean) / std).astype(np.float32)
+
+        return self.position_x[start:end], self.position_y[start:end], measurements
+
+
+class GroundStationNpzWriter(StationFrames):
+    """
+    Engine writing the ground station NPZ files.
+
+    Args:
+        groundstations_info_path (str): Path to the Parquet file containing ground station information.
+        dir_npz (str): Directory of the NPZ files (and of the normalisation statistics).
+        columns_measurements (list): Measurement columns (channels of the images).
+        columns_positions (list, optional): Position columns. Defaults to ["position_x", "position_y"].
+        stats_group_by (str, optional): Normalisation statistics of the whole data (None), per
+                                        "month" or per "station". Defaults to None.
+        raster_options (dict, optional): Parameters of station_raster.rasterize_stations
+                                         (reduction, splat, radius, sigma). Defaults to None
+                                         (mean of the stations of every pixel).
+    """
+
+    def __init__(
+        self,
+        groundstations_info_path,
+        dir_npz,
+        columns_measurements,
+        columns_positions=("position_x", "position_y"),
+        stats_group_by=None,
+        raster_options=None,
+    ):
+        super().__init__(
+            groundstations_info_path,
+            dir_npz,
+            columns_measurements,
+            columns_positions,
+            stats_group_by,
+        )
+        self.dir_npz = dir_npz
+        self.raster_options = dict(raster_options or {})
+
+    def task_arguments(self, data_datetime):
+        """
+        Arguments of write_station_npz for a timestamp (rows of the timestamp, normalised).
+
+        Args:
+            data_datetime (datetime.datetime): The timestamp.
+
+        Returns:
+            tuple: (path, position_x, position_y, measurements, raster_options).
+        """
+        return (
+            os.path.join(self.dir_npz, npz_file_name(data_datetime)),
+            *self.rows(data_datetime),
+            self.raster_options,
+        )
+
+    def run(self, datetimes, executor="thread", num_workers=None):
+        """
+        Write the NPZ files of timestamps (the existing files are skipped).
+
+        Args:
+            datetimes (list): Timestamps (datetime.datetime).
+            executor (str, optional): "serial", "thread" or "process". Defaults to "thread".
+            num_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+
+        Returns:
+            TimingReport: The timings of the run.
+        """
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor}, expected one of {EXECUTORS}")
+        if num_workers is None:
+            num_workers = 1 if executor == "serial" else os.cpu_count()
+
+        report = TimingReport(executor, num_workers)
+        start = time.perf_counter()
+
+        def tasks():
+            for data_datetime in datetimes:
+                if os.path.exists(os.path.join(self.dir_npz, npz_file_name(data_datetime))):
+                    report.skipped += 1
+                    continue
+                prepare_start = time.perf_counter()
+                arguments = self.task_arguments(data_datetime)
+                yield data_datetime, arguments, time.perf_counter() - prepare_start
+
+        progress = tqdm(total=len(datetimes), desc="Processing timestamps")
+
+        def done(data_datetime, prepare_time, result):
+            try:
+                report.add(dict(result(), prepare=prepare_time))
+            except Exception as exc:
+                report.errors += 1
+                print(f"Timestamp {data_datetime} generated an exception: {exc}")
+            progress.update(1)
+
+        if executor == "serial":
+            for data_datetime, arguments, prepare_time in tasks():
+                done(
+                    data_datetime,
+                    prepare_time,
+                    lambda: write_station_npz(*arguments),
+                )
+        else:
+            pool_class = {
+                "thread": concurrent.futures.ThreadPoolExecutor,
+                "process": concurrent.futures.ProcessPoolExecutor,
+            }[executor]
+            with pool_class(max_workers=num_workers) as pool:
+                # bounded number of tasks in flight (their arguments stay in memory)
+                pending = {}
+                for data_datetime, arguments, prepare_time in tasks():
+                    future = pool.submit(write_station_npz, *arguments)
+                    pending[future] = (data_datetime, prepare_time)
+                    if len(pending) >= 4 * num_workers:
+                        finished, _ = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in finished:
+                            done(*pending.pop(future), future.result)
+                for future in concurrent.futures.as_completed(pending):
+                    done(*pending[future], future.result)
+
+        progress.update(report.skipped)
+        progress.close()
+        report.elapsed = time.perf_counter() - start
+
+        return report
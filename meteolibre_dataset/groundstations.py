@@ -0,0 +1,192 @@
+"""
+Module with the schema of the Météo-France ground station data and its CSV conversion.
+
+The hourly data of the stations comes as one .csv.gz archive per department
+(H_<department>_latest-2024-2025.csv.gz, ";" separated). The schema of the
+columns used by the dataset is declared once here and used by:
+
+- the conversion of the archives to Parquet (download_groundstation.py): the
+  .csv.gz is read directly, in batches, with the explicit column types, and every
+  batch is written as a row group, so neither the decompressed CSV nor the whole
+  table is ever materialised.
+- the preprocessing of the stations (preprocess_groundstations.py), with the
+  cleaning of the measurements (clean_groundstations): values masked by quality
+  code and physical bounds, one row per (station, hour) (the first one, no
+  averaging), only the columns used by the NPZ writer.
+"""
+
+import os
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# columns of the station data used by the dataset and their types
+GROUNDSTATION_SCHEMA = {
+    "NUM_POSTE": pl.Int64,
+    "LAT": pl.Float32,
+    "LON": pl.Float32,
+    "ALTI": pl.Int64,
+    "AAAAMMJJHH": pl.Int64,
+    "RR1": pl.Float32,
+    "QRR1": pl.Float32,
+    "FF": pl.Float32,
+    "QFF": pl.Float32,
+    "DD": pl.Float32,
+    "QDD": pl.Float32,
+    "FXY": pl.Float32,
+    "QFXY": pl.Float32,
+    "DXY": pl.Float32,
+    "QDXY": pl.Float32,
+    "HXY": pl.Float32,
+    "QHXY": pl.Float32,
+    "FXI": pl.Float32,
+    "QFXI": pl.Float32,
+    "DXI": pl.Float32,
+    "QDXI": pl.Float32,
+    "HXI": pl.Float32,
+    "QHXI": pl.Float32,
+    "FXI3S": pl.Float32,
+    "QFXI3S": pl.Float32,
+    "HFXI3S": pl.Float32,
+    "QHFXI3S": pl.Float32,
+    "T": pl.Float32,
+    "QT": pl.Float32,
+    "TN": pl.Float32,
+    "QTN": pl.Float32,
+    "HTN": pl.Float32,
+    "QHTN": pl.Float32,
+    "TX": pl.Float32,
+    "QTX": pl.Float32,
+    "HTX": pl.Float32,
+    "QHTX": pl.Float32,
+    "DG": pl.Float32,
+    "QDG": pl.Float32,
+    "NOM_USUEL": pl.String,
+    "U": pl.Float32,
+    "QU": pl.Float32,
+    "PMER": pl.Float32,
+    "QPMER": pl.Float32,
+    "VV": pl.Float32,
+    "QVV": pl.Float32,
+}
+
+GROUNDSTATION_COLUMNS = list(GROUNDSTATION_SCHEMA)
+
+_ARROW_TYPES = {pl.Int64: pa.int64(), pl.Float32: pa.float32(), pl.String: pa.string()}
+
+GROUNDSTATION_ARROW_SCHEMA = pa.schema(
+    [pa.field(name, _ARROW_TYPES[dtype]) for name, dtype in GROUNDSTATION_SCHEMA.items()]
+)
+
+# measurements rasterised by the NPZ writer
+GROUNDSTATION_MEASUREMENTS = ["RR1", "FF", "DD", "T", "U", "PMER", "VV"]
+
+# quality code column of the measurements
+QUALITY_COLUMNS = {
+    "RR1": "QRR1",
+    "FF": "QFF",
+    "DD": "QDD",
+    "T": "QT",
+    "U": "QU",
+    "PMER": "QPMER",
+    "VV": "QVV",
+}
+
+# Météo-France quality codes: 0 protected, 1 validated, 2 doubtful (being checked),
+# 9 filtered (not checked yet), the doubtful values are masked
+VALID_QUALITY_CODES = [0, 1, 9]
+
+# physical bounds of the measurements (units of the Météo-France files)
+PHYSICAL_BOUNDS = {
+    "RR1": (0.0, 300.0),  # mm in the hour
+    "FF": (0.0, 100.0),  # m/s
+    "DD": (0.0, 360.0),  # degrees
+    "T": (-60.0, 60.0),  # °C
+    "U": (0.0, 100.0),  # %
+    "PMER": (850.0, 1100.0),  # hPa
+    "VV": (0.0, 100000.0),  # m
+}
+
+CSV_BLOCK_SIZE = 64 << 20  # bytes of CSV per batch (and per Parquet row group)
+
+
+def csv_to_parquet(csv_path, parquet_path, block_size=CSV_BLOCK_SIZE):
+    """
+    Convert a ground station CSV (.csv or .csv.gz) to Parquet, batch by batch.
+
+    Only the columns of GROUNDSTATION_SCHEMA are kept, with their types. The Parquet
+    file is written under a temporary name and renamed once complete.
+
+    Args:
+        csv_path (str): Path of the CSV (decompressed on the fly if it ends with .gz).
+        parquet_path (str): Path of the Parquet file.
+        block_size (int, optional): Bytes of CSV read per batch. Defaults to CSV_BLOCK_SIZE.
+
+    Returns:
+        int: Number of rows written.
+    """
+    read_options = pa_csv.ReadOptions(block_size=block_size)
+    parse_options = pa_csv.ParseOptions(delimiter=";")
+    convert_options = pa_csv.ConvertOptions(
+        column_types=GROUNDSTATION_ARROW_SCHEMA,
+        include_columns=GROUNDSTATION_COLUMNS,
+        include_missing_columns=True,
+    )
+
+    tmp_path = parquet_path + ".tmp"
+    nb_rows = 0
+
+    # the compression is detected from the extension (.gz)
+    with pa.input_stream(csv_path, compression="detect") as stream:
+        reader = pa_csv.open_csv(
+            stream,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+        with pq.ParquetWriter(tmp_path, GROUNDSTATION_ARROW_SCHEMA) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                nb_rows += batch.num_rows
+
+    os.replace(tmp_path, parquet_path)
+
+    return nb_rows
+
+
+def clean_groundstations(stations, measurements=GROUNDSTATION_MEASUREMENTS):
+    """
+    Clean the station measurements (lazy, vectorised, in the same pass as the preprocessing).
+
+    - the values with a doubtful quality code or out of their physical bounds are set to null,
+    - the rows without any valid measurement are dropped,
+    - the duplicated (station, hour) rows are dropped, the first one is kept (the values
+      are not averaged: the mean of the wind directions DD of 350° and 10° would be 180°).
+
+    The rows are streamed, but the deduplication keeps the (station, hour) keys already
+    seen, so its memory grows with the number of distinct (station, hour) of the input
+    (keys only, not the rows).
+
+    Args:
+        stations (pl.LazyFrame): Station data with the NUM_POSTE, datetime, position_x,
+                                 position_y, measurement and quality columns.
+        measurements (list, optional): Measurement columns kept. Defaults to GROUNDSTATION_MEASUREMENTS.
+
+    Returns:
+        pl.LazyFrame: Columns NUM_POSTE, datetime, position_x, position_y and the measurements.
+    """
+    masked = []
+    for col in measurements:
+        valid = pl.col(col).is_between(*PHYSICAL_BOUNDS[col])
+        if col in QUALITY_COLUMNS:
+            quality = pl.col(QUALITY_COLUMNS[col]).cast(pl.Int64, strict=False)
+            valid = valid & (quality.is_null() | quality.is_in(VALID_QUALITY_CODES))
+        masked.append(pl.when(valid).then(pl.col(col)).alias(col))
+
+    return (
+        stations.select("NUM_POSTE", "datetime", "position_x", "position_y", *masked)
+        .filter(pl.any_horizontal(pl.col(measurements).is_not_null()))
+        .unique(subset=["NUM_POSTE", "datetime"], keep="first")
+    )
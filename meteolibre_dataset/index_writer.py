@@ -0,0 +1,160 @@
+"""
+Module to write the index of the HF dataset (npz backend) as typed Parquet.
+
+Every writer thread buffers its index records and flushes them as a small Parquet
+part file (one row group, written under a temporary name then renamed), so there
+is no lock contention on a shared file and no JSON to parse. At the end of the run
+the parts are consolidated into a single index.parquet sorted by datetime, so
+lookups by time or hour are vectorised. The sample ids are deterministic, so the
+records written twice (a crash between a part flush and the journal update) are
+deduplicated during the consolidation, the last written record is kept.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+INDEX_PARTS_DIR = "index_parts"
+INDEX_FILE = "index.parquet"
+PART_PREFIX = "part-"
+
+INDEX_SCHEMA = pa.schema(
+    [
+        pa.field("id", pa.string()),
+        pa.field("datetime", pa.timestamp("ms")),
+        pa.field("hour", pa.int32()),
+        pa.field("minute", pa.int32()),
+        pa.field("patch_x", pa.int32()),
+        pa.field("patch_y", pa.int32()),
+        pa.field("importance_weight", pa.float32()),
+        pa.field("time_radar_back", pa.list_(pa.float32())),
+        pa.field("radar_file_path_future", pa.string()),
+        pa.field("radar_file_path_back", pa.string()),
+        pa.field("groundstation_file_path_future", pa.string()),
+        pa.field("groundstation_file_path_back", pa.string()),
+    ]
+)
+
+
+class ParquetIndexWriter:
+    """
+    Buffered, per-thread writer of index records into Parquet part files.
+
+    Args:
+        save_dir (str): HF dataset folder (the parts are written in save_dir/index_parts).
+        rows_per_part (int, optional): Number of records buffered before a part is flushed.
+                                       Defaults to 512.
+    """
+
+    def __init__(self, save_dir, rows_per_part=512):
+        self.parts_dir = os.path.join(save_dir, INDEX_PARTS_DIR)
+        os.makedirs(self.parts_dir, exist_ok=True)
+
+        self.rows_per_part = rows_per_part
+        self.local = threading.local()
+        self.states = []
+        self.lock = threading.Lock()
+
+        # parts of a previous (interrupted) run are kept
+        existing = [
+            int(f[len(PART_PREFIX) : -len(".parquet")])
+            for f in os.listdir(self.parts_dir)
+            if f.startswith(PART_PREFIX) and f.endswith(".parquet")
+        ]
+        self.next_part = max(existing) + 1 if existing else 0
+
+    def _state(self):
+        state = getattr(self.local, "state", None)
+        if state is None:
+            state = {"records": [], "commits": []}
+            self.local.state = state
+            with self.lock:
+                self.states.append(state)
+        return state
+
+    def _flush(self, state):
+        records = state["records"]
+        if records:
+            with self.lock:
+                part = self.next_part
+                self.next_part += 1
+
+            table = pa.Table.from_pylist(records, schema=INDEX_SCHEMA)
+            path = os.path.join(self.parts_dir, f"{PART_PREFIX}{part:06d}.parquet")
+            pq.write_table(table, path + ".tmp")
+            os.replace(path + ".tmp", path)
+
+        commits = state["commits"]
+        state["records"] = []
+        state["commits"] = []
+        for on_commit in commits:
+            on_commit()
+
+    def write(self, records, on_commit=None):
+        """
+        Add index records to the buffer of the current thread.
+
+        Args:
+            records (list): Index records (dict with the INDEX_SCHEMA columns).
+            on_commit (callable, optional): Called once those records are persisted.
+        """
+        state = self._state()
+        state["records"].extend(records)
+        if on_commit is not None:
+            state["commits"].append(on_commit)
+
+        if len(state["records"]) >= self.rows_per_part:
+            self._flush(state)
+
+    def close(self):
+        """
+        Flush the buffers of every thread (call it once all the writes are done).
+        """
+        for state in self.states:
+            self._flush(state)
+
+
+def consolidate_index(save_dir, row_group_size=100000):
+    """
+    Merge all the index parts into a single index.parquet sorted by datetime.
+
+    The parts are read in the order they were written and the records with the same
+    id are deduplicated (the last one is kept).
+
+    Args:
+        save_dir (str): HF dataset folder.
+        row_group_size (int, optional): Row group size of the consolidated index.
+                                        Defaults to 100000.
+
+    Returns:
+        str: Path of the consolidated index.
+    """
+    parts_dir = os.path.join(save_dir, INDEX_PARTS_DIR)
+    part_files = sorted(
+        os.path.join(parts_dir, f)
+        for f in os.listdir(parts_dir)
+        if f.startswith(PART_PREFIX) and f.endswith(".parquet")
+    )
+
+    if part_files:
+        table = pa.concat_tables([pq.read_table(f, schema=INDEX_SCHEMA) for f in part_files])
+
+        # last occurrence of every id (the parts are numbered in write order)
+        ids = table.column("id").to_numpy(zero_copy_only=False)
+        _, last_reversed = np.unique(ids[::-1], return_index=True)
+        if len(last_reversed) < len(ids):
+            print(f"Dropping {len(ids) - len(last_reversed)} duplicated index records")
+            table = table.take(np.sort(len(ids) - 1 - last_reversed))
+
+        table = table.sort_by([("datetime", "ascending"), ("id", "ascending")])
+    else:
+        table = INDEX_SCHEMA.empty_table()
+
+    output_path = os.path.join(save_dir, INDEX_FILE)
+    pq.write_table(table, output_path + ".tmp", row_group_size=row_group_size)
+    os.replace(output_path + ".tmp", output_path)
+
+    return output_path
@@ -0,0 +1,103 @@
+"""
+Module to align N data sources (radar, ground stations, satellite, BUFR, ...) on a time axis.
+
+The radar frames are the anchor of the index. Every other source is matched to
+the anchor with an as-of join (polars join_asof): the nearest, previous
+(backward) or next (forward) file within a per-source tolerance. Instead of an
+exact match on the datetime, a source produced at slightly different times (e.g.
+the satellite scans) can still be aligned, and the time offset of every matched
+file is recorded in the index ({name}_offset_s, in seconds).
+
+Adding a modality is one more IndexSource, no new join code.
+"""
+
+import datetime
+
+import polars as pl
+
+
+class IndexSource:
+    """
+    A data source of the index.
+
+    Args:
+        name (str): Name of the source, the index columns are {name}_file_path and {name}_offset_s.
+        files (pl.DataFrame): Files of the source, with a datetime and a file_path column.
+        tolerance (datetime.timedelta, optional): Maximum time offset of a match.
+                                                  Defaults to 0 (exact match).
+        strategy (str, optional): "nearest", "backward" (file at or before the anchor) or
+                                  "forward" (file at or after the anchor). Defaults to "nearest".
+        required (bool, optional): If True, the anchor times without a match are dropped,
+                                   otherwise the file path is left null. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        name,
+        files,
+        tolerance=datetime.timedelta(0),
+        strategy="nearest",
+        required=True,
+    ):
+        self.name = name
+        self.files = files
+        self.tolerance = tolerance
+        self.strategy = strategy
+        self.required = required
+
+
+def build_multi_source_index(anchor, sources):
+    """
+    Build the index: every anchor file with the matched file of every source.
+
+    Args:
+        anchor (IndexSource): The anchor source (its datetime is the datetime of the index).
+        sources (list): The other IndexSource.
+
+    Returns:
+        pl.DataFrame: Index sorted by datetime, with the columns datetime,
+                      {anchor}_file_path, then {name}_file_path and {name}_offset_s per source.
+    """
+    index = (
+        anchor.files.select(
+            pl.col("datetime").cast(pl.Datetime("ms")),
+            pl.col("file_path").alias(f"{anchor.name}_file_path"),
+        )
+        .unique(subset="datetime", keep="first")
+        .sort("datetime")
+    )
+
+    for source in sources:
+        source_datetime = f"{source.name}_datetime"
+        files = (
+            source.files.select(
+                pl.col("datetime").cast(pl.Datetime("ms")).alias(source_datetime),
+                pl.col("file_path").alias(f"{source.name}_file_path"),
+            )
+            .unique(subset=source_datetime, keep="first")
+            .sort(source_datetime)
+        )
+
+        index = index.join_asof(
+            files,
+            left_on="datetime",
+            right_on=source_datetime,
+            strategy=source.strategy,
+            tolerance=source.tolerance,
+        )
+        index = index.with_columns(
+            (pl.col(source_datetime) - pl.col("datetime"))
+            .dt.total_seconds()
+            .cast(pl.Int32)
+            .alias(f"{source.name}_offset_s")
+        ).drop(source_datetime)
+
+        print(
+            f"Source {source.name}: {index[f'{source.name}_file_path'].is_not_null().sum()} "
+            f"/ {len(index)} anchor times matched (tolerance {source.tolerance}, {source.strategy})."
+        )
+
+        if source.required:
+            index = index.filter(pl.col(f"{source.name}_file_path").is_not_null())
+
+    return index
@@ -0,0 +1,132 @@
+"""
+Module to draw patch positions with precipitation-weighted importance sampling.
+
+Most of the patches are dry, so drawing the positions uniformly means generating a
+lot of samples to get enough rainy ones. Here the candidate cells (blocks in which
+every patch origin is valid, see meteolibre_dataset.radar_coverage) are weighted by
+the mean rain intensity of their patch, computed from the precomputed rain maps, and
+the origin is then drawn uniformly inside the cell.
+
+The importance weight of every drawn patch (uniform probability / probability of its
+cell, the uniform probability of a cell being proportional to its number of origins)
+is recorded so the training can be debiased: with uniform sampling every weight is 1.
+"""
+
+import numpy as np
+
+from meteolibre_dataset.radar_coverage import COVERAGE_BLOCK_SIZE, window_sums
+
+
+def cell_sizes(cells, stride=2):
+    """
+    Number of patch origins of every cell.
+
+    Args:
+        cells (np.ndarray): Cells (nb_cells, 4): x_min, x_max, y_min, y_max (see valid_patch_cells).
+        stride (int, optional): Step between two origins. Defaults to 2.
+
+    Returns:
+        np.ndarray: Number of origins of every cell (nb_cells,).
+    """
+    return ((cells[:, 1] - cells[:, 0]) // stride + 1) * ((cells[:, 3] - cells[:, 2]) // stride + 1)
+
+
+def patch_rain_intensity(
+    rain, coverage, cells, patch_size, block_size=COVERAGE_BLOCK_SIZE
+):
+    """
+    Compute the mean rain intensity of the patches of candidate cells over several frames.
+
+    The intensity of a cell is the one of the patch aligned on its block.
+
+    Args:
+        rain (np.ndarray): Rain maps of the frames (nb_frames, nb_blocks_h, nb_blocks_w).
+        coverage (np.ndarray): Coverage maps of the frames (nb_frames, nb_blocks_h, nb_blocks_w).
+        cells (np.ndarray): Candidate cells (nb_cells, 4), see valid_patch_cells.
+        patch_size (int): Size of the patch in full resolution pixels.
+        block_size (int, optional): Size of the blocks in full resolution pixels.
+                                    Defaults to COVERAGE_BLOCK_SIZE.
+
+    Returns:
+        np.ndarray: Mean raw radar value over the valid pixels of every patch,
+                    averaged over the frames (nb_cells,).
+    """
+    window_blocks = patch_size // block_size
+
+    rain_sums = window_sums(rain, window_blocks)
+    valid_sums = window_sums(coverage, window_blocks)
+
+    bx = cells[:, 0] // block_size
+    by = cells[:, 2] // block_size
+    rain_patch = rain_sums[:, bx, by]
+    valid_patch = valid_sums[:, bx, by]
+
+    intensity = rain_patch / np.maximum(valid_patch, 1)
+
+    return intensity.mean(axis=0)
+
+
+def importance_probabilities(intensity, exponent=1.0, floor=0.1, sizes=None):
+    """
+    Convert cell rain intensities into sampling probabilities.
+
+    The weight of a patch is floor + (intensity / mean intensity) ** exponent, so
+    with floor > 0 dry patches can still be drawn, the weight of a cell is the weight
+    of its patches times its number of origins. If every patch is dry, the
+    probabilities are uniform over the origins.
+
+    Args:
+        intensity (np.ndarray): Rain intensity of the candidate cells (nb_cells,).
+        exponent (float, optional): Exponent applied to the intensity, 0 gives
+                                    uniform sampling. Defaults to 1.0.
+        floor (float, optional): Weight added to every patch. Defaults to 0.1.
+        sizes (np.ndarray, optional): Number of origins of every cell (see cell_sizes),
+                                      1 for every cell if None.
+
+    Returns:
+        np.ndarray: Sampling probabilities of the cells (nb_cells,).
+    """
+    intensity = np.asarray(intensity, dtype=np.float64)
+    sizes = np.ones(len(intensity)) if sizes is None else np.asarray(sizes, dtype=np.float64)
+
+    mean_intensity = intensity.mean() if len(intensity) > 0 else 0.0
+    if mean_intensity <= 0:
+        weights = np.ones(len(intensity))
+    else:
+        weights = floor + (intensity / mean_intensity) ** exponent
+
+    weights = weights * sizes
+    return weights / max(weights.sum(), 1e-300)
+
+
+def draw_patch(cells, probabilities=None, rng=None, stride=2):
+    """
+    Draw a patch position: a cell, then an origin uniformly inside the cell.
+
+    Args:
+        cells (np.ndarray): Candidate cells (nb_cells, 4), see valid_patch_cells.
+        probabilities (np.ndarray, optional): Sampling probabilities of the cells,
+                                              uniform over the origins if None.
+        rng (np.random.Generator, optional): Random generator, a new unseeded one if None.
+        stride (int, optional): Step between two origins. Defaults to 2.
+
+    Returns:
+        tuple: A tuple containing:
+            - x (int): Patch position on the first axis.
+            - y (int): Patch position on the second axis.
+            - importance_weight (float): uniform probability / probability of the drawn cell.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    sizes = cell_sizes(cells, stride)
+    uniform = sizes / sizes.sum()
+    p = uniform if probabilities is None else probabilities
+
+    choice = int(rng.choice(len(cells), p=p))
+    x_min, x_max, y_min, y_max = (int(v) for v in cells[choice])
+    x = x_min + stride * int(rng.integers((x_max - x_min) // stride + 1))
+    y = y_min + stride * int(rng.integers((y_max - y_min) // stride + 1))
+
+    if probabilities is None:
+        return x, y, 1.0
+
+    return x, y, float(uniform[choice] / probabilities[choice])
@@ -0,0 +1,193 @@
+"""
+Module with a small staged producer/consumer pipeline based on threads and bounded queues.
+
+Every stage has its own pool of worker threads and its own bounded input queue.
+When a queue is full the upstream stage blocks (back-pressure), so the number of
+items in flight (and the memory used) stays bounded whatever the size of the input.
+
+Every stage records throughput counters: number of items, busy time (in the stage
+function), starved time (waiting for input) and blocked time (waiting for space
+downstream). The stage with the highest busy ratio is the bottleneck.
+"""
+
+import queue
+import threading
+import time
+
+_SENTINEL = object()
+
+
+class Stage:
+    """
+    A stage of the pipeline.
+
+    Args:
+        name (str): Name of the stage (used in the report).
+        func (callable): Function applied to every item. If it returns None the
+                         item is dropped, otherwise the result is sent to the next stage.
+        num_workers (int, optional): Number of worker threads. Defaults to 1.
+        queue_size (int, optional): Size of the input queue of the stage.
+                                    Defaults to 2 * num_workers.
+    """
+
+    def __init__(self, name, func, num_workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.num_workers = num_workers
+        self.queue_size = queue_size if queue_size is not None else 2 * num_workers
+
+
+class StageStats:
+    """
+    Throughput counters of a stage.
+    """
+
+    def __init__(self, name, num_workers):
+        self.name = name
+        self.num_workers = num_workers
+        self.items = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.starved_time = 0.0
+        self.blocked_time = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, busy, starved, blocked, dropped=False, error=False):
+        with self.lock:
+            self.items += 1
+            self.dropped += int(dropped)
+            self.errors += int(error)
+            self.busy_time += busy
+            self.starved_time += starved
+            self.blocked_time += blocked
+
+    def report(self, elapsed):
+        """
+        Get a one line report of the stage.
+
+        Args:
+            elapsed (float): Total duration of the pipeline run in seconds.
+
+        Returns:
+            str: The report.
+        """
+        worker_time = max(elapsed * self.num_workers, 1e-9)
+        return (
+            f"{self.name:>10s} ({self.num_workers} workers): "
+            f"{self.items} items ({self.dropped} dropped, {self.errors} errors), "
+            f"{self.items / max(elapsed, 1e-9):.2f} items/s, "
+            f"busy {self.busy_time / worker_time:.0%}, "
+            f"starved {self.starved_time / worker_time:.0%}, "
+            f"blocked {self.blocked_time / worker_time:.0%}"
+        )
+
+
+class BoundedPipeline:
+    """
+    Run items through a list of stages with bounded queues between them.
+
+    Args:
+        stages (list): List of Stage.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.stats = [StageStats(stage.name, stage.num_workers) for stage in stages]
+        self.elapsed = 0.0
+
+    def _worker(self, k, queues, remaining, remaining_lock, progress):
+        stage = self.stages[k]
+        stats = self.stats[k]
+        input_queue = queues[k]
+        output_queue = queues[k + 1] if k + 1 < len(queues) else None
+
+        while True:
+            start = time.perf_counter()
+            item = input_queue.get()
+            starved = time.perf_counter() - start
+
+            if item is _SENTINEL:
+                break
+
+            start = time.perf_counter()
+            try:
+                result = stage.func(item)
+                error = False
+            except Exception as exc:
+                print(f"Stage {stage.name} generated an exception: {exc}")
+                result = None
+                error = True
+            busy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if result is not None and output_queue is not None:
+                output_queue.put(result)
+            blocked = time.perf_counter() - start
+
+            stats.add(busy, starved, blocked, dropped=result is None, error=error)
+
+            if output_queue is None and progress is not None:
+                progress()
+
+        # the last worker of the stage to finish closes the next stage
+        with remaining_lock:
+            remaining[k] -= 1
+            last = remaining[k] == 0
+
+        if last and output_queue is not None:
+            for _ in range(self.stages[k + 1].num_workers):
+                output_queue.put(_SENTINEL)
+
+    def run(self, items, progress=None):
+        """
+        Run all the items through the pipeline (blocks until every item is processed).
+
+        Args:
+            items (iterable): Input items of the first stage.
+            progress (callable, optional): Called every time an item leaves the last stage.
+
+        Returns:
+            list: The StageStats of every stage.
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        remaining = [stage.num_workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        threads = []
+        for k, stage in enumerate(self.stages):
+            for w in range(stage.num_workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(k, queues, remaining, remaining_lock, progress),
+                    name=f"{stage.name}-{w}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        start = time.perf_counter()
+
+        # feeding blocks when the first queue is full (back-pressure)
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].num_workers):
+            queues[0].put(_SENTINEL)
+
+        for thread in threads:
+            thread.join()
+
+        self.elapsed = time.perf_counter() - start
+
+        return self.stats
+
+    def report(self):
+        """
+        Get the report of the last run (one line per stage).
+
+        Returns:
+            str: The report.
+        """
+        lines = [f"Pipeline run in {self.elapsed:.1f}s"]
+        lines += [stats.report(self.elapsed) for stats in self.stats]
+        return "\n".join(lines)
@@ -0,0 +1,104 @@
+"""
+Module to downsample batched stacks of frames (N, H, W, C) to a target resolution.
+
+All the operators work on the whole batch in one vectorised call, by reshaping
+the stack into (N, H/f, f, W/f, f, C) blocks and reducing the block axes:
+
+- "max": maximum of the block (ground station default).
+- "mean": mean of the block.
+- "masked_mean": mean of the block ignoring the no data value (-100 for the
+  ground station images), no data if the whole block is no data.
+- "nearest": top left pixel of the block (same as strided slicing [::f], radar default).
+
+multi_scale_pool produces several resolutions from the same source stack, so
+the 128/256/512 variants of a dataset can be built in one pass over the frames
+(hf_dataset_resize.py pools the radar and the ground station crops with it).
+"""
+
+import numpy as np
+
+GROUNDSTATION_NODATA = -100
+
+POOLING_OPS = ["max", "mean", "masked_mean", "nearest"]
+
+
+def pool(stack, factor, op="max", nodata=GROUNDSTATION_NODATA):
+    """
+    Downsample a stack of frames by an integer factor.
+
+    Args:
+        stack (np.ndarray): Stack of frames (N, H, W, C), H and W multiple of factor.
+        factor (int): Downsampling factor.
+        op (str, optional): Pooling operator, one of POOLING_OPS. Defaults to "max".
+        nodata (float, optional): No data value ignored by "masked_mean".
+                                  Defaults to GROUNDSTATION_NODATA.
+
+    Returns:
+        np.ndarray: Pooled stack (N, H / factor, W / factor, C). "mean" and
+                    "masked_mean" return float32, the other operators keep the dtype.
+    """
+    if op not in POOLING_OPS:
+        raise ValueError(f"Unknown pooling operator {op}, expected one of {POOLING_OPS}.")
+
+    stack = np.asarray(stack)
+    N, H, W, C = stack.shape
+    if H % factor != 0 or W % factor != 0:
+        raise ValueError(
+            f"Frame dimensions ({H}, {W}) must be multiples of the pooling factor {factor}."
+        )
+
+    if factor == 1:
+        return stack
+
+    if op == "nearest":
+        return np.ascontiguousarray(stack[:, ::factor, ::factor, :])
+
+    blocks = stack.reshape(N, H // factor, factor, W // factor, factor, C)
+
+    if op == "max":
+        return blocks.max(axis=(2, 4))
+
+    if op == "mean":
+        return blocks.mean(axis=(2, 4), dtype=np.float32)
+
+    # masked mean: sum and count of the valid pixels of every block
+    valid = blocks != nodata
+    sums = np.where(valid, blocks, 0).sum(axis=(2, 4), dtype=np.float32)
+    counts = np.count_nonzero(valid, axis=(2, 4))
+
+    pooled = np.full(sums.shape, nodata, dtype=np.float32)
+    np.divide(sums, counts, out=pooled, where=counts > 0)
+
+    return pooled
+
+
+def multi_scale_pool(stack, factors, op="max", nodata=GROUNDSTATION_NODATA):
+    """
+    Downsample a stack of frames to several resolutions at once.
+
+    The factors are processed from the smallest to the largest and, when possible,
+    a level is pooled from the previous one (e.g. 4x from 2x) instead of from the
+    source stack ("max" and "nearest" give the same result both ways).
+
+    Args:
+        stack (np.ndarray): Stack of frames (N, H, W, C).
+        factors (list): Downsampling factors (e.g. [1, 2, 4]).
+        op (str, optional): Pooling operator, one of POOLING_OPS. Defaults to "max".
+        nodata (float, optional): No data value ignored by "masked_mean".
+                                  Defaults to GROUNDSTATION_NODATA.
+
+    Returns:
+        dict: Factor -> pooled stack.
+    """
+    cascade = op in ("max", "nearest")
+
+    results = {}
+    source, source_factor = stack, 1
+    for factor in sorted(set(factors)):
+        if cascade and factor % source_factor == 0:
+            results[factor] = pool(source, factor // source_factor, op=op, nodata=nodata)
+            source, source_factor = results[factor], factor
+        else:
+            results[factor] = pool(stack, factor, op=op, nodata=nodata)
+
+    return results
@@ -0,0 +1,335 @@
+"""
+Module to precompute low resolution radar coverage maps.
+
+For every radar frame we store the number of valid pixels (not 65535) per block of
+block_size x block_size pixels, and the sum of the radar values over those valid
+pixels (rain map). With those maps, the dataset generation can pick patch positions
+that are guaranteed to be valid before reading the full frames (instead of reading
+the frames and rejecting the patch afterwards), and weight them by precipitation
+(see meteolibre_dataset.patch_sampling).
+
+Only the pixels read by the dataset generation are counted: the frames are read
+with a stride (2 by default) so we count the pixels of frame[::stride, ::stride].
+
+The block maps are only used to reject patches, not to place them: the patch origins
+are drawn uniformly (on the stride grid) inside the valid blocks ("cells"). A cell
+is valid if, for every frame, the blocks fully contained in any patch whose origin
+falls in the cell (patch_size // block_size - 1 blocks per side) have more than
+min_valid valid pixels, a conservative lower bound of the count of the patch.
+
+The maps of the frames already in the coverage file are kept, only the new radar
+files are read (update_coverage_index).
+"""
+
+import os
+import concurrent.futures
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+RADAR_NODATA = 65535
+COVERAGE_BLOCK_SIZE = 64  # in full resolution pixels
+
+
+def read_radar_frame(path_file):
+    """
+    Read a full radar frame from a h5 file.
+
+    Args:
+        path_file (str): Path to the h5 file.
+
+    Returns:
+        np.ndarray: The radar frame (raw values, 65535 for no data).
+    """
+    with h5py.File(path_file, "r") as f:
+        return f["dataset1"]["data1"]["data"][:]
+
+
+def _to_blocks(radar_frame, block_size, stride):
+    """
+    Reshape the strided radar frame into blocks (nb_blocks_h, block, nb_blocks_w, block).
+    """
+    if block_size % stride != 0:
+        raise ValueError("block_size must be a multiple of stride.")
+
+    block = block_size // stride
+    sampled = radar_frame[::stride, ::stride]
+
+    nb_blocks_h = sampled.shape[0] // block
+    nb_blocks_w = sampled.shape[1] // block
+
+    return sampled[: nb_blocks_h * block, : nb_blocks_w * block].reshape(
+        nb_blocks_h, block, nb_blocks_w, block
+    )
+
+
+def compute_coverage_map(radar_frame, block_size=COVERAGE_BLOCK_SIZE, stride=2):
+    """
+    Compute the number of valid pixels per block for a radar frame.
+
+    Args:
+        radar_frame (np.ndarray): Raw radar frame (H, W).
+        block_size (int, optional): Size of the blocks in full resolution pixels.
+                                    Defaults to COVERAGE_BLOCK_SIZE.
+        stride (int, optional): Stride used when reading the patches. Defaults to 2.
+
+    Returns:
+        np.ndarray: Valid pixel count per block (H // block_size, W // block_size).
+    """
+    blocks = _to_blocks(radar_frame, block_size, stride)
+
+    return (blocks != RADAR_NODATA).sum(axis=(1, 3), dtype=np.uint16)
+
+
+def compute_rain_map(radar_frame, block_size=COVERAGE_BLOCK_SIZE, stride=2):
+    """
+    Compute the sum of the radar values (valid pixels only) per block for a radar frame.
+
+    Args:
+        radar_frame (np.ndarray): Raw radar frame (H, W).
+        block_size (int, optional): Size of the blocks in full resolution pixels.
+                                    Defaults to COVERAGE_BLOCK_SIZE.
+        stride (int, optional): Stride used when reading the patches. Defaults to 2.
+
+    Returns:
+        np.ndarray: Sum of the raw radar values per block (H // block_size, W // block_size).
+    """
+    blocks = _to_blocks(radar_frame, block_size, stride)
+    values = np.where(blocks != RADAR_NODATA, blocks, 0)
+
+    return values.sum(axis=(1, 3), dtype=np.float64).astype(np.float32)
+
+
+def build_coverage_index(
+    radar_file_paths, main_dir, block_size=COVERAGE_BLOCK_SIZE, stride=2, num_workers=6
+):
+    """
+    Compute the coverage and rain maps for a list of radar files.
+
+    Every frame is read once and both maps are computed from it.
+
+    Args:
+        radar_file_paths (list): Radar file paths (relative to main_dir, as in index.parquet).
+        main_dir (str): Main data directory.
+        block_size (int, optional): Size of the blocks in full resolution pixels.
+                                    Defaults to COVERAGE_BLOCK_SIZE.
+        stride (int, optional): Stride used when reading the patches. Defaults to 2.
+        num_workers (int, optional): Number of reader threads. Defaults to 6.
+
+    Returns:
+        tuple: A tuple containing:
+            - coverage (np.ndarray): Coverage maps (nb_files, nb_blocks_h, nb_blocks_w).
+            - rain (np.ndarray): Rain maps (nb_files, nb_blocks_h, nb_blocks_w).
+    """
+
+    def process(path):
+        frame = read_radar_frame(os.path.join(main_dir, str(path)))
+        return (
+            compute_coverage_map(frame, block_size=block_size, stride=stride),
+            compute_rain_map(frame, block_size=block_size, stride=stride),
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = list(
+            tqdm(
+                executor.map(process, radar_file_paths),
+                total=len(radar_file_paths),
+                desc="Computing coverage maps",
+            )
+        )
+
+    coverage = np.stack([result[0] for result in results], axis=0)
+    rain = np.stack([result[1] for result in results], axis=0)
+
+    return coverage, rain
+
+
+def save_coverage_index(
+    output_path, radar_file_paths, coverage, rain, block_size, stride
+):
+    """
+    Save the coverage and rain maps with the radar file paths they belong to.
+
+    Args:
+        output_path (str): Path of the npz file.
+        radar_file_paths (list): Radar file paths.
+        coverage (np.ndarray): Coverage maps (nb_files, nb_blocks_h, nb_blocks_w).
+        rain (np.ndarray): Rain maps (nb_files, nb_blocks_h, nb_blocks_w).
+        block_size (int): Size of the blocks in full resolution pixels.
+        stride (int): Stride used when reading the patches.
+    """
+    np.savez_compressed(
+        output_path,
+        radar_file_path=np.array(radar_file_paths, dtype=str),
+        coverage=coverage,
+        rain=rain,
+        block_size=np.int32(block_size),
+        stride=np.int32(stride),
+    )
+
+
+def load_coverage_index(path):
+    """
+    Load the coverage maps saved with save_coverage_index.
+
+    Args:
+        path (str): Path of the npz file.
+
+    Returns:
+        tuple: A tuple containing:
+            - coverage_lookup (dict): radar file path -> row in the coverage array.
+            - coverage (np.ndarray): Coverage maps (nb_files, nb_blocks_h, nb_blocks_w).
+            - rain (np.ndarray): Rain maps (nb_files, nb_blocks_h, nb_blocks_w),
+                                 None if the file does not contain them.
+            - block_size (int): Size of the blocks in full resolution pixels.
+            - stride (int): Stride of the pixels counted in the maps.
+    """
+    with np.load(path) as data:
+        radar_file_paths = data["radar_file_path"]
+        coverage = data["coverage"]
+        rain = data["rain"] if "rain" in data.files else None
+        block_size = int(data["block_size"])
+        stride = int(data["stride"]) if "stride" in data.files else 2
+
+    coverage_lookup = {str(path): i for i, path in enumerate(radar_file_paths)}
+
+    return coverage_lookup, coverage, rain, block_size, stride
+
+
+def update_coverage_index(
+    output_path,
+    radar_file_paths,
+    main_dir,
+    block_size=COVERAGE_BLOCK_SIZE,
+    stride=2,
+    num_workers=6,
+):
+    """
+    Compute the coverage and rain maps of the radar files that are not in the coverage
+    file yet and save all of them (in the order of radar_file_paths).
+
+    The whole file is recomputed if it was built with another block size or stride,
+    or without the rain maps.
+
+    Args:
+        output_path (str): Path of the npz file.
+        radar_file_paths (list): Radar file paths (relative to main_dir, as in index.parquet).
+        main_dir (str): Main data directory.
+        block_size (int, optional): Size of the blocks in full resolution pixels.
+                                    Defaults to COVERAGE_BLOCK_SIZE.
+        stride (int, optional): Stride used when reading the patches. Defaults to 2.
+        num_workers (int, optional): Number of reader threads. Defaults to 6.
+
+    Returns:
+        tuple: (coverage, rain) maps of radar_file_paths and the number of frames read.
+    """
+    radar_file_paths = [str(path) for path in radar_file_paths]
+
+    lookup, coverage, rain = {}, None, None
+    if os.path.exists(output_path):
+        lookup, coverage, rain, old_block_size, old_stride = load_coverage_index(output_path)
+        if rain is None or (old_block_size, old_stride) != (block_size, stride):
+            print(f"{output_path} was built with other parameters, recomputing it")
+            lookup = {}
+
+    missing = [path for path in radar_file_paths if path not in lookup]
+    if missing:
+        new_coverage, new_rain = build_coverage_index(
+            missing, main_dir, block_size=block_size, stride=stride, num_workers=num_workers
+        )
+        offset = len(coverage) if lookup else 0
+        lookup.update({path: offset + i for i, path in enumerate(missing)})
+        if offset:
+            coverage = np.concatenate([coverage, new_coverage], axis=0)
+            rain = np.concatenate([rain, new_rain], axis=0)
+        else:
+            coverage, rain = new_coverage, new_rain
+
+    rows = [lookup[path] for path in radar_file_paths]
+    coverage, rain = coverage[rows], rain[rows]
+    save_coverage_index(output_path, radar_file_paths, coverage, rain, block_size, stride)
+
+    return coverage, rain, len(missing)
+
+
+def window_sums(coverage, window_blocks):
+    """
+    Sum the block values over every window of window_blocks x window_blocks blocks.
+
+    Uses an integral image so all the windows are computed in one vectorised pass.
+
+    Args:
+        coverage (np.ndarray): Block values (..., nb_blocks_h, nb_blocks_w).
+        window_blocks (int): Size of the window in blocks.
+
+    Returns:
+        np.ndarray: Window sums (..., nb_blocks_h - window_blocks + 1, nb_blocks_w - window_blocks + 1),
+                    the value at (bx, by) is the sum of the window starting at block (bx, by).
+    """
+    dtype = np.float64 if np.issubdtype(coverage.dtype, np.floating) else np.int64
+    integral = np.cumsum(np.cumsum(coverage, axis=-2, dtype=dtype), axis=-1)
+    pad = [(0, 0)] * (integral.ndim - 2) + [(1, 0), (1, 0)]
+    integral = np.pad(integral, pad)
+
+    w = window_blocks
+    return (
+        integral[..., w:, w:]
+        - integral[..., :-w, w:]
+        - integral[..., w:, :-w]
+        + integral[..., :-w, :-w]
+    )
+
+
+def valid_patch_cells(
+    coverage, patch_size, min_valid, low, high, block_size=COVERAGE_BLOCK_SIZE, stride=2
+):
+    """
+    Get the cells (blocks) in which every patch origin is valid for all the frames.
+
+    A patch is valid for a frame if it contains strictly more than min_valid valid pixels.
+    Any patch whose origin falls in block b fully contains the blocks b + 1 to
+    b + patch_size // block_size - 1, so their count is a lower bound of the count of
+    the patch: a cell is valid if this lower bound is above min_valid for every frame.
+
+    Args:
+        coverage (np.ndarray): Coverage maps of the frames to check (nb_frames, nb_blocks_h, nb_blocks_w).
+        patch_size (int): Size of the patch in full resolution pixels (multiple of block_size).
+        min_valid (int): Minimum number of valid pixels (exclusive).
+        low (int): Minimum patch position (inclusive).
+        high (int): Maximum patch position (inclusive).
+        block_size (int, optional): Size of the blocks in full resolution pixels.
+                                    Defaults to COVERAGE_BLOCK_SIZE.
+        stride (int, optional): Stride of the pixels counted in the maps, the patch
+                                origins are multiples of it. Defaults to 2.
+
+    Returns:
+        np.ndarray: Valid cells (nb_cells, 4): x_min, x_max, y_min, y_max, the range
+                    (inclusive, multiples of stride) of the patch origins of every cell.
+    """
+    if patch_size % block_size != 0:
+        raise ValueError("patch_size must be a multiple of block_size.")
+
+    window_blocks = patch_size // block_size
+    inner = window_sums(coverage, window_blocks - 1)
+    # inner[..., b + 1] is the count of the blocks fully contained in the patches of cell b
+    valid = np.all(inner[..., 1:, 1:] > min_valid, axis=0)
+    # cell b only exists if the patch of origin b * block_size fits in the maps
+    nb_cells_h = coverage.shape[-2] - window_blocks + 1
+    nb_cells_w = coverage.shape[-1] - window_blocks + 1
+    valid = valid[:nb_cells_h, :nb_cells_w]
+
+    def origin_ranges(nb_cells):
+        # range of the patch origins (multiples of stride) of every cell, in [low, high]
+        start = np.maximum(np.arange(nb_cells) * block_size, low)
+        end = np.minimum(np.arange(nb_cells) * block_size + block_size - 1, high)
+        start = -(-start // stride) * stride
+        end = end // stride * stride
+        return start, end
+
+    x_start, x_end = origin_ranges(nb_cells_h)
+    y_start, y_end = origin_ranges(nb_cells_w)
+    valid &= (x_start <= x_end)[:, None] & (y_start <= y_end)[None, :]
+
+    bx, by = np.nonzero(valid)
+    return np.stack([x_start[bx], x_end[bx], y_start[by], y_end[by]], axis=1).astype(np.int64)
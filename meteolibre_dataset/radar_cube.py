@@ -0,0 +1,250 @@
+"""
+Module to repack the radar frames into a single time series cube (time, x, y).
+
+A training sample needs consecutive frames at the same (x, y) window. With one
+h5 file per timestamp, that is one file open and one chunk decompression per
+frame. Here the frames are stored in a single chunked and compressed h5 dataset
+with temporal chunks (16, 256, 256 by default), so a temporal window at a location
+is one or two chunk reads per spatial chunk:
+
+    radar_cube.h5
+    ├── radar        (nb_frames, 3472, 3472) uint16, chunks (16, 256, 256)
+    └── timestamps   (nb_frames,) int64, seconds since epoch, sorted
+
+The cube is append only: new timestamps (later than the last one) are appended
+along the time axis. Frames backfilled earlier than the last frame of the cube
+cannot be inserted: they are reported when the cube is updated, and added by
+rebuilding the cube (build_radar_cube with rebuild=True).
+"""
+
+import os
+import datetime
+import threading
+import concurrent.futures
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+from meteolibre_dataset.radar_coverage import RADAR_NODATA, read_radar_frame
+
+CUBE_DATASET = "radar"
+TIMES_DATASET = "timestamps"
+CUBE_CHUNKS = (16, 256, 256)
+
+
+def to_timestamp(data_datetime):
+    """
+    Convert a (naive, UTC) datetime into seconds since epoch.
+    """
+    return int(data_datetime.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+class RadarCube:
+    """
+    Time series cube of radar frames.
+
+    Args:
+        path (str): Path of the cube store.
+        mode (str, optional): "r" to read, "a" to append (created if needed). Defaults to "r".
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.file = h5py.File(path, mode)
+        self.lock = threading.Lock()
+
+        self.times = (
+            self.file[TIMES_DATASET][:]
+            if TIMES_DATASET in self.file
+            else np.empty(0, dtype=np.int64)
+        )
+
+    def append(self, frames, datetimes, chunks=CUBE_CHUNKS, compression="lzf"):
+        """
+        Append frames at the end of the cube.
+
+        Args:
+            frames (np.ndarray): Raw radar frames (nb_frames, H, W).
+            datetimes (list): Datetime of every frame, sorted and later than the last frame of the cube.
+            chunks (tuple, optional): Chunks of the cube (used at creation). Defaults to CUBE_CHUNKS.
+            compression (str, optional): h5 compression filter (used at creation). Defaults to "lzf".
+        """
+        times = np.array([to_timestamp(d) for d in datetimes], dtype=np.int64)
+        if np.any(np.diff(times) <= 0) or (
+            len(self.times) > 0 and times[0] <= self.times[-1]
+        ):
+            raise ValueError(
+                "Appended frames must be sorted and later than the last frame of the cube."
+            )
+
+        with self.lock:
+            if CUBE_DATASET not in self.file:
+                self.file.create_dataset(
+                    CUBE_DATASET,
+                    shape=(0,) + frames.shape[1:],
+                    maxshape=(None,) + frames.shape[1:],
+                    dtype=np.uint16,
+                    chunks=chunks,
+                    compression=compression,
+                    shuffle=True,
+                    fillvalue=RADAR_NODATA,
+                )
+                self.file.create_dataset(
+                    TIMES_DATASET, shape=(0,), maxshape=(None,), dtype=np.int64
+                )
+
+            cube = self.file[CUBE_DATASET]
+            start = cube.shape[0]
+            cube.resize(start + len(frames), axis=0)
+            cube[start:] = frames
+
+            # timestamps are written last: a frame is visible once its timestamp is
+            self.file[TIMES_DATASET].resize(start + len(frames), axis=0)
+            self.file[TIMES_DATASET][start:] = times
+            self.file.flush()
+
+            self.times = np.concatenate([self.times, times])
+
+    def rows(self, datetimes):
+        """
+        Get the rows of frames in the cube.
+
+        Args:
+            datetimes (list): Datetimes of the frames.
+
+        Returns:
+            np.ndarray: Row of every frame, -1 if the frame is not in the cube.
+        """
+        times = np.array([to_timestamp(d) for d in datetimes], dtype=np.int64)
+        rows = np.searchsorted(self.times, times)
+        found = rows < len(self.times)
+        found[found] = self.times[rows[found]] == times[found]
+        return np.where(found, rows, -1)
+
+    def read_window(self, start, stop, x, y, size, stride=2):
+        """
+        Read a temporal window of frames at a location.
+
+        Args:
+            start (int): First row (inclusive).
+            stop (int): Last row (exclusive).
+            x (int): Position on the first spatial axis.
+            y (int): Position on the second spatial axis.
+            size (int): Size of the window at the stride resolution.
+            stride (int, optional): Spatial stride. Defaults to 2.
+
+        Returns:
+            np.ndarray: Raw radar frames (stop - start, size, size).
+        """
+        with self.lock:
+            return self.file[CUBE_DATASET][
+                start:stop,
+                x : (x + size * stride) : stride,
+                y : (y + size * stride) : stride,
+            ]
+
+    def close(self):
+        self.file.close()
+
+
+def build_radar_cube(
+    radar_file_paths,
+    datetimes,
+    main_dir,
+    output_path,
+    chunks=CUBE_CHUNKS,
+    compression="lzf",
+    num_workers=6,
+    rebuild=False,
+):
+    """
+    Append the radar frames later than the last frame of the cube to the cube.
+
+    The frames are read by num_workers threads and appended one temporal chunk
+    (chunks[0] frames) at a time, so every chunk is compressed and written once.
+    The frames missing from the cube but earlier than its last frame (backfilled)
+    cannot be appended: they are reported and skipped, unless rebuild is True, in
+    which case a new cube is built from all the frames and replaces the old one
+    once complete.
+
+    Args:
+        radar_file_paths (list): Radar file paths (relative to main_dir, as in index.parquet).
+        datetimes (list): Datetime of every radar file.
+        main_dir (str): Main data directory.
+        output_path (str): Path of the cube store (created if needed).
+        chunks (tuple, optional): Chunks of the cube. Defaults to CUBE_CHUNKS.
+        compression (str, optional): h5 compression filter. Defaults to "lzf".
+        num_workers (int, optional): Number of reader threads. Defaults to 6.
+        rebuild (bool, optional): Rebuild the cube from all the frames. Defaults to False.
+
+    Returns:
+        int: Number of frames appended to the cube.
+    """
+    if rebuild:
+        # built aside, the old cube stays readable until the new one is complete
+        tmp_path = output_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        nb_added = build_radar_cube(
+            radar_file_paths,
+            datetimes,
+            main_dir,
+            tmp_path,
+            chunks=chunks,
+            compression=compression,
+            num_workers=num_workers,
+        )
+        os.replace(tmp_path, output_path)
+        return nb_added
+
+    cube = RadarCube(output_path, mode="a")
+
+    # sorted frames later than the last frame of the cube (one frame per timestamp)
+    last = cube.times[-1] if len(cube.times) > 0 else None
+    todo = []
+    for k in sorted(range(len(datetimes)), key=lambda k: datetimes[k]):
+        timestamp = to_timestamp(datetimes[k])
+        if last is None or timestamp > last:
+            todo.append(k)
+            last = timestamp
+
+    print(f"{len(todo)} radar frames to append to the cube ({len(cube.times)} already in it).")
+
+    # frames missing from the cube but earlier than its last frame (backfilled gaps)
+    if len(cube.times) > 0:
+        missing = cube.rows(datetimes) < 0
+        backfilled = sorted(
+            {
+                datetimes[k]
+                for k in np.flatnonzero(missing)
+                if to_timestamp(datetimes[k]) < cube.times[-1]
+            }
+        )
+        if backfilled:
+            shown = ", ".join(d.strftime("%Y-%m-%d %H:%M") for d in backfilled[:10])
+            more = f" and {len(backfilled) - 10} more" if len(backfilled) > 10 else ""
+            print(
+                f"{len(backfilled)} radar frames earlier than the last frame of the cube "
+                f"are not in it and are skipped (append only): {shown}{more}. "
+                "Rebuild the cube to add them (rebuild=True)."
+            )
+
+    def read(k):
+        return read_radar_frame(os.path.join(main_dir, str(radar_file_paths[k])))
+
+    batch_size = chunks[0]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for start in tqdm(range(0, len(todo), batch_size), desc="Appending to the cube"):
+            batch = todo[start : start + batch_size]
+            frames = list(executor.map(read, batch))
+            cube.append(
+                np.stack(frames, axis=0),
+                [datetimes[k] for k in batch],
+                chunks=chunks,
+                compression=compression,
+            )
+
+    cube.close()
+
+    return len(todo)
@@ -0,0 +1,185 @@
+"""
+Module to build and read a multi-resolution pyramid cache of the radar frames.
+
+With RADAR_POOLING = "nearest" (default), the dataset generation reads the radar
+frames with a stride of 2, which pulls the full resolution chunks of the h5 files
+from disk although only a quarter of the pixels are used. Here every frame is stored once
+per level (2x, 4x downsampling by default, "nearest" pooling so that the 2x level
+is exactly frame[::2, ::2]) in a single chunked and compressed h5 store, keyed by
+timestamp:
+
+    radar_pyramid.h5
+    ├── level_2/<YYYYmmddHHMM>   (1736, 1736) uint16
+    └── level_4/<YYYYmmddHHMM>   (868, 868) uint16
+
+There is no 1x level by default: it would be a copy of the h5 files, which are
+read directly at full resolution. A patch is then read from the level it needs,
+with contiguous reads of a few chunks. The store is incremental: the frames already
+in it are skipped. Every reader thread has its own handle on the store, so the
+threads do not share the state of an h5py handle. The reads themselves are not
+parallel: h5py serialises all its calls on a global lock, the threads only overlap
+the h5 reads with the rest of their work (pooling, normalisation).
+"""
+
+import os
+import threading
+
+import h5py
+import numpy as np
+
+from meteolibre_dataset.pipeline import BoundedPipeline, Stage
+from meteolibre_dataset.pooling import multi_scale_pool
+from meteolibre_dataset.radar_coverage import read_radar_frame
+
+PYRAMID_LEVELS = [2, 4]
+PYRAMID_CHUNK_SIZE = 256
+
+
+def pyramid_key(data_datetime):
+    """
+    Get the key of a radar frame in the pyramid store.
+
+    Args:
+        data_datetime (datetime.datetime): Datetime of the radar frame.
+
+    Returns:
+        str: The key (e.g. 202501031200).
+    """
+    return data_datetime.strftime("%Y%m%d%H%M")
+
+
+def build_radar_pyramid(
+    radar_file_paths,
+    datetimes,
+    main_dir,
+    output_path,
+    levels=PYRAMID_LEVELS,
+    chunk_size=PYRAMID_CHUNK_SIZE,
+    compression="lzf",
+    num_workers=6,
+):
+    """
+    Add the pyramid levels of the radar frames to the pyramid store.
+
+    The frames are read and downsampled by num_workers threads and written by a
+    single thread, with bounded queues in between (see meteolibre_dataset.pipeline).
+
+    Args:
+        radar_file_paths (list): Radar file paths (relative to main_dir, as in index.parquet).
+        datetimes (list): Datetime of every radar file.
+        main_dir (str): Main data directory.
+        output_path (str): Path of the pyramid store (created if needed).
+        levels (list, optional): Downsampling factors. Defaults to PYRAMID_LEVELS.
+        chunk_size (int, optional): Chunk size of the stored frames. Defaults to PYRAMID_CHUNK_SIZE.
+        compression (str, optional): h5 compression filter. Defaults to "lzf".
+        num_workers (int, optional): Number of reader threads. Defaults to 6.
+
+    Returns:
+        int: Number of frames added to the store.
+    """
+    with h5py.File(output_path, "a") as store:
+        for level in levels:
+            store.require_group(f"level_{level}")
+
+        # only the frames missing from one of the levels are (re)computed
+        todo = []
+        for path, data_datetime in zip(radar_file_paths, datetimes):
+            key = pyramid_key(data_datetime)
+            if not all(key in store[f"level_{level}"] for level in levels):
+                todo.append((path, key))
+
+        nb_done = len(radar_file_paths) - len(todo)
+        print(f"{len(todo)} radar frames to add to the pyramid ({nb_done} already done).")
+
+        def read(item):
+            path, key = item
+            frame = read_radar_frame(os.path.join(main_dir, str(path)))
+            pyramid = multi_scale_pool(frame[None, :, :, None], levels, op="nearest")
+            return key, {level: pyramid[level][0, :, :, 0] for level in levels}
+
+        def write(item):
+            key, pyramid = item
+            for level, frame in pyramid.items():
+                group = store[f"level_{level}"]
+                if key in group:
+                    del group[key]
+                chunks = tuple(min(chunk_size, s) for s in frame.shape)
+                group.create_dataset(
+                    key, data=frame, chunks=chunks, compression=compression, shuffle=True
+                )
+            return key
+
+        pipeline = BoundedPipeline(
+            [
+                Stage("read", read, num_workers=num_workers),
+                Stage("write", write, num_workers=1),
+            ]
+        )
+        pipeline.run(todo)
+        print(pipeline.report())
+
+    return len(todo)
+
+
+class RadarPyramid:
+    """
+    Reader of the radar pyramid store.
+
+    Args:
+        path (str): Path of the pyramid store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.files = []
+        self.lock = threading.Lock()
+        self.levels = sorted(int(name.split("_")[1]) for name in self._file().keys())
+
+    def _file(self):
+        # handle of the current thread, opened on its first read
+        file = getattr(self.local, "file", None)
+        if file is None:
+            file = h5py.File(self.path, "r")
+            self.local.file = file
+            with self.lock:
+                self.files.append(file)
+        return file
+
+    def has(self, key, level):
+        """
+        Check if a frame is available at a level.
+        """
+        return level in self.levels and key in self._file()[f"level_{level}"]
+
+    def read_patches(self, key, positions, size, level):
+        """
+        Read patches of a frame at a level.
+
+        Args:
+            key (str): Key of the frame (see pyramid_key).
+            positions (list): Full resolution (x, y) positions of the patches,
+                              multiples of level.
+            size (int): Size of the patches at the level resolution.
+            level (int): Downsampling factor.
+
+        Returns:
+            np.ndarray: Raw radar patches (nb_patches, size, size).
+        """
+        data = self._file()[f"level_{level}"][key]
+        return np.stack(
+            [
+                data[x // level : x // level + size, y // level : y // level + size]
+                for x, y in positions
+            ],
+            axis=0,
+        )
+
+    def close(self):
+        """
+        Close the handles of every thread.
+        """
+        with self.lock:
+            for file in self.files:
+                file.close()
+            self.files = []
@@ -0,0 +1,77 @@
+"""
+Module to transform raw radar frames (uint16 with a no data value) into normalized float32 frames.
+
+The naive transform (cast to int32, replace the no data value, cast to float32,
+divide, then count the valid pixels) makes several full array passes with a
+temporary array for each of them. Here a raw value is mapped to its normalized
+value with a 65536 entries lookup table, so the transform is a single gather
+written directly into the output buffer, and the valid pixel count comes from
+a comparison into a per-thread scratch mask that is reused between calls.
+"""
+
+import threading
+
+import numpy as np
+
+from meteolibre_dataset.radar_coverage import RADAR_NODATA
+
+
+class RadarFrameTransform:
+    """
+    Fused no data replacement + normalisation + valid pixel count of radar frames.
+
+    Args:
+        nodata (int, optional): No data value of the raw frames. Defaults to RADAR_NODATA.
+        default_value (float, optional): Value given to the no data pixels (before
+                                         normalisation). Defaults to -1.
+        normalization (float, optional): Normalisation factor. Defaults to 60.0.
+    """
+
+    def __init__(self, nodata=RADAR_NODATA, default_value=-1, normalization=60.0):
+        self.nodata = nodata
+
+        self.lut = np.arange(65536, dtype=np.float32)
+        self.lut[nodata] = default_value
+        self.lut /= np.float32(normalization)
+
+        self.local = threading.local()
+
+    def _mask(self, shape):
+        # scratch mask of the current thread, reallocated only when the shape changes
+        mask = getattr(self.local, "mask", None)
+        if mask is None or mask.shape != shape:
+            mask = np.empty(shape, dtype=bool)
+            self.local.mask = mask
+        return mask
+
+    def __call__(self, raw, out=None):
+        """
+        Transform a stack of raw radar frames.
+
+        Args:
+            raw (np.ndarray): Raw uint16 frames (..., H, W), e.g. (nb_patches, T, H, W).
+            out (np.ndarray, optional): float32 output buffer of the same shape
+                                        (allocated if None).
+
+        Returns:
+            tuple: A tuple containing:
+                - out (np.ndarray): The normalized frames.
+                - nb_valid (np.ndarray): Number of valid (not no data) pixels per frame (...).
+        """
+        raw = np.asarray(raw)
+        if raw.dtype != np.uint16:
+            raw = raw.astype(np.uint16)
+
+        if out is None:
+            out = np.empty(raw.shape, dtype=np.float32)
+
+        # mode="clip" avoids the buffered copy of mode="raise" (uint16 is always in range)
+        np.take(self.lut, raw, out=out, mode="clip")
+
+        mask = self._mask(raw.shape)
+        np.not_equal(raw, self.nodata, out=mask)
+        nb_valid = np.count_nonzero(
+            mask.reshape(raw.shape[:-2] + (-1,)), axis=-1
+        )
+
+        return out, nb_valid
@@ -0,0 +1,231 @@
+"""
+Module to handle the static layers (ground height and landcover) of the HF dataset.
+
+Those layers are fixed rasters (3472x3472) that do not depend on time, a sample
+patch is fully determined by its position (x, y). Instead of writing a crop of
+them for every sample, we save them once in the dataset folder (as .npy files
+that can be memory mapped) and crop them on demand at training time.
+
+The layers are prepared once from the assets: normalized, stored as float32 and
+written channel by channel (the statistics are accumulated in float64 over blocks
+of rows, so there is no float64 copy of a full layer), with the normalisation
+statistics and the size / mtime of their sources saved next to them (stats.json).
+Any number of workers can then attach to them without copy by memory mapping the
+.npy files (load_static_layers).
+"""
+
+import os
+import json
+
+import numpy as np
+
+STATIC_DIR = "static"
+STATS_FILE = "stats.json"
+STATS_BLOCK_ROWS = 256  # rows per block for the statistics (float64 temporaries)
+
+STATIC_LAYERS = ["ground_height_image", "landcover_image"]
+
+
+def get_static_layer_path(hf_dataset_dir, name):
+    """
+    Get the path of a static layer inside the HF dataset folder.
+
+    Args:
+        hf_dataset_dir (str): Path to the HF dataset folder.
+        name (str): Name of the static layer (ground_height_image or landcover_image).
+
+    Returns:
+        str: Path of the .npy file.
+    """
+    return os.path.join(hf_dataset_dir, STATIC_DIR, name + ".npy")
+
+
+def _normalization_stats(data, block_rows=STATS_BLOCK_ROWS):
+    """
+    Compute the mean and std of a layer (float64 accumulation over blocks of rows,
+    the float64 temporaries are the size of one block).
+    """
+    total = 0.0
+    for start in range(0, data.shape[0], block_rows):
+        total += float(np.sum(data[start : start + block_rows], dtype=np.float64))
+    mean = total / data.size
+
+    squares = 0.0
+    for start in range(0, data.shape[0], block_rows):
+        deviation = data[start : start + block_rows].astype(np.float64) - mean
+        squares += float(np.dot(deviation.ravel(), deviation.ravel()))
+    std = (squares / data.size) ** 0.5
+
+    return mean, std
+
+
+def _source_versions(paths):
+    """
+    Size and mtime of the source files, to detect a change of the assets.
+    """
+    versions = []
+    for path in paths:
+        stat = os.stat(path)
+        versions.append(f"{stat.st_size}-{stat.st_mtime_ns}")
+    return versions
+
+
+def prepare_static_layers(
+    hf_dataset_dir, ground_height_path, landcover_path_template, landcover_classes
+):
+    """
+    Prepare the normalized float32 static layers once in the HF dataset folder.
+
+    The layers are written directly into memory mapped .npy files, one channel at
+    a time, and the normalisation statistics are saved in stats.json. If the
+    layers are already prepared with the same sources (paths, sizes and mtimes),
+    nothing is done.
+
+    Args:
+        hf_dataset_dir (str): Path to the HF dataset folder.
+        ground_height_path (str): Path to the ground height .npy asset.
+        landcover_path_template (str): Path to the landcover .npz assets, with a {} for the class.
+        landcover_classes (list): Landcover classes to stack as channels.
+
+    Returns:
+        dict: The normalisation statistics of the layers.
+    """
+    static_dir = os.path.join(hf_dataset_dir, STATIC_DIR)
+    os.makedirs(static_dir, exist_ok=True)
+
+    sources = {
+        "ground_height_image": [ground_height_path],
+        "landcover_image": [landcover_path_template.format(c) for c in landcover_classes],
+    }
+
+    versions = {name: _source_versions(paths) for name, paths in sources.items()}
+
+    stats_path = os.path.join(static_dir, STATS_FILE)
+    if os.path.exists(stats_path) and all(
+        os.path.exists(get_static_layer_path(hf_dataset_dir, name))
+        for name in STATIC_LAYERS
+    ):
+        stats = load_static_stats(hf_dataset_dir)
+        if all(
+            stats[name]["sources"] == sources[name]
+            and stats[name].get("versions") == versions[name]
+            for name in STATIC_LAYERS
+        ):
+            return stats
+
+    stats = {}
+
+    # ground height (H, W)
+    data = np.load(ground_height_path)
+    mean, std = _normalization_stats(data)
+    layer = np.lib.format.open_memmap(
+        get_static_layer_path(hf_dataset_dir, "ground_height_image"),
+        mode="w+",
+        dtype=np.float32,
+        shape=data.shape,
+    )
+    np.subtract(data, mean, out=layer, dtype=np.float32)
+    layer /= np.float32(std)
+    layer.flush()
+    del layer
+    stats["ground_height_image"] = {
+        "sources": sources["ground_height_image"],
+        "versions": versions["ground_height_image"],
+        "mean": [mean],
+        "std": [std],
+    }
+
+    # landcover (H, W, nb_classes)
+    layer = None
+    means = []
+    stds = []
+    for k, path in enumerate(sources["landcover_image"]):
+        data = np.load(path)["arr_0"]
+        if layer is None:
+            layer = np.lib.format.open_memmap(
+                get_static_layer_path(hf_dataset_dir, "landcover_image"),
+                mode="w+",
+                dtype=np.float32,
+                shape=data.shape + (len(landcover_classes),),
+            )
+        mean, std = _normalization_stats(data)
+        channel = np.subtract(data, mean, dtype=np.float32)
+        channel /= np.float32(std)
+        layer[:, :, k] = channel
+        means.append(mean)
+        stds.append(std)
+    layer.flush()
+    del layer
+    stats["landcover_image"] = {
+        "sources": sources["landcover_image"],
+        "versions": versions["landcover_image"],
+        "classes": list(landcover_classes),
+        "mean": means,
+        "std": stds,
+    }
+
+    with open(stats_path, "w") as f:
+        json.dump(stats, f, indent=2)
+
+    return stats
+
+
+def load_static_stats(hf_dataset_dir):
+    """
+    Load the normalisation statistics of the static layers.
+
+    Args:
+        hf_dataset_dir (str): Path to the HF dataset folder.
+
+    Returns:
+        dict: Static layer name -> {"sources", "versions", "mean", "std"} (one value per channel).
+    """
+    with open(os.path.join(hf_dataset_dir, STATIC_DIR, STATS_FILE), "r") as f:
+        return json.load(f)
+
+
+def load_static_layers(hf_dataset_dir, mmap_mode="r"):
+    """
+    Load (attach to) the static layers prepared with prepare_static_layers.
+
+    With the default memory mapping, the layers are shared through the page cache
+    by every process that loads them.
+
+    Args:
+        hf_dataset_dir (str): Path to the HF dataset folder.
+        mmap_mode (str, optional): Memory mapping mode given to np.load, use None
+                                   to load the arrays in memory. Defaults to "r".
+
+    Returns:
+        dict: Static layer name -> array (memory mapped by default).
+    """
+    return {
+        name: np.load(get_static_layer_path(hf_dataset_dir, name), mmap_mode=mmap_mode)
+        for name in STATIC_LAYERS
+    }
+
+
+def crop_static_layers(static_layers, x, y, shape_extracted_image=256, stride=2):
+    """
+    Crop the static layers for a sample patch.
+
+    The crop is the same as the one done on the radar data during the dataset
+    generation: a (shape_extracted_image * stride) window starting at (x, y),
+    subsampled with the given stride.
+
+    Args:
+        static_layers (dict): Static layers as returned by load_static_layers.
+        x (int): Patch position on the first axis (patch_x in the index).
+        y (int): Patch position on the second axis (patch_y in the index).
+        shape_extracted_image (int, optional): Size of the patch. Defaults to 256.
+        stride (int, optional): Subsampling factor. Defaults to 2.
+
+    Returns:
+        dict: Static layer name -> cropped array.
+    """
+    size = shape_extracted_image * stride
+
+    return {
+        name: np.array(layer[x : (x + size) : stride, y : (y + size) : stride])
+        for name, layer in static_layers.items()
+    }
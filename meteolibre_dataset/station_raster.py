@@ -0,0 +1,133 @@
+"""
+Module to rasterise the ground station measurements on the radar grid.
+
+Writing every station into its pixel with image[y, x] = measurements makes the
+last write win when two stations fall in the same pixel, and leaves a very
+sparse signal. Here the stations are splatted with a footprint and the values
+falling in the same pixel are reduced:
+
+- footprint ("splat"): "point" (one pixel), "disk" (every pixel within radius)
+  or "gaussian" (pixels within radius weighted by exp(-d^2 / 2 sigma^2)).
+- reduction: "mean" (weighted mean), "max" or "count" (number of stations), the
+  contributions of the touched pixels are accumulated with np.bincount /
+  np.maximum.at (vectorised, deterministic), missing (NaN) measurements are
+  ignored per channel.
+
+Any window of the grid can be rasterised (e.g. only the 512 x 512 crop of a
+patch during the dataset generation), the stations whose footprint does not
+reach the window are ignored. Pixels without any contribution are set to nodata.
+"""
+
+import numpy as np
+
+from meteolibre_dataset.pooling import GROUNDSTATION_NODATA
+
+GRID_SIZE = 3472
+REDUCTIONS = ("mean", "max", "count")
+SPLATS = ("point", "disk", "gaussian")
+
+
+def splat_footprint(splat="point", radius=0, sigma=1.0):
+    """
+    Offsets and weights of the pixels of a footprint.
+
+    Args:
+        splat (str, optional): "point", "disk" or "gaussian". Defaults to "point".
+        radius (int, optional): Radius of the footprint in pixels (disk, gaussian). Defaults to 0.
+        sigma (float, optional): Standard deviation of the gaussian in pixels. Defaults to 1.0.
+
+    Returns:
+        tuple: (dy, dx, weight) arrays of the pixels of the footprint.
+    """
+    if splat not in SPLATS:
+        raise ValueError(f"Unknown splat {splat}, expected one of {SPLATS}")
+    if splat == "point" or radius == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), np.ones(1)
+
+    dy, dx = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    distance2 = dy**2 + dx**2
+    inside = distance2 <= radius**2
+    if splat == "disk":
+        weight = np.ones(inside.sum())
+    else:
+        weight = np.exp(-distance2[inside] / (2 * sigma**2))
+
+    return dy[inside].astype(np.int64), dx[inside].astype(np.int64), weight
+
+
+def rasterize_stations(
+    position_x,
+    position_y,
+    measurements,
+    window=(0, 0, GRID_SIZE, GRID_SIZE),
+    reduction="mean",
+    splat="point",
+    radius=0,
+    sigma=1.0,
+    nodata=GROUNDSTATION_NODATA,
+):
+    """
+    Rasterise station measurements on a window of the grid.
+
+    Args:
+        position_x (np.ndarray): Column of every station in the grid.
+        position_y (np.ndarray): Row of every station in the grid.
+        measurements (np.ndarray): Measurements of shape (nb_stations, nb_channels), NaN if missing.
+        window (tuple, optional): (row, column, height, width) of the window in the grid.
+                                  Defaults to the whole grid.
+        reduction (str, optional): "mean", "max" or "count". Defaults to "mean".
+        splat (str, optional): "point", "disk" or "gaussian". Defaults to "point".
+        radius (int, optional): Radius of the footprint in pixels. Defaults to 0.
+        sigma (float, optional): Standard deviation of the gaussian footprint. Defaults to 1.0.
+        nodata (float, optional): Value of the pixels without station. Defaults to GROUNDSTATION_NODATA.
+
+    Returns:
+        np.ndarray: Image of shape (height, width, nb_channels), float32.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction {reduction}, expected one of {REDUCTIONS}")
+
+    row, column, height, width = window
+    nb_channels = measurements.shape[1]
+
+    dy, dx, weight = splat_footprint(splat, radius, sigma)
+
+    # pixels of the footprints of all the stations (nb_stations, footprint size)
+    rows = np.asarray(position_y, dtype=np.int64)[:, None] + dy[None, :] - row
+    columns = np.asarray(position_x, dtype=np.int64)[:, None] + dx[None, :] - column
+    inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+
+    station, pixel = np.nonzero(inside)
+    flat = rows[station, pixel] * width + columns[station, pixel]
+    weights = weight[pixel]
+    values = np.asarray(measurements, dtype=np.float64)[station]
+    valid = ~np.isnan(values)
+
+    # accumulation on the touched pixels only (not on the whole window)
+    pixels, inverse = np.unique(flat, return_inverse=True)
+    nb_touched = len(pixels)
+
+    image = np.full((height * width, nb_channels), nodata, dtype=np.float32)
+
+    for c in range(nb_channels):
+        valid_c = valid[:, c]
+        inverse_c = inverse[valid_c]
+        if reduction == "max":
+            maximum = np.full(nb_touched, -np.inf)
+            np.maximum.at(maximum, inverse_c, values[valid_c, c])
+            filled = maximum > -np.inf
+            image[pixels[filled], c] = maximum[filled]
+            continue
+
+        weights_c = weights[valid_c]
+        total_weight = np.bincount(inverse_c, weights=weights_c, minlength=nb_touched)
+        filled = total_weight > 0
+        if reduction == "count":
+            image[pixels[filled], c] = np.bincount(inverse_c, minlength=nb_touched)[filled]
+        else:
+            total = np.bincount(
+                inverse_c, weights=weights_c * values[valid_c, c], minlength=nb_touched
+            )
+            image[pixels[filled], c] = total[filled] / total_weight[filled]
+
+    return image.reshape(height, width, nb_channels)
@@ -0,0 +1,355 @@
+"""
+Module with a small storage layer for the buckets used by the scripts.
+
+A storage is opened from a URL with open_storage:
+
+- "gs://bucket" (or "gs://bucket/prefix"): Google Cloud Storage (GCSStorage), one
+  client per storage with an HTTP connection pool sized for the batch operations.
+- any other path ("/tmp/fake_bucket", "file:///tmp/fake_bucket"): a local directory
+  used as a bucket (LocalStorage), to run, test and benchmark the download, upload
+  and listing paths on a machine with no network.
+
+Every storage has the same operations: list, get, put, exists, and the batch
+variants get_many / put_many (thread pool, retries with exponential backoff).
+get writes the file under a temporary name and renames it once complete.
+
+It can also be used from the command line to copy a file (e.g. in shell scripts):
+
+    python -m meteolibre_dataset.storage cp hf_dataset.zip gs://meteofrance-preprocess/hf_dataset.zip
+"""
+
+import os
+import sys
+import time
+import bisect
+import random
+import shutil
+import functools
+import threading
+import concurrent.futures
+
+from tqdm import tqdm
+
+
+def with_retry(func, max_retries=5, backoff=1.0, max_backoff=60.0):
+    """
+    Call func, retrying with exponential backoff (and jitter) if it raises.
+
+    Args:
+        func (callable): Function without arguments.
+        max_retries (int, optional): Maximum number of retries. Defaults to 5.
+        backoff (float, optional): Delay before the first retry in seconds (doubled at
+                                   every retry). Defaults to 1.0.
+        max_backoff (float, optional): Maximum delay between two tries. Defaults to 60.0.
+
+    Returns:
+        The result of func.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception:
+            if attempt == max_retries:
+                raise
+            delay = min(backoff * 2**attempt, max_backoff)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+class Storage:
+    """
+    Base class of the storages: the backends implement list, exists, _get and _put.
+
+    Args:
+        max_retries (int, optional): Maximum number of retries of get / put. Defaults to 5.
+        backoff (float, optional): Delay before the first retry in seconds. Defaults to 1.0.
+    """
+
+    def __init__(self, max_retries=5, backoff=1.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def list(self, prefix=""):
+        """
+        List the objects whose name starts with prefix.
+
+        Args:
+            prefix (str, optional): Prefix of the names. Defaults to "".
+
+        Returns:
+            iterator: Dicts with the name, size and generation of every object.
+        """
+        raise NotImplementedError
+
+    def exists(self, name):
+        """
+        Check if an object exists.
+        """
+        raise NotImplementedError
+
+    def _get(self, name, path):
+        raise NotImplementedError
+
+    def _put(self, path, name):
+        raise NotImplementedError
+
+    def get(self, name, path):
+        """
+        Download an object to a local file (temporary file renamed once complete, with retries).
+
+        Args:
+            name (str): Name of the object.
+            path (str): Local path.
+        """
+        tmp_path = path + ".tmp"
+
+        def download():
+            try:
+                self._get(name, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        with_retry(download, max_retries=self.max_retries, backoff=self.backoff)
+
+    def put(self, path, name):
+        """
+        Upload a local file as an object (with retries).
+
+        Args:
+            path (str): Local path.
+            name (str): Name of the object.
+        """
+        with_retry(
+            lambda: self._put(path, name), max_retries=self.max_retries, backoff=self.backoff
+        )
+
+    def _run_many(self, func, pairs, num_workers, desc):
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(func, a, b): a for a, b in pairs}
+            for future in tqdm(
+                concurrent.futures.as_completed(futures),
+                total=len(futures),
+                desc=desc,
+                unit="file",
+            ):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"{desc} failed for {futures[future]}: {e}")
+                    failed.append((futures[future], str(e)))
+        return failed
+
+    def get_many(self, names, paths, num_workers=16):
+        """
+        Download objects concurrently.
+
+        Args:
+            names (list): Names of the objects.
+            paths (list): Local path of every object.
+            num_workers (int, optional): Number of threads. Defaults to 16.
+
+        Returns:
+            list: (name, error) of the objects that could not be downloaded.
+        """
+        return self._run_many(self.get, zip(names, paths), num_workers, "Downloading")
+
+    def put_many(self, paths, names, num_workers=16):
+        """
+        Upload local files concurrently.
+
+        Args:
+            paths (list): Local paths.
+            names (list): Object name of every file.
+            num_workers (int, optional): Number of threads. Defaults to 16.
+
+        Returns:
+            list: (path, error) of the files that could not be uploaded.
+        """
+        return self._run_many(self.put, zip(paths, names), num_workers, "Uploading")
+
+
+class GCSStorage(Storage):
+    """
+    Google Cloud Storage bucket, one client shared by all the threads.
+
+    Args:
+        bucket_name (str): Name of the bucket.
+        prefix (str, optional): Prefix added to every object name. Defaults to "".
+        pool_size (int, optional): Size of the HTTP connection pool. Defaults to 32.
+        **kwargs: Retry parameters of Storage.
+    """
+
+    def __init__(self, bucket_name, prefix="", pool_size=32, **kwargs):
+        super().__init__(**kwargs)
+
+        import google.auth
+        import requests
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import storage
+
+        # credentials resolved once, connection pool sized for the batch operations
+        credentials, project = google.auth.default()
+        session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        session.mount("https://", adapter)
+
+        self.client = storage.Client(project=project, credentials=credentials, _http=session)
+        self.bucket = self.client.bucket(bucket_name)
+        self.prefix = prefix
+
+    def list(self, prefix=""):
+        for blob in self.client.list_blobs(self.bucket, prefix=self.prefix + prefix):
+            yield {
+                "name": blob.name[len(self.prefix) :],
+                "size": blob.size,
+                "generation": blob.generation,
+            }
+
+    def exists(self, name):
+        return self.bucket.blob(self.prefix + name).exists()
+
+    def _get(self, name, path):
+        self.bucket.blob(self.prefix + name).download_to_filename(path)
+
+    def _put(self, path, name):
+        self.bucket.blob(self.prefix + name).upload_from_filename(path)
+
+
+class LocalStorage(Storage):
+    """
+    Local directory used as a bucket (object names are relative paths).
+
+    The sorted entries of every listed directory are cached with the mtime of the
+    directory, so listing many prefixes (e.g. one per day) reads a directory once
+    and finds the names of every prefix by bisection.
+
+    Args:
+        root (str): Root directory of the bucket (created if needed).
+        pool_size (int, optional): Unused (same parameters as GCSStorage).
+        **kwargs: Retry parameters of Storage.
+    """
+
+    def __init__(self, root, pool_size=None, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+        self.listings = {}
+        self.lock = threading.Lock()
+
+    def _entries(self, relative_dir):
+        # sorted (files, subdirectories) of a directory, listed again when its mtime changes
+        directory = os.path.join(self.root, relative_dir)
+        mtime = os.stat(directory).st_mtime_ns
+        with self.lock:
+            listing = self.listings.get(relative_dir)
+        if listing is not None and listing[0] == mtime:
+            return listing[1], listing[2]
+
+        files = []
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                else:
+                    files.append(entry.name)
+        listing = (mtime, sorted(files), sorted(subdirectories))
+        with self.lock:
+            self.listings[relative_dir] = listing
+        return listing[1], listing[2]
+
+    def _list(self, relative_dir, start):
+        files, subdirectories = self._entries(relative_dir)
+
+        # names of the directory starting with start
+        for file in files[bisect.bisect_left(files, start) :]:
+            if not file.startswith(start):
+                break
+            if file.endswith(".tmp"):
+                continue
+            name = f"{relative_dir}/{file}" if relative_dir else file
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except FileNotFoundError:
+                continue
+            yield {"name": name, "size": stat.st_size, "generation": stat.st_mtime_ns}
+
+        for subdirectory in subdirectories:
+            if subdirectory.startswith(start):
+                yield from self._list(
+                    f"{relative_dir}/{subdirectory}" if relative_dir else subdirectory, ""
+                )
+
+    def list(self, prefix=""):
+        # only the directory of the prefix (and its matching subdirectories) is listed
+        relative_dir, _, start = prefix.rpartition("/")
+        if not os.path.isdir(os.path.join(self.root, relative_dir)):
+            return
+        yield from self._list(relative_dir, start)
+
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.root, name))
+
+    def _get(self, name, path):
+        shutil.copyfile(os.path.join(self.root, name), path)
+
+    def _put(self, path, name):
+        destination = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(path, destination + ".tmp")
+        os.replace(destination + ".tmp", destination)
+
+
+@functools.lru_cache(maxsize=None)
+def open_storage(url, **kwargs):
+    """
+    Open a storage from its URL (one storage, and client, per URL).
+
+    Args:
+        url (str): "gs://bucket[/prefix]" for GCS, a local directory (or "file://" URL) otherwise.
+        **kwargs: Parameters of the storage (pool_size, max_retries, backoff).
+
+    Returns:
+        Storage: The storage.
+    """
+    if url.startswith("gs://"):
+        bucket_name, _, prefix = url[len("gs://") :].partition("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        return GCSStorage(bucket_name, prefix=prefix, **kwargs)
+
+    if url.startswith("file://"):
+        url = url[len("file://") :]
+    return LocalStorage(url, **kwargs)
+
+
+def _split_url(url):
+    """
+    Split "gs://bucket/dir/name" (or "/dir/name") into the storage URL and the object name.
+    """
+    if url.startswith("gs://"):
+        bucket_name, _, name = url[len("gs://") :].partition("/")
+        return "gs://" + bucket_name, name
+    return os.path.dirname(url) or ".", os.path.basename(url)
+
+
+if __name__ == "__main__":
+    # python -m meteolibre_dataset.storage cp SOURCE DESTINATION (one of them local)
+    if len(sys.argv) != 4 or sys.argv[1] != "cp":
+        print("Usage: python -m meteolibre_dataset.storage cp SOURCE DESTINATION")
+        sys.exit(1)
+
+    source, destination = sys.argv[2], sys.argv[3]
+    if source.startswith("gs://"):
+        storage_url, name = _split_url(source)
+        open_storage(storage_url).get(name, destination)
+    else:
+        storage_url, name = _split_url(destination)
+        open_storage(storage_url).put(source, name)
+    print(f"Copied {source} to {destination}.")
@@ -0,0 +1,142 @@
+"""
+Module to precompute the temporal windows of the dataset generation.
+
+A window starting at row i of the (sorted) index uses the frames of the rows
+i + 1 to i + nb_back_steps + nb_future_steps: nb_back_steps past frames (the last
+one is the current frame, row i + nb_back_steps) and nb_future_steps future frames.
+
+For every window start, and in one vectorised pass over the index, we compute:
+
+- offsets: time offset of every frame from the current frame (minutes).
+- frame_valid: past frames older than max_back_age are invalid (replaced by a
+  no data frame by the generation), future frames are invalid if the gap with
+  the previous frame is larger than max_gap.
+- valid: the window is valid if all its future frames are valid.
+
+The generation then skips the invalid windows before doing any I/O.
+"""
+
+import numpy as np
+
+WINDOWS_FILE = "windows.npz"
+MAX_GAP_MINUTES = 30  # radar / ground station frames are every 30 minutes
+
+
+def default_max_back_age(nb_back_steps):
+    """
+    Get the default maximum age of the past frames (minutes), (nb_back_steps // 2 + 1) hours.
+    """
+    return (nb_back_steps // 2 + 1) * 60
+
+
+def compute_windows(
+    datetimes,
+    nb_back_steps,
+    nb_future_steps,
+    max_gap_minutes=MAX_GAP_MINUTES,
+    max_back_age_minutes=None,
+):
+    """
+    Compute the offsets and validity of every temporal window of a sorted index.
+
+    Args:
+        datetimes (np.ndarray): Sorted datetimes of the index rows.
+        nb_back_steps (int): Number of past steps (including the current frame).
+        nb_future_steps (int): Number of future steps.
+        max_gap_minutes (int, optional): Maximum gap between two consecutive future
+                                         frames. Defaults to MAX_GAP_MINUTES.
+        max_back_age_minutes (int, optional): Maximum age of the past frames.
+                                              Defaults to default_max_back_age(nb_back_steps).
+
+    Returns:
+        dict: Window arrays, one row per window start (len(datetimes) - nb_back_steps - nb_future_steps):
+            - offsets (np.ndarray): (nb_windows, nb_frames) int32 offsets in minutes.
+            - frame_valid (np.ndarray): (nb_windows, nb_frames) bool.
+            - valid (np.ndarray): (nb_windows,) bool.
+    """
+    if max_back_age_minutes is None:
+        max_back_age_minutes = default_max_back_age(nb_back_steps)
+
+    nb_frames = nb_back_steps + nb_future_steps
+    minutes = np.asarray(datetimes, dtype="datetime64[m]").astype(np.int64)
+    nb_windows = max(len(minutes) - nb_frames, 0)
+
+    # frames of every window: rows i + 1 to i + nb_frames
+    if nb_windows > 0:
+        frames = np.lib.stride_tricks.sliding_window_view(minutes[1:], nb_frames)[:nb_windows]
+    else:
+        frames = np.empty((0, nb_frames), dtype=np.int64)
+    offsets = frames - frames[:, nb_back_steps - 1 : nb_back_steps]
+
+    frame_valid = np.empty(offsets.shape, dtype=bool)
+    frame_valid[:, :nb_back_steps] = -offsets[:, :nb_back_steps] < max_back_age_minutes
+    gaps = np.diff(offsets[:, nb_back_steps - 1 :], axis=1)
+    frame_valid[:, nb_back_steps:] = (gaps > 0) & (gaps <= max_gap_minutes)
+
+    return {
+        "offsets": offsets.astype(np.int32),
+        "frame_valid": frame_valid,
+        "valid": frame_valid[:, nb_back_steps:].all(axis=1),
+    }
+
+
+def save_windows(
+    output_path, windows, nb_back_steps, nb_future_steps, max_gap_minutes, max_back_age_minutes
+):
+    """
+    Save the windows computed with compute_windows with their spec.
+
+    Args:
+        output_path (str): Path of the npz file.
+        windows (dict): Output of compute_windows.
+        nb_back_steps (int): Number of past steps.
+        nb_future_steps (int): Number of future steps.
+        max_gap_minutes (int): Maximum gap between two consecutive future frames.
+        max_back_age_minutes (int): Maximum age of the past frames.
+    """
+    np.savez_compressed(
+        output_path,
+        offsets=windows["offsets"],
+        frame_valid=windows["frame_valid"],
+        valid=windows["valid"],
+        nb_back_steps=np.int32(nb_back_steps),
+        nb_future_steps=np.int32(nb_future_steps),
+        max_gap_minutes=np.int32(max_gap_minutes),
+        max_back_age_minutes=np.int32(max_back_age_minutes),
+    )
+
+
+def load_windows(
+    path, nb_back_steps, nb_future_steps, max_gap_minutes, max_back_age_minutes, nb_rows
+):
+    """
+    Load the windows saved with save_windows if they match the given spec.
+
+    Args:
+        path (str): Path of the npz file.
+        nb_back_steps (int): Number of past steps.
+        nb_future_steps (int): Number of future steps.
+        max_gap_minutes (int): Maximum gap between two consecutive future frames.
+        max_back_age_minutes (int): Maximum age of the past frames.
+        nb_rows (int): Number of rows of the index the windows were computed on.
+
+    Returns:
+        dict: The windows (see compute_windows), None if the file was computed
+              with another spec or index.
+    """
+    with np.load(path) as data:
+        spec = (
+            int(data["nb_back_steps"]),
+            int(data["nb_future_steps"]),
+            int(data["max_gap_minutes"]),
+            int(data["max_back_age_minutes"]),
+        )
+        if spec != (nb_back_steps, nb_future_steps, max_gap_minutes, max_back_age_minutes):
+            return None
+
+        windows = {key: data[key] for key in ["offsets", "frame_valid", "valid"]}
+
+    if len(windows["valid"]) != max(nb_rows - nb_back_steps - nb_future_steps, 0):
+        return None
+
+    return windows
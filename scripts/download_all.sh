@@ -1,21 +1,34 @@
 # !/bin/bash
 # download all the files from the bucket
 # and save them in the current directory
+#
+# the radar files and the ground station data are independent (the ground station
+# npz files take their timestamps from the station data), so both chains run
+# concurrently, the index is created once both are done
 
-# get the list of files (radar info and h5 files)
-python3 get_bucket_list_files.py
+# radar chain: get the list of files (radar info and h5 files)
+# and download all the files (only h5 files)
+(
+    python3 get_bucket_list_files.py &&
+    python3 download_h5_files.py
+) &
+radar_pid=$!
 
-# download all the files (only h5 files)
-python3 download_h5_files.py
+# ground station chain: download ground station data, preprocess it
+# and create the npz files
+(
+    python3 download_groundstation.py &&
+    python3 preprocess_groundstations.py &&
+    python3 groundstation_npz_writing.py
+) &
+groundstation_pid=$!
 
-# download ground station data
-python3 download_groundstation.py
-
-# preprocess ground station data
-python3 preprocess_groundstations.py
-
-# creation of npz files (only radar/info files)
-python3 groundstation_npz_writing.py
+status=0
+wait $radar_pid || { echo "radar download failed"; status=1; }
+wait $groundstation_pid || { echo "ground station processing failed"; status=1; }
+if [ $status -ne 0 ]; then
+    exit $status
+fi
 
 # index creation (for h5 files) (only radar/info files)
-python3 index_creation.py
\ No newline at end of file
+python3 index_creation.py
@@ -14,7 +14,12 @@ The list of files already exist nothing to be done in reality
 
 import pandas as pd
 import os
-import datetime
+import urllib.request
+import concurrent.futures
+
+from meteolibre_dataset.groundstations import csv_to_parquet
+
+NUM_WORKERS = 8  # departments downloaded and converted in parallel
 
 # 2. we first take a look at the data.gouv files to get the url of the historical data
 file_ressources = "../data/datagouv/2ad89e9d0b014ad0fc3b605dc69b9d41.parquet"
@@ -35,39 +40,30 @@ data_to_download = ressources_meteofrance.loc[idx]
 
 data_to_download[["description", "url"]].head().values
 
-# loop over data_to_download and download the data from dataset.url col
-for url in data_to_download["url"]:
-    # apply the command :
-    # !wget {url} -O ../data/groundstations/{url.split("/")[-1]}
-    os.system(f"wget {url} -O ../data/groundstations/{url.split('/')[-1]}")
-
-
-## now for each files in data/groundstations we unzip the .gz files read it, create a parquet file
-list_files = os.listdir("../data/groundstations")
-
-# only .gz file
-list_files = [f for f in list_files if f.endswith(".gz")]
-#list_files = [f for f in list_files if f.endswith(".csv")]
 
-# we loop over the file and unzip it read it save it into parquet format and delete the .gz file
-for file in list_files:
+# download and convert the departments in parallel: every .csv.gz is converted to parquet
+# batch by batch (explicit schema, no decompressed csv on disk) and deleted
+def download_and_convert(url):
+    file = url.split("/")[-1]
+    gz_path = f"../data/groundstations/{file}"
     try:
-        print(file)
-        # command : !gzip -d ../data/groundstations/{file}
-        os.system(f"gzip -d ../data/groundstations/{file}")
+        urllib.request.urlretrieve(url, gz_path + ".tmp")
+        os.replace(gz_path + ".tmp", gz_path)
 
-        # remove the last .gz
-        file = file[:-3]
-
-        # read the csv file
-        df = pd.read_csv(f"../data/groundstations/{file}", sep=";")
-
-        # save it into parquet format
-        df.to_parquet(f"../data/groundstations_parquet/{file.split('.')[0]}.parquet")
+        # same name without the .csv.gz
+        output_path = f"../data/groundstations_parquet/{file.split('.')[0]}.parquet"
+        nb_rows = csv_to_parquet(gz_path, output_path)
+        print(f"{file}: {nb_rows} rows")
 
         # delete the .gz file
-        os.remove(f"../data/groundstations/{file}")
-        
+        os.remove(gz_path)
+
     except Exception as e:
-        print(e)
+        print(f"{file}: {e}")
+
+
+os.makedirs("../data/groundstations", exist_ok=True)
+os.makedirs("../data/groundstations_parquet", exist_ok=True)
 
+with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
+    list(executor.map(download_and_convert, data_to_download["url"]))
@@ -1,34 +1,17 @@
 import os
-from tqdm import tqdm
 
 import pandas as pd
 
-from google.cloud import storage
-import google.auth
+from meteolibre_dataset.bucket_manifest import load_manifest, manifest_diff, save_manifest
+from meteolibre_dataset.downloader import download_files
+from meteolibre_dataset.storage import open_storage
 
-
-def download_file(bucket_name, source_blob_name, destination_file_name):
-    """Downloads a blob from the bucket."""
-    try:
-        credentials, project = google.auth.default()
-        storage_client = storage.Client(credentials=credentials)
-
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(source_blob_name)
-        blob.download_to_filename(destination_file_name)
-
-        print(
-            "Downloaded storage object {} from bucket {} to filename {}.".format(
-                source_blob_name,
-                bucket_name,
-                destination_file_name,
-            )
-        )
-
-    except Exception as e:
-        print(
-            f"Failed to download gs://{bucket_name}/{source_blob_name} to {destination_file_name}: {e}"
-        )
+# "gs://bucket" or a local directory used as a bucket (offline tests / benchmarks)
+STORAGE_URL = "gs://meteofrancedata"
+NUM_WORKERS = 32  # concurrent downloads (one pooled client shared by all of them)
+MAX_RETRIES = 5
+# manifest of the files already downloaded, the downloads are its diff with the bucket manifest
+DOWNLOADED_MANIFEST = "../data/h5_manifest.parquet"
 
 
 def main():
@@ -45,17 +28,36 @@ def main():
         # filter the csv to keep only the h5 files
         df = df[df["name"].str.endswith(".h5")]
 
-        # Assuming the CSV has columns named 'bucket_name' and 'name'
-        for index, row in tqdm(
-            df.iterrows(), total=len(df), desc="Downloading files", unit="file"
-        ):
-            bucket_name = "meteofrancedata"
-            name = row["name"]
-            if name.endswith(".h5"):
-                filename = os.path.basename(name)
-                output_path = os.path.join(output_dir, filename)
-                if not os.path.exists(output_path):
-                    download_file(bucket_name, name, output_path)
+        # files new in the bucket or with a new generation since they were downloaded
+        if os.path.exists(DOWNLOADED_MANIFEST):
+            downloaded, _ = load_manifest(DOWNLOADED_MANIFEST)
+        else:
+            # first run: the files already on disk with the size of the bucket are kept
+            with os.scandir(output_dir) as entries:
+                sizes = {entry.name: entry.stat().st_size for entry in entries}
+            on_disk = df["name"].map(os.path.basename).map(sizes) == df["size"]
+            downloaded = df[on_disk.to_numpy()]
+        todo = manifest_diff(df, downloaded)
+
+        # one client for the whole run, files downloaded concurrently with retries
+        # (temporary file + atomic rename)
+        storage = open_storage(STORAGE_URL, pool_size=NUM_WORKERS, max_retries=MAX_RETRIES)
+        nb_downloaded, failed = download_files(
+            storage,
+            todo["name"].tolist(),
+            output_dir,
+            num_workers=NUM_WORKERS,
+            overwrite=True,
+        )
+
+        failed_names = {name for name, _ in failed}
+        done = todo[~todo["name"].isin(failed_names)]
+        downloaded = pd.concat(
+            [downloaded[~downloaded["name"].isin(done["name"])], done], ignore_index=True
+        )
+        save_manifest(downloaded, DOWNLOADED_MANIFEST)
+
+        print(f"Downloaded {nb_downloaded} files, {len(failed)} failed.")
 
     except FileNotFoundError:
         print(f"Error: CSV file not found at {csv_file}")
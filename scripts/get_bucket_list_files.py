@@ -1,59 +1,75 @@
 """
 This script lists files in a Google Cloud Storage bucket, processes the file names to extract dates,
 filters them, and saves the list to a Parquet file.
+
+The listing is sharded by time prefix (one per product and per day, listed in parallel)
+and kept as an incremental manifest (see meteolibre_dataset.bucket_manifest): a re-run
+only lists the new and the last days. Every FULL_RELIST_DAYS days the whole bucket is
+listed again, which refreshes the older days and logs the files that match no
+product prefix or are older than START_DATE.
 """
 
+import datetime
+
 import pandas as pd
-from google.cloud import storage
-import google.auth
+
+from meteolibre_dataset.bucket_manifest import update_manifest
+from meteolibre_dataset.storage import open_storage
 
 # --- Constants ---
-BUCKET_NAME = "meteofrancedata"
+# "gs://bucket" or a local directory used as a bucket (offline tests / benchmarks)
+STORAGE_URL = "gs://meteofrancedata"
+MANIFEST_FILE = "bucket_manifest.parquet"
 OUTPUT_FILE = "list_files.parquet"
 
+# products of the bucket (T_<product>_C_LFPW_YYYYMMDDhhmmss.<ext>) and listed days
+PRODUCTS = ["T_IPRN20_C_LFPW_", "T_IMFR27_C_LFPW_"]
+START_DATE = datetime.date(2024, 1, 1)
+NUM_WORKERS = 16  # shards listed concurrently
+RELIST_DAYS = 2  # the last days are always listed again (files still arriving), None for a full listing
+FULL_RELIST_DAYS = 7  # the whole bucket is listed again every FULL_RELIST_DAYS days (None: never)
+
 
-def get_file_list_from_bucket(bucket_name: str) -> list[str]:
+def get_file_list_from_bucket(storage_url: str) -> pd.DataFrame:
     """
-    Lists all files in a given GCS bucket.
+    Lists the files of a given bucket (incremental update of the manifest).
 
     Args:
-        bucket_name: The name of the GCS bucket.
+        storage_url: The URL of the bucket (see meteolibre_dataset.storage.open_storage).
 
     Returns:
-        A list of file names.
+        The manifest of the bucket (name, size, generation, date, prefix), empty on error.
     """
     try:
-        # storage.Client() will automatically find and use credentials from
+        # the GCS storage automatically finds and uses credentials from
         # the environment, including those set by `gcloud auth login`.
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        return [blob.name for blob in bucket.list_blobs()]
-    except google.auth.exceptions.DefaultCredentialsError:
-        print("Authentication failed. Please run 'gcloud auth login' or set GOOGLE_APPLICATION_CREDENTIALS.")
-        return []
+        storage = open_storage(storage_url)
+        df, _, _ = update_manifest(
+            storage,
+            MANIFEST_FILE,
+            PRODUCTS,
+            START_DATE,
+            num_workers=NUM_WORKERS,
+            relist_days=RELIST_DAYS,
+            full_relist_days=FULL_RELIST_DAYS,
+        )
+        return df
     except Exception as e:
         print(f"An error occurred while accessing the bucket: {e}")
-        return []
+        return pd.DataFrame(columns=["name", "size", "generation", "date", "prefix"])
 
 
-def process_file_list(file_list: list[str]) -> pd.DataFrame:
+def process_file_list(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Processes a list of file names to extract and format dates.
+    Filters the files of the manifest on their dates.
 
     Args:
-        file_list: A list of file names.
+        df: The manifest (dates extracted from filenames like 'T_IMFR27_C_LFPW_20250103224500.bufr.gz').
 
     Returns:
-        A pandas DataFrame with processed and filtered data.
+        A pandas DataFrame with the filtered data.
     """
-    if not file_list:
-        return pd.DataFrame(columns=['name', 'date'])
-
-    df = pd.DataFrame(file_list, columns=['name'])
-    # Extract date from filenames like 'T_IMFR27_C_LFPW_20250103224500.bufr.gz'
-    df["date"] = df["name"].str.extract(r"(\d{12})")
-    df["date"] = pd.to_datetime(df["date"], format="%Y%m%d%H%M")
-    df = df.sort_values(by="date")
+    df = df.dropna(subset=["date"]).sort_values(by="date")
     # Filter for files at 0 or 30 minutes past the hour
     df = df[df["date"].dt.minute.isin([0, 30])]
     return df
@@ -63,12 +79,12 @@ def main():
     """
     Main function to execute the script logic.
     """
-    print(f"Fetching file list from bucket: {BUCKET_NAME}...")
-    file_list = get_file_list_from_bucket(BUCKET_NAME)
-    print(f"Found {len(file_list)} total files in the bucket.")
+    print(f"Fetching file list from bucket: {STORAGE_URL}...")
+    df = get_file_list_from_bucket(STORAGE_URL)
+    print(f"Found {len(df)} total files in the bucket.")
 
-    if file_list:
-        df = process_file_list(file_list)
+    if len(df):
+        df = process_file_list(df)
         print(f"Filtered down to {len(df)} files.")
         print(f"Saving dataframe to {OUTPUT_FILE}...")
         df.to_parquet(OUTPUT_FILE, index=False)
@@ -1,358 +1,87 @@
 import polars as pl
-import numpy as np
-import os
-from tqdm import tqdm
-import concurrent.futures
 
-columns_measurements = [
-    "RR1",
-    "FF",
-    "DD",
-    "T",
-    "U",
-    "PMER",
-    "VV",
-]
+from meteolibre_dataset.groundstation_npz import GroundStationNpzWriter, time_axis
+from meteolibre_dataset.groundstations import GROUNDSTATION_MEASUREMENTS
+
+# measurements cleaned by preprocess_groundstations (quality codes, physical bounds)
+columns_measurements = GROUNDSTATION_MEASUREMENTS
 
 columns_positions = ["position_x", "position_y"]
 groundstations_info_path = "../data/groundstations_filter/total_transformed.parquet"
-dir_h5 = "../data/h5/"
 dir_npz_preprocess = "../data/groundstation_npz/"
 
+# normalisation statistics: None (whole data), "month" or "station"
+STATS_GROUP_BY = None
 
-def process_h5_files_and_create_npz(
-    dir_h5: str,
-    groundstations_info_path: str,
-    dir_npz_preprocess: str,
-    columns_measurements: list,
-    columns_positions: list,
-):
-    """
-    Processes HDF5 files containing ground station data, transforms the data into
-    image format, and saves it as NPZ files.
-
-    This function iterates through HDF5 files in the specified directory, extracts
-    date information from filenames, filters data based on time frequency,
-    transforms ground station data for each timestamp into a 2D image-like format,
-    and saves each timestamp's data as a compressed NPZ file.
-
-    Args:
-        dir_h5 (str): Directory containing HDF5 files.
-        groundstations_info_path (str): Path to the Parquet file containing ground station information.
-        dir_npz_preprocess (str): Directory to save the preprocessed NPZ files.
-        columns_measurements (list): List of measurement columns to be extracted from ground station data.
-        columns_positions (list): List of position columns ('position_x', 'position_y').
-    """
-
-    ############# First get list of h5 files #############
-    list_files = os.listdir(dir_h5)
-
-    # remove non h5 files
-    list_files = [f for f in list_files if f.endswith(".h5")]
-
-    df_files = pl.DataFrame({"file_path": list_files})
-    df_files = df_files.with_columns(
-        (pl.lit("h5/") + pl.col("file_path")).alias("file_path_h5")
-    )
-
-    print("First few rows of H5 file list:")
-    print(df_files.head())
-
-    # data is of form T_IPRN20_C_LFPW_20250125033000.h5
-    # we want to extract the date from the filename
-    df_files = df_files.with_columns(
-        pl.col("file_path").str.extract(r"(\d{12})").alias("date")
-    )
-
-    # now we want to sort the dataframe by date
-    df_files = df_files.sort(by="date")
-
-    # preprocess the date to get datetime format
-    df_files = df_files.with_columns(
-        pl.col("date")
-        .str.strptime(pl.Datetime, format="%Y%m%d%H%M")
-        .alias("datetime")
-    )
-    # now we want to keep on date that have a frequency of 1 hour or 30 minutes
-    df_files = df_files.filter(pl.col("datetime").dt.minute().is_in([0, 30]))
-
-    # print the number of rows
-    print(f"Number of H5 files to process: {len(df_files)}")
-
-    # now we sort the dataframe by datetime
-    df_files = df_files.sort(by="datetime")
-
-    ####### Second get ground station information ########
-
-    groundstations_info_df = pl.read_parquet(
-        groundstations_info_path, columns=columns_measurements + columns_positions + ["datetime"]
-    )
-    
-    # normalize the columns_measurements values
-    means_col = groundstations_info_df[columns_measurements].mean()
-    std_col = groundstations_info_df[columns_measurements].std()
-    
-    for col in columns_measurements:
-        groundstations_info_df = groundstations_info_df.with_columns(
-            ((pl.col(col) - means_col[col]) / std_col[col]).alias(col)
-        )
-    
-    # save the mean and std in a file
-    means_col.write_parquet(
-        os.path.join("./", "means.parquet"), use_pyarrow=True
-    )
-    std_col.write_parquet(
-        os.path.join("./", "std.parquet"), use_pyarrow=True
-    )
-
-    print("\nFirst few rows of ground station info:")
-    print(groundstations_info_df.head())
-
-    # get statistics of the dataframe
-    print("\nStatistics of ground station info:")
-    print(groundstations_info_df.describe())
-
-    def transform_groundstation_data_into_image(df_ground_stations):
-        """
-        Transforms ground station dataframe into a 2D image-like numpy array.
-
-        Args:
-            df_ground_stations (pl.DataFrame): DataFrame containing ground station data
-                                                with columns for position_x, position_y,
-                                                and measurement columns.
-
-        Returns:
-            tuple: A tuple containing:
-                - mask (np.ndarray): A boolean mask indicating valid data points in the image.
-                - image_result (np.ndarray): A 3D numpy array representing the ground station data in image format (lon, lat, channels).
-        """
-        lat = np.array(
-            df_ground_stations["position_x"].to_numpy(), dtype=np.int64,
-        )
-        lon = np.array(df_ground_stations["position_y"].to_numpy(), dtype=np.int64)
-
-        nb_channels = len(columns_measurements)
-        image_result = (
-            np.ones((3472, 3472, nb_channels), dtype=np.float32) * -100
-        )
-
-        measurements = df_ground_stations[columns_measurements].to_numpy()
-
-        image_result[lon, lat, :] = np.array(measurements)
-        mask = image_result != -100
+# rasterisation of the stations (see meteolibre_dataset.station_raster): reduction of the
+# stations falling in the same pixel ("mean", "max", "count") and footprint of every
+# station ("point", "disk" or "gaussian" of radius pixels)
+RASTER_OPTIONS = {"reduction": "mean", "splat": "point", "radius": 0, "sigma": 1.0}
 
-        return mask, image_result
+# executor of the rasterisation tasks: "serial", "thread" or "process"
+EXECUTOR = "thread"
+NUM_WORKERS = None  # defaults to the number of CPUs
 
-    ####### Third write npz files for every time stamp ########
-    for i in tqdm(range(len(df_files))):
-        print(f"Processing H5 file {i+1}/{len(df_files)}")
-        datetime = df_files[i, "datetime"]
+# time axis of the npz files, taken from the station data (no need for the radar files):
+# from START to END (defaults to the span of the station data) every FREQUENCY
+# (None for the hours of the station data), optionally only the datetimes of an index
+START = None  # e.g. datetime.datetime(2025, 1, 1)
+END = None
+FREQUENCY = "30m"  # polars duration string
+INTERSECT_WITH_INDEX = None  # e.g. "../data/h5_files.parquet" (datetime column)
 
-        file_name_to_write = (
-            "ground_stations_" + datetime.strftime("%Y%m%d%H%M") + ".npz"
-        )
-        full_path_npz = os.path.join(dir_npz_preprocess, file_name_to_write)
-        if os.path.exists(full_path_npz):
-            print(f"File {file_name_to_write} already exists, skipping")
-            continue
 
-        print(f"Processing data for datetime: {datetime}")
-        # get ground station information for this time stamp
-        df_ground_stations = groundstations_info_df.filter(
-            pl.col("datetime") == datetime
-        )
-        _, image_result = transform_groundstation_data_into_image(
-            df_ground_stations
-        )
-
-        # save the image result in a npz format
-        # NPZ files are more efficient than HDF5 files where handling sparse data
-        np.savez_compressed(full_path_npz, image=image_result)
-
-def process_single_timestamp(
-    i, df_files, groundstations_info_df, dir_npz_preprocess, transform_func
-):
-    """Processes a single timestamp and saves the result as an NPZ file."""
-    datetime = df_files[i, "datetime"]
-
-    file_name_to_write = (
-        "ground_stations_" + datetime.strftime("%Y%m%d%H%M") + ".npz"
-    )
-    full_path_npz = os.path.join(dir_npz_preprocess, file_name_to_write)
-    if os.path.exists(full_path_npz):
-        # print(f"File {file_name_to_write} already exists, skipping") # Avoid printing in threads
-        return f"Skipped {file_name_to_write}"
-
-    # print(f"Processing data for datetime: {datetime}") # Avoid printing in threads
-    # get ground station information for this time stamp
-    df_ground_stations = groundstations_info_df.filter(
-        pl.col("datetime") == datetime
-    )
-    _, image_result = transform_func(df_ground_stations)
-
-    # save the image result in a npz format
-    np.savez_compressed(full_path_npz, image=image_result)
-    return f"Processed {file_name_to_write}"
-
-
-def process_h5_files_and_create_npz_multithread(
-    dir_h5: str,
+def process_groundstations_and_create_npz(
     groundstations_info_path: str,
     dir_npz_preprocess: str,
     columns_measurements: list,
     columns_positions: list,
+    executor: str = EXECUTOR,
+    num_workers: int = NUM_WORKERS,
 ):
     """
-    Processes HDF5 files containing ground station data, transforms the data into
-    image format, and saves it as NPZ files using multithreading.
-
-    This function iterates through HDF5 files in the specified directory, extracts
-    date information from filenames, filters data based on time frequency,
-    transforms ground station data for each timestamp into a 2D image-like format,
-    and saves each timestamp's data as a compressed NPZ file using a ThreadPoolExecutor.
+    Transforms the ground station data of every timestamp of the time axis into image format,
+    and saves it as NPZ files.
 
     Args:
-        dir_h5 (str): Directory containing HDF5 files.
         groundstations_info_path (str): Path to the Parquet file containing ground station information.
         dir_npz_preprocess (str): Directory to save the preprocessed NPZ files.
         columns_measurements (list): List of measurement columns to be extracted from ground station data.
         columns_positions (list): List of position columns ('position_x', 'position_y').
+        executor (str, optional): "serial", "thread" or "process". Defaults to EXECUTOR.
+        num_workers (int, optional): Number of workers. Defaults to NUM_WORKERS.
     """
-
-    ############# First get list of h5 files #############
-    list_files = os.listdir(dir_h5)
-
-    # remove non h5 files
-    list_files = [f for f in list_files if f.endswith(".h5")]
-
-    df_files = pl.DataFrame({"file_path": list_files})
-    df_files = df_files.with_columns(
-        (pl.lit("h5/") + pl.col("file_path")).alias("file_path_h5")
-    )
-
-    print("First few rows of H5 file list:")
-    print(df_files.head())
-
-    # data is of form T_IPRN20_C_LFPW_20250125033000.h5
-    # we want to extract the date from the filename
-    df_files = df_files.with_columns(
-        pl.col("file_path").str.extract(r"(\d{12})").alias("date")
-    )
-
-    # now we want to sort the dataframe by date
-    df_files = df_files.sort(by="date")
-
-    # preprocess the date to get datetime format
-    df_files = df_files.with_columns(
-        pl.col("date")
-        .str.strptime(pl.Datetime, format="%Y%m%d%H%M")
-        .alias("datetime")
-    )
-    # now we want to keep on date that have a frequency of 1 hour or 30 minutes
-    df_files = df_files.filter(pl.col("datetime").dt.minute().is_in([0, 30]))
-
-    # print the number of rows
-    print(f"Number of H5 files to process: {len(df_files)}")
-
-    # now we sort the dataframe by datetime
-    df_files = df_files.sort(by="datetime")
-
-    ####### Second get ground station information ########
-    print(groundstations_info_path)
-    groundstations_info_df = pl.read_parquet(
-        groundstations_info_path, columns=columns_measurements + columns_positions + ["datetime"]
+    writer = GroundStationNpzWriter(
+        groundstations_info_path,
+        dir_npz_preprocess,
+        columns_measurements,
+        columns_positions,
+        stats_group_by=STATS_GROUP_BY,
+        raster_options=RASTER_OPTIONS,
     )
 
-    # normalize the columns_measurements values
-    means_col = groundstations_info_df[columns_measurements].mean()
-    std_col = groundstations_info_df[columns_measurements].std()
+    intersect_with = None
+    if INTERSECT_WITH_INDEX is not None:
+        intersect_with = pl.read_parquet(INTERSECT_WITH_INDEX, columns=["datetime"])["datetime"]
 
-    for col in columns_measurements:
-        groundstations_info_df = groundstations_info_df.with_columns(
-            ((pl.col(col) - means_col[col]) / std_col[col]).alias(col)
-        )
-
-    # save the mean and std in a file
-    means_col.write_parquet(
-        os.path.join("./", "means.parquet"), use_pyarrow=True
-    )
-    std_col.write_parquet(
-        os.path.join("./", "std.parquet"), use_pyarrow=True
+    datetimes = time_axis(
+        writer.station_datetimes(),
+        start=START,
+        end=END,
+        frequency=FREQUENCY,
+        intersect_with=intersect_with,
     )
+    print(f"Number of timestamps to process: {len(datetimes)}")
 
-    print("\nFirst few rows of ground station info:")
-    print(groundstations_info_df.head())
-
-    # get statistics of the dataframe
-    print("\nStatistics of ground station info:")
-    print(groundstations_info_df.describe())
-
-    def transform_groundstation_data_into_image(df_ground_stations):
-        """
-        Transforms ground station dataframe into a 2D image-like numpy array.
-
-        Args:
-            df_ground_stations (pl.DataFrame): DataFrame containing ground station data
-                                                with columns for position_x, position_y,
-                                                and measurement columns.
-
-        Returns:
-            tuple: A tuple containing:
-                - mask (np.ndarray): A boolean mask indicating valid data points in the image.
-                - image_result (np.ndarray): A 3D numpy array representing the ground station data in image format (lon, lat, channels).
-        """
-        lat = np.array(
-            df_ground_stations["position_x"].to_numpy(), dtype=np.int64,
-        )
-        lon = np.array(df_ground_stations["position_y"].to_numpy(), dtype=np.int64)
-
-        nb_channels = len(columns_measurements)
-        image_result = (
-            np.ones((3472, 3472, nb_channels), dtype=np.float32) * -100
-        )
-
-        measurements = df_ground_stations[columns_measurements].to_numpy()
-
-        image_result[lon, lat, :] = np.array(measurements)
-        mask = image_result != -100
-
-        return mask, image_result
-
-    ####### Third write npz files for every time stamp ########
-    print("Starting NPZ file creation using ThreadPoolExecutor...")
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit tasks to the executor
-        future_to_timestamp = {
-            executor.submit(
-                process_single_timestamp,
-                i,
-                df_files,
-                groundstations_info_df,
-                dir_npz_preprocess,
-                transform_groundstation_data_into_image,
-            ): i
-            for i in range(len(df_files))
-        }
-
-        # Use tqdm to show progress
-        for future in tqdm(
-            concurrent.futures.as_completed(future_to_timestamp),
-            total=len(df_files),
-            desc="Processing timestamps",
-        ):
-            timestamp_index = future_to_timestamp[future]
-            try:
-                result = future.result()
-                # print(result) # Optional: print result of each task
-            except Exception as exc:
-                print(f"Timestamp {timestamp_index} generated an exception: {exc}")
+    print(f"Starting NPZ file creation ({executor} executor)...")
+    report = writer.run(datetimes, executor=executor, num_workers=num_workers)
+    print(report.report())
 
     print("NPZ file creation completed.")
 
 
 if __name__ == "__main__":
-    process_h5_files_and_create_npz_multithread(
-        dir_h5,
+    process_groundstations_and_create_npz(
         groundstations_info_path,
         dir_npz_preprocess,
         columns_measurements,
@@ -8,226 +8,532 @@ The original dataset is in different format (h5 for radar and npz for ground sta
 and is big in term of images (3472x3472xnb_channels).
 The idea is to create a smaller dataset (256x256) with the same number of channels
 
+The patches are PATCH_SIZE (512) full resolution pixels wide. They are downsampled in
+the compute stage, the radar (after the normalisation) with RADAR_POOLING ("nearest"
+by default, same as a [::2, ::2] slice) and the ground station crops with
+GROUNDSTATION_POOLING ("max" by default), to every resolution of OUTPUT_RESOLUTIONS
+at once (see meteolibre_dataset.pooling.multi_scale_pool): the 128/256/512 variants
+of the dataset are written in one pass, each in its own folder.
+
+The static layers (ground height and landcover) are not saved for every sample:
+they are saved once in the static/ folder and the patch position (patch_x, patch_y)
+is recorded in the index so they can be cropped at training time
+(see meteolibre_dataset.static_layers).
+
+The generation runs as a pipeline with bounded queues (see meteolibre_dataset.pipeline):
+an I/O stage reads the radar / ground station crops, a compute stage builds the
+data points (radar frames of all the passes normalized in one call, see
+meteolibre_dataset.radar_transform) and a write stage compresses and saves them.
+Each stage has its own number of workers and the per-stage throughput is reported
+at the end.
+
+With OUTPUT_BACKEND = "parquet", the samples are streamed into Parquet shards
+(hf_dataset/data/train-xxxxx.parquet, see meteolibre_dataset.arrow_writer) that can
+be read directly with datasets.load_dataset, instead of npz files + index.parquet.
+
+With the npz backend, every writer thread buffers its index records and flushes
+them as Parquet parts (see meteolibre_dataset.index_writer), consolidated at the end
+of the run into a single typed index.parquet sorted by datetime.
+
+The temporal windows (frame offsets and gap masks, see meteolibre_dataset.temporal_windows)
+are precomputed by index_creation.py (or computed here if the spec differs): a window
+with a gap in its future frames is skipped before any read, and past frames older
+than (NB_BACK_STEPS // 2 + 1) hours are replaced by a no data frame.
+
+If the radar coverage maps have been computed (radar_coverage_creation.py), the
+patch positions are drawn uniformly inside the blocks ("cells") where every patch is
+valid for all the future frames (conservative check on the block maps), so almost no
+frame is read for a patch that would be rejected. With IMPORTANCE_SAMPLING (off by default),
+those cells are weighted by their rain intensity and the importance weight of every
+sample is recorded in the index (importance_weight, 1 with uniform sampling) for debiasing.
+
+With RADAR_POOLING = "nearest" (default), the radar crops are read with a stride of
+2, from the 2x level of the radar pyramid if it has been built (radar_pyramid_creation.py,
+see meteolibre_dataset.radar_pyramid) instead of the full resolution h5 files, the
+other operators need the full resolution crops (4x more radar reads). If the radar
+cube has been built (radar_cube_creation.py), the radar frames of the whole temporal
+window of a patch are read at once from it (see meteolibre_dataset.radar_cube).
+
+With GROUNDSTATION_SOURCE = "stations", the ground station crops are not read from
+the npz files but rasterised on the fly from the station data, only on the window
+of every patch (see meteolibre_dataset.station_raster), with the same normalisation
+statistics as groundstation_npz_writing.py.
+
+The generation is deterministic (see meteolibre_dataset.generation_run): every
+(datetime, pass) uses a random generator derived from SEED and the sample ids are
+derived from the datetime and the pass number. The datetimes already written are
+recorded in a journal so a restarted run skips them (the journal records a hash of
+SEED and of the sampling configuration, a run with another configuration refuses to
+resume it), and a run can be restricted to [INDEX_RANGE_START, INDEX_RANGE_END) to
+split the generation across several machines.
+
 """
 
 import os
+import math
 from tqdm import tqdm
-import random
-import datetime
 import h5py
 
 import numpy as np
 import pandas as pd
-import concurrent.futures
-import threading
-import json
+import functools
 
-# Create a lock for thread-safe file writing
-index_file_lock = threading.Lock()
+from meteolibre_dataset.static_layers import prepare_static_layers
+from meteolibre_dataset.radar_coverage import (
+    RADAR_NODATA,
+    load_coverage_index,
+    valid_patch_cells,
+)
+from meteolibre_dataset.patch_sampling import (
+    cell_sizes,
+    draw_patch,
+    importance_probabilities,
+    patch_rain_intensity,
+)
+from meteolibre_dataset.generation_run import (
+    GenerationJournal,
+    index_permutation,
+    sample_id,
+    sample_rng,
+)
+from meteolibre_dataset.pipeline import BoundedPipeline, Stage
+from meteolibre_dataset.radar_transform import RadarFrameTransform
+from meteolibre_dataset.pooling import GROUNDSTATION_NODATA, multi_scale_pool, pool
+from meteolibre_dataset.radar_pyramid import RadarPyramid, pyramid_key
+from meteolibre_dataset.radar_cube import RadarCube
+from meteolibre_dataset.temporal_windows import (
+    MAX_GAP_MINUTES,
+    compute_windows,
+    default_max_back_age,
+    load_windows,
+)
+from meteolibre_dataset.arrow_writer import ParquetShardWriter
+from meteolibre_dataset.groundstation_npz import StationFrames
+from meteolibre_dataset.groundstations import GROUNDSTATION_MEASUREMENTS
+from meteolibre_dataset.station_raster import rasterize_stations
+from meteolibre_dataset.index_writer import ParquetIndexWriter, consolidate_index
 
 
-def max_pool_2x2(frames):
+def get_patch_sampler(i, nb_back_steps, nb_future_steps):
     """
-    Downsamples frames by a factor of 2 using max pooling.
-    Assumes input frames have shape (H, W, T) and so you want to reduce to (H/2, W/2, T).
-    """
-    H, W, T = frames.shape
-    # Ensure dimensions are even for 2x2 pooling
-    if H % 2 != 0 or W % 2 != 0:
-        # Handle odd dimensions if necessary, e.g., by padding or cropping
-        # For now, assuming even dimensions based on typical use cases
-        raise ValueError("Input frame dimensions must be even for 2x2 max pooling.")
-
-    # Reshape to group 2x2 blocks and apply max pooling
-    # (H, W, T) -> (H/2, 2, W/2, 2, T) -> max over axes 1 and 3 -> (H/2, W/2, T)
-    pooled_frames = frames.reshape(H // 2, 2, W // 2, 2, T).max(axis=(1, 3))
-
-    return pooled_frames
-
-
-def generate_data_point(
-    index_dataframe,
-    i,
-    nb_back_steps,
-    nb_future_steps,
-    shape_image,
-    ground_height_image,
-    landcover_image,
-):
-    """
-    Generate a data point for the HF dataset.
+    Get the cells in which the patches are valid for all the future frames of a data point,
+    with their sampling probabilities.
 
     Args:
-        index (pd.DataFrame): The index dataframe containing file paths and datetime.
         i (int): The current index for the data point.
         nb_back_steps (int): Number of past steps to consider.
         nb_future_steps (int): Number of future steps to consider.
-        shape_image (int): the initial shape of the image.
-        ground_height_image (np.ndarray): Ground height image.
-        save_hf_dataset (str): Path to save the HF dataset.
 
     Returns:
-        None
+        tuple: A tuple (cells, probabilities, stride) with the valid cells (nb_cells, 4),
+               their sampling probabilities (None for uniform sampling) and the step
+               between two patch origins, or None if the coverage maps are not available
+               for those frames.
     """
-    # get the datetime
+    if coverage_index is None:
+        return None
+
+    coverage_lookup, coverage, rain, block_size, stride = coverage_index
     index = int(i + nb_back_steps)
 
-    current_date = index_dataframe.index[index]
+    rows = []
+    for future in range(nb_future_steps):
+        path = radar_paths[index + 1 + future]
+        if path not in coverage_lookup:
+            return None
+        rows.append(coverage_lookup[path])
+
+    cells = valid_patch_cells(
+        coverage[rows],
+        patch_size=PATCH_SIZE,
+        min_valid=MIN_VALID_PIXELS,
+        low=PATCH_MARGIN,
+        high=shape_image - PATCH_SIZE - PATCH_MARGIN,
+        block_size=block_size,
+        stride=stride,
+    )
 
-    dict_return = {}
+    probabilities = None
+    if IMPORTANCE_SAMPLING and rain is not None and len(cells) > 0:
+        intensity = patch_rain_intensity(
+            rain[rows],
+            coverage[rows],
+            cells,
+            patch_size=PATCH_SIZE,
+            block_size=block_size,
+        )
+        probabilities = importance_probabilities(
+            intensity,
+            exponent=RAIN_WEIGHT_EXPONENT,
+            floor=RAIN_WEIGHT_FLOOR,
+            sizes=cell_sizes(cells, stride),
+        )
 
-    # now for every image, we select only a random 256x256 patch
-    x = random.randint(400, shape_image - shape_extrated_image * 2 - 400)
-    y = random.randint(400, shape_image - shape_extrated_image * 2 - 400)
+    return cells, probabilities, stride
 
-    array_future_list = []
-    array_back_list = []
 
-    array_back_groundstation_list = []
-    array_future_groundstation_list = []
+def read_radar_crops(row, patches):
+    """
+    Read the radar crops of all the patches of a radar frame.
 
-    array_back_list_time = []
+    The crops are read with a stride of RADAR_READ_STRIDE (2 with RADAR_POOLING = "nearest",
+    1 otherwise). If the frame is in the radar pyramid (radar_pyramid_creation.py) at
+    that level and the patch positions are on its grid, the crops are read from the
+    pyramid, otherwise from the h5 file (opened once).
 
-    for future in range(nb_future_steps):
-        path_file = os.path.join(
-            MAIN_DIR, str(index_dataframe["radar_file_path"].iloc[index + 1 + future])
+    Args:
+        row (int): Row of the radar frame in the index.
+        patches (list): List of (pass_index, x, y, importance_weight).
+
+    Returns:
+        np.ndarray: Raw radar crops (nb_patches, PATCH_SIZE / RADAR_READ_STRIDE,
+                    PATCH_SIZE / RADAR_READ_STRIDE).
+    """
+    stride = RADAR_READ_STRIDE
+
+    if radar_pyramid is not None and all(
+        x % stride == 0 and y % stride == 0 for _, x, y, _ in patches
+    ):
+        key = pyramid_key(datetimes[row])
+        if radar_pyramid.has(key, stride):
+            return radar_pyramid.read_patches(
+                key, [(x, y) for _, x, y, _ in patches], PATCH_SIZE // stride, level=stride
+            )
+
+    with h5py.File(os.path.join(MAIN_DIR, radar_paths[row]), "r") as f:
+        data = f["dataset1"]["data1"]["data"]
+        return np.stack(
+            [
+                data[x : (x + PATCH_SIZE) : stride, y : (y + PATCH_SIZE) : stride]
+                for _, x, y, _ in patches
+            ],
+            axis=0,
         )
 
-        # take
-        array = np.array(
-            h5py.File(path_file, "r")["dataset1"]["data1"]["data"][
-                x : (x + shape_extrated_image * 2) : 2,
-                y : (y + shape_extrated_image * 2) : 2,
-            ]
+
+def read_groundstation_crops(k, patches):
+    """
+    Read the ground station crops of all the patches of a row of the index.
+
+    With GROUNDSTATION_SOURCE = "npz" the crops are read from the npz file (loaded once),
+    with "stations" they are rasterised on the fly from the station data, only on the
+    window of every patch (see meteolibre_dataset.station_raster).
+
+    When GROUNDSTATION_POOLING can be applied in several steps ("max", "nearest"), the crops are
+    already pooled here by GROUNDSTATION_READ_FACTOR (the factor shared by all the
+    output resolutions), so that only the small arrays are kept in memory between the
+    pipeline stages; the compute stage pools them to the output resolutions.
+
+    Args:
+        k (int): Row of the index.
+        patches (list): List of (pass_index, x, y, importance_weight).
+
+    Returns:
+        np.ndarray: Ground station crops (nb_patches, PATCH_SIZE / GROUNDSTATION_READ_FACTOR,
+                    PATCH_SIZE / GROUNDSTATION_READ_FACTOR, nb_channels).
+    """
+    if station_frames is not None:
+        position_x, position_y, measurements = station_frames.rows(groundstation_datetimes[k])
+        crops = np.stack(
+            [
+                rasterize_stations(
+                    position_x,
+                    position_y,
+                    measurements,
+                    window=(x, y, PATCH_SIZE, PATCH_SIZE),
+                    **GROUNDSTATION_RASTER,
+                )
+                for _, x, y, _ in patches
+            ],
+            axis=0,
         )
+        return pool(crops, GROUNDSTATION_READ_FACTOR, op=GROUNDSTATION_POOLING)
 
-        array = array.astype(np.int32)
+    array_ground_station = np.load(os.path.join(MAIN_DIR, groundstation_paths[k]))["image"]
 
-        array[array == 65535] = DEFAULT_VALUE
+    crops = np.stack(
+        [
+            array_ground_station[x : (x + PATCH_SIZE), y : (y + PATCH_SIZE), :]
+            for _, x, y, _ in patches
+        ],
+        axis=0,
+    )
 
-        # if there is nothing > 0, we go on the next item
-        if np.sum(array > -0.1) <= 10:
-            print("not enaught good point")
-            return None
+    return pool(crops, GROUNDSTATION_READ_FACTOR, op=GROUNDSTATION_POOLING)
 
-        array = np.float32(array) / RADAR_NORMALIZATION  # normalization
 
-        array_future_list.append(array)
+def read_radar_window(index, nb_back_steps, nb_future_steps, patches):
+    """
+    Read the radar frames of the whole temporal window of all the patches from the radar cube.
 
-        # dict_return["radar_mask_future_" + str(future)] = array != (
-        #     DEFAULT_VALUE / RADAR_NORMALIZATION
-        # )
+    Args:
+        index (int): Row of the current frame in the index.
+        nb_back_steps (int): Number of past steps to consider.
+        nb_future_steps (int): Number of future steps to consider.
+        patches (list): List of (pass_index, x, y, importance_weight).
 
-        array_ground_station = np.load(
-            os.path.join(
-                MAIN_DIR,
-                str(index_dataframe["groundstation_file_path"].iloc[index + future]),
+    Returns:
+        np.ndarray: Raw radar crops (nb_patches, nb_back_steps + nb_future_steps,
+                    PATCH_SIZE / RADAR_READ_STRIDE, PATCH_SIZE / RADAR_READ_STRIDE),
+                    or None if the window is not stored contiguously in the radar cube.
+    """
+    if radar_cube is None:
+        return None
+
+    rows = radar_cube.rows(datetimes[index - nb_back_steps + 1 : index + nb_future_steps + 1])
+    if rows[0] < 0 or np.any(rows != rows[0] + np.arange(len(rows))):
+        return None
+
+    return np.stack(
+        [
+            radar_cube.read_window(
+                rows[0],
+                rows[-1] + 1,
+                x,
+                y,
+                PATCH_SIZE // RADAR_READ_STRIDE,
+                stride=RADAR_READ_STRIDE,
             )
-        )["image"]
+            for _, x, y, _ in patches
+        ],
+        axis=0,
+    )
+
 
-        # maxpool
-        array_ground_station = array_ground_station[
-            x : (x + shape_extrated_image * 2), y : (y + shape_extrated_image * 2), :
-        ]
+def read_data_point(i, nb_back_steps, nb_future_steps, nb_passes, seed):
+    """
+    Read the raw data of all the passes of a data point (I/O stage).
 
-        array_ground_station = max_pool_2x2(array_ground_station)
+    The patch positions of all the passes are drawn first, then every radar and
+    ground station file is opened only once to read the crops of all the passes
+    (or the radar window of every patch is read at once from the radar cube).
 
-        array_future_groundstation_list.append(array_ground_station)
+    Args:
+        i (int): The current index for the data point.
+        nb_back_steps (int): Number of past steps to consider.
+        nb_future_steps (int): Number of future steps to consider.
+        nb_passes (int): Number of passes (patches) for this data point.
+        seed (int): Seed of the generation run.
 
-    for back in range(-nb_back_steps + 1, 1):
-        path_file = os.path.join(
-            MAIN_DIR,
-            str(index_dataframe["radar_file_path"].iloc[index + back]),
+    Returns:
+        dict: Raw data of the data point (patches, raw radar crops, ground station crops).
+    """
+    # get the datetime
+    index = int(i + nb_back_steps)
+    current_date = datetimes[index]
+
+    raw = {"i": i, "datetime": current_date, "patches": []}
+
+    # valid patch positions (computed once for all the passes)
+    patch_sampler = get_patch_sampler(i, nb_back_steps, nb_future_steps)
+    if patch_sampler is not None and len(patch_sampler[0]) == 0:
+        # no valid patch for this data point, nothing to read
+        return raw
+
+    # now for every pass, we select only a random 256x256 patch
+    for pass_index in range(nb_passes):
+        rng = sample_rng(seed, current_date, pass_index)
+        if patch_sampler is not None:
+            cells, probabilities, stride = patch_sampler
+            x, y, importance_weight = draw_patch(cells, probabilities, rng=rng, stride=stride)
+        else:
+            importance_weight = 1.0
+            x, y = (
+                int(v)
+                for v in rng.integers(
+                    PATCH_MARGIN,
+                    shape_image - PATCH_SIZE - PATCH_MARGIN,
+                    size=2,
+                    endpoint=True,
+                )
+            )
+        raw["patches"].append((pass_index, x, y, importance_weight))
+
+    patches = raw["patches"]
+    nb_patches = len(patches)
+
+    # radar window (back and future frames) read at once from the cube, if available
+    radar_window = read_radar_window(index, nb_back_steps, nb_future_steps, patches)
+
+    if radar_window is not None:
+        raw["radar_future"] = radar_window[:, nb_back_steps:]
+    else:
+        raw["radar_future"] = np.stack(
+            [
+                read_radar_crops(index + 1 + future, patches)
+                for future in range(nb_future_steps)
+            ],
+            axis=1,
         )
+    raw["groundstation_future"] = np.stack(
+        [
+            read_groundstation_crops(index + future, patches)
+            for future in range(nb_future_steps)
+        ],
+        axis=1,
+    )
 
-        # check if the delta with the current time is not too high
-        time_back = index_dataframe.index[index + back]
-        delta_time = current_date - time_back
+    radar_back_list = []
+    groundstation_back_list = []
 
-        # convert delta time in minutes
-        delta_time_minutes = delta_time.total_seconds() / 60
+    # precomputed offsets (minutes) and validity of the frames of the window
+    offsets = windows["offsets"][i]
+    frame_valid = windows["frame_valid"][i]
 
-        if delta_time < datetime.timedelta(hours=(nb_back_steps // 2 + 1)):
-            array = np.array(
-                h5py.File(path_file, "r")["dataset1"]["data1"]["data"][
-                    x : (x + shape_extrated_image * 2) : 2,
-                    y : (y + shape_extrated_image * 2) : 2,
-                ]
+    for back in range(-nb_back_steps + 1, 1):
+        # past frames too old are replaced by a no data frame
+        if not frame_valid[back + nb_back_steps - 1]:
+            # too old: no data frame (becomes DEFAULT_VALUE after the transform)
+            array = np.full(
+                (nb_patches, PATCH_SIZE // RADAR_READ_STRIDE, PATCH_SIZE // RADAR_READ_STRIDE),
+                RADAR_NODATA,
+                dtype=np.uint16,
             )
-            array = array.astype(np.int32)
-            array[array == 65535] = DEFAULT_VALUE
-
+        elif radar_window is not None:
+            array = radar_window[:, back + nb_back_steps - 1]
         else:
-            # print("bad delta time", delta_time)
-            array = (
-                np.ones((shape_extrated_image, shape_extrated_image), dtype=np.float32)
-                * DEFAULT_VALUE
-            )
+            array = read_radar_crops(index + back, patches)
 
-        array = np.float32(array) / RADAR_NORMALIZATION  # normalization
-
-        # dict_return["radar_back_" + str(back)] = array
-        array_back_list.append(array)
-        array_back_list_time.append(delta_time_minutes / 60.0)
+        radar_back_list.append(array)
 
         ## groundstation setup
-        array_ground_station = np.load(
-            os.path.join(
-                MAIN_DIR,
-                str(index_dataframe["groundstation_file_path"].iloc[index + back]),
-            )
-        )["image"]
+        groundstation_back_list.append(
+            read_groundstation_crops(index + back, patches)
+        )
 
-        array_ground_station = array_ground_station[
-            x : (x + shape_extrated_image * 2), y : (y + shape_extrated_image * 2), :
-        ]
+    raw["radar_back"] = np.stack(radar_back_list, axis=1)
+    raw["groundstation_back"] = np.stack(groundstation_back_list, axis=1)
+    raw["time_radar_back"] = -offsets[:nb_back_steps].astype(np.float32) / 60.0
 
-        array_ground_station = max_pool_2x2(array_ground_station)
+    return raw
 
-        array_back_groundstation_list.append(array_ground_station)
 
-    dict_return["hour"] = np.int32(current_date.hour)
-    dict_return["minute"] = np.int32(current_date.minute)
+def pool_frames(stack, factors, op, nodata):
+    """
+    Pool a stack of crops to several downsampling factors at once.
 
-    # dd ground height image
-    dict_return["ground_height_image"] = ground_height_image[
-        x : (x + shape_extrated_image * 2) : 2, y : (y + shape_extrated_image * 2) : 2
-    ]
+    Args:
+        stack (np.ndarray): Crops (nb_patches, T, H, W) or (nb_patches, T, H, W, C).
+        factors (dict): Output resolution -> downsampling factor.
+        op (str): Pooling operator (see meteolibre_dataset.pooling).
+        nodata (float): No data value of the crops (ignored by "masked_mean").
 
-    dict_return["landcover_image"] = landcover_image[
-        x : (x + shape_extrated_image * 2) : 2,
-        y : (y + shape_extrated_image * 2) : 2,
-        :,
-    ]
+    Returns:
+        dict: Output resolution -> pooled crops (nb_patches, T, H / factor, W / factor[, C]).
+    """
+    nb_patches, nb_frames, H, W = stack.shape[:4]
+    pooled = multi_scale_pool(
+        stack.reshape(nb_patches * nb_frames, H, W, -1),
+        list(factors.values()),
+        op=op,
+        nodata=nodata,
+    )
 
-    dict_return["radar_future"] = np.stack(array_future_list, axis=0)
-    dict_return["radar_back"] = np.stack(array_back_list, axis=0)
+    return {
+        resolution: pooled[factor].reshape(
+            (nb_patches, nb_frames) + pooled[factor].shape[1:3] + stack.shape[4:]
+        )
+        for resolution, factor in factors.items()
+    }
 
-    dict_return["time_radar_back"] = np.array(array_back_list_time, dtype=np.float32)
 
-    dict_return["groundstation_future"] = np.stack(
-        array_future_groundstation_list, axis=0
+def compute_data_point(raw):
+    """
+    Build the data points of all the passes from the raw data (compute stage).
+
+    The radar frames of all the passes are normalized in one call, then the radar
+    crops are pooled with RADAR_POOLING and the ground station crops with
+    GROUNDSTATION_POOLING to every output resolution.
+
+    Args:
+        raw (dict): Raw data of the data point (see read_data_point).
+
+    Returns:
+        dict: The datetime, time index and, for every output resolution, the list of
+              data point dictionaries to save.
+    """
+    current_date = raw["datetime"]
+
+    dict_results = {resolution: [] for resolution in OUTPUT_RESOLUTIONS}
+    if not raw["patches"]:
+        return {"i": raw["i"], "datetime": current_date, "dict_results": dict_results}
+
+    # transform the frames of all the passes at once (nb_patches, T, H, W)
+    radar_future, nb_valid_future = radar_transform(raw["radar_future"])
+    radar_back, _ = radar_transform(raw["radar_back"])
+
+    if RADAR_READ_STRIDE == 1:
+        # valid pixels counted on the 2x grid, as in the coverage maps
+        nb_valid_future = np.count_nonzero(
+            raw["radar_future"][..., ::2, ::2] != RADAR_NODATA, axis=(-2, -1)
+        )
+
+    # every output resolution in one call per array
+    radar_nodata = radar_transform.lut[RADAR_NODATA]
+    radar_future = pool_frames(radar_future, RADAR_POOL_FACTORS, RADAR_POOLING, radar_nodata)
+    radar_back = pool_frames(radar_back, RADAR_POOL_FACTORS, RADAR_POOLING, radar_nodata)
+    groundstation_future = pool_frames(
+        raw["groundstation_future"],
+        GROUNDSTATION_POOL_FACTORS,
+        GROUNDSTATION_POOLING,
+        GROUNDSTATION_NODATA,
     )
-    dict_return["groundstation_back"] = np.stack(array_back_groundstation_list, axis=0)
+    groundstation_back = pool_frames(
+        raw["groundstation_back"],
+        GROUNDSTATION_POOL_FACTORS,
+        GROUNDSTATION_POOLING,
+        GROUNDSTATION_NODATA,
+    )
+
+    for p, (pass_index, x, y, importance_weight) in enumerate(raw["patches"]):
+        # if there is nothing > 0, we go on the next item
+        if np.any(nb_valid_future[p] <= MIN_VALID_PIXELS):
+            print("not enaught good point")
+            continue
+
+        for resolution in OUTPUT_RESOLUTIONS:
+            dict_return = {}
+            dict_return["hour"] = np.int32(current_date.hour)
+            dict_return["minute"] = np.int32(current_date.minute)
+
+            # patch position, used to crop the static layers (ground height, landcover)
+            dict_return["patch_x"] = np.int32(x)
+            dict_return["patch_y"] = np.int32(y)
+            dict_return["importance_weight"] = np.float32(importance_weight)
 
-    # save the image and save an index
-    return dict_return
+            dict_return["radar_future"] = radar_future[resolution][p]
+            dict_return["radar_back"] = radar_back[resolution][p]
 
+            dict_return["time_radar_back"] = raw["time_radar_back"]
 
-def save_image(dict_results, save_hf_dataset, data_datetime_str, lock):
+            dict_return["groundstation_future"] = groundstation_future[resolution][p]
+            dict_return["groundstation_back"] = groundstation_back[resolution][p]
+
+            dict_return["id"] = sample_id(current_date, pass_index)
+            dict_results[resolution].append(dict_return)
+
+    return {
+        "i": raw["i"],
+        "datetime": current_date,
+        "dict_results": dict_results,
+    }
+
+
+def save_image(dict_results, save_hf_dataset, data_datetime, index_writer, on_commit):
     """
     Save multiple images and update the index.
 
     Args:
         dict_results (list): List of dictionaries containing the data points.
         save_hf_dataset (str): Path to save the HF dataset.
-        data_datetime_str (str): The datetime string for the data point.
-        lock (threading.Lock): The lock for thread-safe file writing.
+        data_datetime (datetime.datetime): The datetime of the data point.
+        index_writer (ParquetIndexWriter): The index writer.
+        on_commit (callable): Called once the index records are persisted.
 
     Returns:
         None
     """
-    def get_file_name(key, random_id, hour):
+    def get_file_name(key, data_id, hour):
         return os.path.join(
             save_hf_dataset,
             key,
@@ -235,8 +541,8 @@ def save_image(dict_results, save_hf_dataset, data_datetime_str, lock):
             + "_"
             + str(hour)
             + f"_"
-            + random_id
-            + ".npz",  # include random_id in the filename
+            + data_id
+            + ".npz",  # include data_id in the filename
         )
 
     # Collect all index data to write at once
@@ -244,7 +550,7 @@ def save_image(dict_results, save_hf_dataset, data_datetime_str, lock):
 
     # Process each dict_result
     for dict_return in dict_results:
-        random_id = str(random.randint(0, 10000000000))  # generate a random id for the image
+        data_id = dict_return["id"]  # deterministic id (datetime and pass)
         hour = dict_return["hour"].item()
 
         # Save the numpy arrays for this data point
@@ -255,10 +561,8 @@ def save_image(dict_results, save_hf_dataset, data_datetime_str, lock):
                 or key.startswith("radar_back")
                 or key.startswith("groundstation_future")
                 or key.startswith("groundstation_back")
-                or key.startswith("ground_height_image")
-                or key.startswith("landcover_image")
             ):
-                file_name = get_file_name(key, random_id, hour)
+                file_name = get_file_name(key, data_id, hour)
                 # Ensure directory exists before saving
                 os.makedirs(os.path.dirname(file_name), exist_ok=True)
 
@@ -266,178 +570,407 @@ def save_image(dict_results, save_hf_dataset, data_datetime_str, lock):
 
         # Prepare index data for this data point
         dict_data = {
-            "radar_file_path_future": get_file_name("radar_future", random_id, hour),
-            "radar_file_path_back": get_file_name("radar_back", random_id, hour),
+            "radar_file_path_future": get_file_name("radar_future", data_id, hour),
+            "radar_file_path_back": get_file_name("radar_back", data_id, hour),
             "groundstation_file_path_future": get_file_name(
-                "groundstation_future", random_id, hour
+                "groundstation_future", data_id, hour
             ),
             "groundstation_file_path_back": get_file_name(
-                "groundstation_back", random_id, hour
-            ),
-            "ground_height_file_path": get_file_name(
-                "ground_height_image", random_id, hour
-            ),
-            "landcover_file_path": get_file_name(
-                "landcover_image", random_id, hour
+                "groundstation_back", data_id, hour
             ),
+            "patch_x": dict_return["patch_x"].item(),
+            "patch_y": dict_return["patch_y"].item(),
+            "importance_weight": dict_return["importance_weight"].item(),
             "hour": dict_return["hour"].item(),
             "minute": dict_return["minute"].item(),
             "time_radar_back": dict_return["time_radar_back"].tolist(),
-            "datetime": data_datetime_str,
-            "id": random_id,
+            "datetime": data_datetime,
+            "id": data_id,
         }
         all_dict_data.append(dict_data)
 
-    # Write all index data at once within the lock
-    with lock:
-        with open(os.path.join(save_hf_dataset, "index.json"), "a") as f:
-            for dict_data in all_dict_data:
-                json.dump(dict_data, f)
-                f.write("\n")
-
-
-# New worker function
-def process_index_multiple_passes(
-    i,
-    index_dataframe,
-    nb_back_steps,
-    nb_future_steps,
-    shape_image,
-    ground_height_image,
-    landcover_image,
-    save_hf_dataset,
-    lock,
-    nb_passes,
-):
+    # buffered in the index writer of this thread (no lock on a shared file)
+    index_writer.write(all_dict_data, on_commit=on_commit)
+
+
+def write_data_point(data, journal, outputs):
     """
-    Processes a single index multiple times to generate and save multiple data points.
-    This function handles the NB_PASS_PER_IMAGES loop internally for better thread utilization.
+    Save the data points of a time index and record it in the journal (write stage).
+
+    The data points of every output resolution are saved in the folder of that
+    resolution. The datetime is recorded in the journal once its index records
+    (npz backend) or its shards (parquet backend) are persisted in every folder.
+
+    Args:
+        data (dict): Output of compute_data_point.
+        journal (GenerationJournal): The completion journal of the run.
+        outputs (dict): Output resolution -> (dataset folder, index writer (npz backend),
+            parquet writer (parquet backend, the data points are then streamed into
+            Parquet shards instead of npz files)).
+
+    Returns:
+        int: The number of data points saved (per resolution).
     """
-    # Get the datetime for this data point
-    data_datetime = index_dataframe.index[int(i + nb_back_steps)]
-    data_datetime_str = data_datetime.strftime("%Y-%m-%d %H:%M:%S")
-
-    # Collect all passes first
-    dict_results = []
-    for _ in range(nb_passes):
-        dict_result = generate_data_point(
-            index_dataframe,
-            i,
-            nb_back_steps,
-            nb_future_steps,
-            shape_image,
-            ground_height_image,
-            landcover_image,
-        )
+    on_commit = journal.commit_callback(data["datetime"], nb_writers=len(outputs))
+
+    for resolution, (save_dir, index_writer, parquet_writer) in outputs.items():
+        dict_results = data["dict_results"][resolution]
+
+        if parquet_writer is not None:
+            records = [
+                {
+                    key: dict_return[key]
+                    for key in list(PARQUET_SCALAR_TYPES) + list(parquet_writer.tensor_shapes)
+                    if key != "datetime"
+                }
+                for dict_return in dict_results
+            ]
+            for record in records:
+                record["datetime"] = data["datetime"]
+
+            parquet_writer.write(records, on_commit=on_commit)
+        else:
+            # Write all passes at once
+            save_image(dict_results, save_dir, data["datetime"], index_writer, on_commit)
 
-        if dict_result is not None:
-            dict_results.append(dict_result)
+    return len(dict_results)
 
-    # Write all passes at once
-    if dict_results:
-        save_image(dict_results, save_hf_dataset, data_datetime_str, lock)
+
+def parquet_tensor_shapes(resolution):
+    """
+    Get the shapes of the arrays of a sample at an output resolution (parquet backend).
+    """
+    return {
+        "radar_future": (NB_FUTURE_STEPS, resolution, resolution),
+        "radar_back": (NB_BACK_STEPS, resolution, resolution),
+        "groundstation_future": (
+            NB_FUTURE_STEPS,
+            resolution,
+            resolution,
+            NB_GROUNDSTATION_CHANNELS,
+        ),
+        "groundstation_back": (
+            NB_BACK_STEPS,
+            resolution,
+            resolution,
+            NB_GROUNDSTATION_CHANNELS,
+        ),
+    }
 
 
 # --- 0. Prerequisite: load main variable ---
 MAIN_DIR = "../data/"
-ground_height_image = MAIN_DIR + "assets/reprojected_gebco_32630_500m_padded.npy"
+ground_height_image_path = MAIN_DIR + "assets/reprojected_gebco_32630_500m_padded.npy"
 landcover_image_path = MAIN_DIR + "assets/consensus_full_class_{}_france_padded.npz"
 
 
 index_file = MAIN_DIR + "index.parquet"
+groundstations_info_path = MAIN_DIR + "groundstations_filter/total_transformed.parquet"
+coverage_file = MAIN_DIR + "radar_coverage.npz"
+pyramid_file = MAIN_DIR + "radar_pyramid.h5"
+cube_file = MAIN_DIR + "radar_cube.h5"
+windows_file = MAIN_DIR + "windows.npz"
 save_hf_dataset = "../data/hf_dataset/"
 
 NB_BACK_STEPS = 5
 NB_FUTURE_STEPS = 4
 NB_PASS_PER_IMAGES = 8
+SEED = 42  # seed of the generation run (patch positions, processing order)
+INDEX_RANGE_START = 0  # first time index of this run (to split across machines)
+INDEX_RANGE_END = None  # last time index of this run (exclusive), None for the end
+
 RADAR_NORMALIZATION = 60.0
 DEFAULT_VALUE = -1
+# pooling operators: "max", "mean", "masked_mean" (ignores the no data values) or
+# "nearest" (strided), see meteolibre_dataset.pooling
+# radar (after normalisation): "nearest" reads the crops with a stride of 2 (from the
+# pyramid if built), the other operators read them at full resolution (4x the I/O);
+# "max" keeps the rain peaks but changes the radar targets of the dataset (opt-in)
+RADAR_POOLING = "nearest"
+GROUNDSTATION_POOLING = "max"
+# ground station crops: "npz" (groundstation_npz_writing.py files) or "stations"
+# (rasterised on the fly from the station data, only on the patch windows, with
+# GROUNDSTATION_RASTER, see meteolibre_dataset.station_raster)
+GROUNDSTATION_SOURCE = "npz"
+GROUNDSTATION_RASTER = {"reduction": "mean", "splat": "point", "radius": 0, "sigma": 1.0}
+GROUNDSTATION_STATS_GROUP_BY = None  # normalisation statistics, as in groundstation_npz_writing.py
+MIN_VALID_PIXELS = 10  # minimum number of valid radar pixels in a future patch
+PATCH_MARGIN = 400  # patches are drawn at least PATCH_MARGIN pixels from the border
+
+# precipitation-weighted importance sampling (needs the rain maps of radar_coverage.npz)
+# weight of a patch = RAIN_WEIGHT_FLOOR + (intensity / mean intensity) ** RAIN_WEIGHT_EXPONENT
+# off by default: it changes the distribution of the samples, which then have to be
+# weighted by importance_weight (always 1 with uniform sampling) at training time
+IMPORTANCE_SAMPLING = False
+RAIN_WEIGHT_EXPONENT = 1.0
+RAIN_WEIGHT_FLOOR = 0.1
+
+# number of worker threads of every pipeline stage
+NUM_READ_WORKERS = 6  # h5 / npz reads (I/O bound)
+NUM_COMPUTE_WORKERS = 2  # radar transform, data point assembly
+NUM_WRITE_WORKERS = 4  # npz compression and writing
+
+LANDCOVER_CLASSES = [4, 7, 9, 12]
 
 shape_image = 3472
-shape_extrated_image = 256
+PATCH_SIZE = 512  # size of the patches in full resolution pixels
+
+# output resolution (pixels) -> dataset folder, every resolution is pooled from the
+# same patches in one pass, e.g. {128: "../data/hf_dataset_128/", 256: save_hf_dataset,
+# 512: "../data/hf_dataset_512/"}; the journal of the run is kept in save_hf_dataset
+OUTPUT_RESOLUTIONS = {256: save_hf_dataset}
+
+# output backend: "npz" (npz files + index.parquet) or "parquet" (Parquet shards)
+OUTPUT_BACKEND = "npz"
+NB_GROUNDSTATION_CHANNELS = 7  # measurements of groundstation_npz_writing.py
+PARQUET_ROWS_PER_ROW_GROUP = 8  # ~20 MB of uncompressed arrays per sample
+PARQUET_ROWS_PER_SHARD = 256
+INDEX_ROWS_PER_PART = 512  # index records buffered per writer thread (npz backend)
+
+PARQUET_SCALAR_TYPES = {
+    "id": "string",
+    "datetime": "timestamp[ms]",
+    "hour": "int32",
+    "minute": "int32",
+    "patch_x": "int32",
+    "patch_y": "int32",
+    "importance_weight": "float32",
+    "time_radar_back": ["float32"],
+}
+# downsampling factors of the output resolutions, part of them is applied when the
+# crops are read (strided radar reads, ground station crops pooled in the read stage
+# when GROUNDSTATION_POOLING can be applied in several steps), the rest in the compute stage
+for resolution in OUTPUT_RESOLUTIONS:
+    if PATCH_SIZE % resolution != 0:
+        raise ValueError(
+            f"Output resolution {resolution} must divide the patch size {PATCH_SIZE}."
+        )
+OUTPUT_FACTORS = {resolution: PATCH_SIZE // resolution for resolution in OUTPUT_RESOLUTIONS}
+RADAR_READ_STRIDE = (
+    2
+    if RADAR_POOLING == "nearest" and all(f % 2 == 0 for f in OUTPUT_FACTORS.values())
+    else 1
+)
+GROUNDSTATION_READ_FACTOR = (
+    math.gcd(*OUTPUT_FACTORS.values()) if GROUNDSTATION_POOLING in ("max", "nearest") else 1
+)
+RADAR_POOL_FACTORS = {r: f // RADAR_READ_STRIDE for r, f in OUTPUT_FACTORS.items()}
+GROUNDSTATION_POOL_FACTORS = {
+    r: f // GROUNDSTATION_READ_FACTOR for r, f in OUTPUT_FACTORS.items()
+}
 
 # we read the index file
 index = pd.read_parquet(index_file)
 
-# sort by datetime
-index = index.sort_values(by="datetime")
+# sort by datetime (stable: index_creation.py already saves the index sorted)
+index = index.sort_values(by="datetime", kind="stable")
 
 # set datetime as index
 index = index.set_index("datetime")
 
-nb_back_steps = NB_BACK_STEPS
-nb_future_steps = NB_FUTURE_STEPS
-shape_image = shape_image
+# plain arrays used by the pipeline stages (no DataFrame access in the hot loop)
+radar_paths = index["radar_file_path"].astype(str).to_numpy()
+groundstation_paths = index["groundstation_file_path"].astype(str).to_numpy()
+datetimes = index.index.to_pydatetime()
+
+# ground station data rasterised on the fly (normalisation statistics of the npz directory)
+if GROUNDSTATION_SOURCE == "stations":
+    station_frames = StationFrames(
+        groundstations_info_path,
+        MAIN_DIR + "groundstation_npz",
+        GROUNDSTATION_MEASUREMENTS,
+        stats_group_by=GROUNDSTATION_STATS_GROUP_BY,
+    )
+    # datetime of the matched ground station frame (as-of join of index_creation.py)
+    groundstation_offsets = pd.to_timedelta(
+        index.get("groundstation_offset_s", pd.Series(0, index=index.index)).fillna(0).to_numpy(),
+        unit="s",
+    )
+    groundstation_datetimes = (index.index + groundstation_offsets).to_pydatetime()
+else:
+    station_frames = None
 
-# manage ground height image (read the .npy file)
-ground_height_image = np.load(ground_height_image)
-ground_height_image = (ground_height_image - np.mean(ground_height_image)) / np.std(
-    ground_height_image
+# fused radar transform (lookup table, scratch buffers reused by every compute thread)
+radar_transform = RadarFrameTransform(
+    default_value=DEFAULT_VALUE, normalization=RADAR_NORMALIZATION
 )
 
-# manage landcover
-# load landcover data
-landcover_list = []
-
-for i in [4, 7, 9, 12]:
-    landcover_image = landcover_image_path.format(i)
-    data = np.load(landcover_image)["arr_0"].astype(float)
-    data = (data - np.mean(data)) / np.std(data)
-    landcover_list.append(data)
-landcover_image = np.stack(landcover_list, axis=2)
+nb_back_steps = NB_BACK_STEPS
+nb_future_steps = NB_FUTURE_STEPS
+shape_image = shape_image
 
+# load the radar coverage maps if they have been computed
+if os.path.exists(coverage_file):
+    coverage_index = load_coverage_index(coverage_file)
+    print(f"Using radar coverage maps from {coverage_file}")
+else:
+    coverage_index = None
+
+# open the radar pyramid if it has been built
+if os.path.exists(pyramid_file):
+    radar_pyramid = RadarPyramid(pyramid_file)
+    print(f"Using radar pyramid from {pyramid_file}")
+else:
+    radar_pyramid = None
+
+# open the radar cube if it has been built (used first for the radar windows)
+if os.path.exists(cube_file):
+    radar_cube = RadarCube(cube_file)
+    print(f"Using radar cube from {cube_file}")
+else:
+    radar_cube = None
+
+
+# temporal windows (offsets, gap masks), precomputed by index_creation.py if possible
+windows = None
+if os.path.exists(windows_file):
+    windows = load_windows(
+        windows_file,
+        nb_back_steps,
+        nb_future_steps,
+        MAX_GAP_MINUTES,
+        default_max_back_age(nb_back_steps),
+        len(index),
+    )
+if windows is None:
+    windows = compute_windows(
+        datetimes,
+        nb_back_steps,
+        nb_future_steps,
+        max_gap_minutes=MAX_GAP_MINUTES,
+        max_back_age_minutes=default_max_back_age(nb_back_steps),
+    )
+else:
+    print(f"Using temporal windows from {windows_file}")
 
 # loop over the index and create the dataset
 len_total = len(index) - nb_back_steps - nb_future_steps
 
-# Create necessary directories for saving files
+# Create necessary directories for saving files (one dataset folder per resolution)
 os.makedirs(save_hf_dataset, exist_ok=True)
-# Create subdirectories for different data types
-for data_type in [
-    "radar_future",
-    "radar_back",
-    "groundstation_future",
-    "groundstation_back",
-    "ground_height_image",
-    "landcover_image",
-]:
-    os.makedirs(os.path.join(save_hf_dataset, data_type), exist_ok=True)
-
-# Initialize the index.json file (do not overwrite if exists)
-if not os.path.exists(os.path.join(save_hf_dataset, "index.json")):
-    with open(os.path.join(save_hf_dataset, "index.json"), "w") as f:
-        pass  # Just create an empty file or write a header if needed
-
-# Use ThreadPoolExecutor for parallel processing
-# Determine the number of workers, e.g., number of CPU cores
-num_workers = 6  # Use number of cores, default to 4 if not available
-print(f"Using {num_workers} worker threads.")
-
-# create a random permutation of range(len_total)
-index_permutation = np.random.permutation(range(len_total))
-
-with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-    futures = []
-    # Use tqdm here to track the submission of tasks
-    for i in tqdm(range(len_total), desc="Submitting tasks"):
-        # shuffle the index ()
-        new_i = index_permutation[i]
-
-        # Submit the worker function to the executor
-        future = executor.submit(
-            process_index_multiple_passes,
-            new_i,
-            index,  # Pass index_dataframe
-            nb_back_steps,
-            nb_future_steps,
-            shape_image,
-            ground_height_image,
-            landcover_image,
-            save_hf_dataset,
-            index_file_lock,  # Pass the lock
-            NB_PASS_PER_IMAGES,  # Pass the number of passes
+outputs = {}
+for resolution, save_dir in OUTPUT_RESOLUTIONS.items():
+    os.makedirs(save_dir, exist_ok=True)
+    # Create subdirectories for different data types (npz backend)
+    if OUTPUT_BACKEND == "npz":
+        for data_type in [
+            "radar_future",
+            "radar_back",
+            "groundstation_future",
+            "groundstation_back",
+        ]:
+            os.makedirs(os.path.join(save_dir, data_type), exist_ok=True)
+
+    # the static layers (ground height, landcover) are prepared only once
+    # (normalized float32, full resolution, memory mappable, with their statistics)
+    prepare_static_layers(
+        save_dir, ground_height_image_path, landcover_image_path, LANDCOVER_CLASSES
+    )
+
+    if OUTPUT_BACKEND == "parquet":
+        outputs[resolution] = (
+            save_dir,
+            None,
+            ParquetShardWriter(
+                save_dir,
+                parquet_tensor_shapes(resolution),
+                PARQUET_SCALAR_TYPES,
+                rows_per_row_group=PARQUET_ROWS_PER_ROW_GROUP,
+                rows_per_shard=PARQUET_ROWS_PER_SHARD,
+            ),
+        )
+    else:
+        # the index parts of a previous (interrupted) run are kept
+        outputs[resolution] = (
+            save_dir,
+            ParquetIndexWriter(save_dir, rows_per_part=INDEX_ROWS_PER_PART),
+            None,
         )
-        futures.append(future)
 
-    # The executor context manager waits for all futures to complete automatically.
+# completion journal: the datetimes already processed are skipped, it can only be
+# resumed by a run with the same seed and sampling configuration
+journal = GenerationJournal(
+    save_hf_dataset,
+    {
+        "seed": SEED,
+        "nb_back_steps": NB_BACK_STEPS,
+        "nb_future_steps": NB_FUTURE_STEPS,
+        "nb_pass_per_images": NB_PASS_PER_IMAGES,
+        "patch_margin": PATCH_MARGIN,
+        "min_valid_pixels": MIN_VALID_PIXELS,
+        "coverage_maps": coverage_index is not None,
+        "importance_sampling": IMPORTANCE_SAMPLING,
+        "rain_weight_exponent": RAIN_WEIGHT_EXPONENT,
+        "rain_weight_floor": RAIN_WEIGHT_FLOOR,
+        "patch_size": PATCH_SIZE,
+        "output_resolutions": sorted(OUTPUT_RESOLUTIONS),
+        "radar_normalization": RADAR_NORMALIZATION,
+        "default_value": DEFAULT_VALUE,
+        "radar_pooling": RADAR_POOLING,
+        "groundstation_pooling": GROUNDSTATION_POOLING,
+        "groundstation_source": GROUNDSTATION_SOURCE,
+        "groundstation_raster": GROUNDSTATION_RASTER,
+        "output_backend": OUTPUT_BACKEND,
+    },
+)
+
+# create a seeded permutation of the index range of this run
+range_end = len_total if INDEX_RANGE_END is None else min(INDEX_RANGE_END, len_total)
+index_order = index_permutation(SEED, INDEX_RANGE_START, range_end)
+# windows with a gap in their future frames are skipped before any I/O
+nb_invalid = int(np.count_nonzero(~windows["valid"][index_order]))
+index_order = [
+    i
+    for i in index_order
+    if windows["valid"][i] and not journal.is_done(datetimes[i + nb_back_steps])
+]
+print(
+    f"{len(index_order)} indices to process in [{INDEX_RANGE_START}, {range_end}) "
+    f"({len(journal.completed)} already in the journal, {nb_invalid} invalid windows)."
+)
+
+# staged pipeline: I/O reads -> compute -> compress/write, with bounded queues
+pipeline = BoundedPipeline(
+    [
+        Stage(
+            "read",
+            functools.partial(
+                read_data_point,
+                nb_back_steps=nb_back_steps,
+                nb_future_steps=nb_future_steps,
+                nb_passes=NB_PASS_PER_IMAGES,
+                seed=SEED,
+            ),
+            num_workers=NUM_READ_WORKERS,
+        ),
+        Stage("compute", compute_data_point, num_workers=NUM_COMPUTE_WORKERS),
+        Stage(
+            "write",
+            functools.partial(
+                write_data_point,
+                journal=journal,
+                outputs=outputs,
+            ),
+            num_workers=NUM_WRITE_WORKERS,
+        ),
+    ]
+)
+print(
+    f"Using {NUM_READ_WORKERS} read, {NUM_COMPUTE_WORKERS} compute "
+    f"and {NUM_WRITE_WORKERS} write worker threads."
+)
+
+with tqdm(total=len(index_order), desc="Generating data points") as progress_bar:
+    pipeline.run(index_order, progress=progress_bar.update)
+
+for save_dir, index_writer, parquet_writer in outputs.values():
+    if parquet_writer is not None:
+        # flush the last row groups and close the shards (commits the journal)
+        parquet_writer.close()
+    else:
+        # flush the last index parts (commits the journal) and consolidate them
+        index_writer.close()
+        print(f"Index saved to {consolidate_index(save_dir)}")
+
+print(pipeline.report())
 print("Dataset generation complete.")
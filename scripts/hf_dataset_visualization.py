@@ -10,11 +10,12 @@ import pandas as pd
 import imageio
 
 
-import json
+from meteolibre_dataset.static_layers import load_static_layers, crop_static_layers
 
-# load the index data from json
-json_path = "../data/hf_dataset/index.json"
-df_from_string = pd.read_json(json_path, orient='columns', lines=True)
+# load the index data from parquet
+hf_dataset_dir = "../data/hf_dataset/"
+index_path = "../data/hf_dataset/index.parquet"
+df_from_string = pd.read_parquet(index_path)
 
 print(df_from_string.columns)
 
@@ -23,13 +24,14 @@ print(df_from_string.columns)
 # radar_file_path_back
 # groundstation_file_path_future
 # groundstation_file_path_back
-# ground_height_file_path
+# and the patch position (patch_x, patch_y) for the static layers
 index= 5
 radar_file_path_future = df_from_string['radar_file_path_future'].values[index]
 radar_file_path_back = df_from_string['radar_file_path_back'].values[index]
 groundstation_file_path_future = df_from_string['groundstation_file_path_future'].values[index]
 groundstation_file_path_back = df_from_string['groundstation_file_path_back'].values[index]
-ground_height_file_path = df_from_string['ground_height_file_path'].values[index]
+patch_x = df_from_string['patch_x'].values[index]
+patch_y = df_from_string['patch_y'].values[index]
 
 # load the npz files
 def load_npz_file(file_path):
@@ -45,7 +47,10 @@ radar_future = load_npz_file(radar_file_path_future)
 radar_back = load_npz_file(radar_file_path_back)
 groundstation_future = load_npz_file(groundstation_file_path_future)
 groundstation_back = load_npz_file(groundstation_file_path_back)
-ground_height = load_npz_file(ground_height_file_path)
+
+# static layers are cropped on demand from the full resolution assets
+static_layers = crop_static_layers(load_static_layers(hf_dataset_dir), patch_x, patch_y)
+ground_height = static_layers["ground_height_image"]
 
 # Check if the data is loaded correctly
 if radar_future is None or radar_back is None or groundstation_future is None or groundstation_back is None or ground_height is None:
@@ -1,10 +1,28 @@
 # !/bin/bash
 # generate the hf files from the h5 files
 
+# precompute the radar coverage maps (valid patch positions)
+python3 radar_coverage_creation.py
+
+# radar read cache, only one of them is built (RADAR_CACHE, "cube" by default):
+# - cube: the radar frames repacked into a time series cube (one read per temporal
+#   window, any pooling)
+# - pyramid: the pyramid cache (2x, 4x levels, only read with RADAR_POOLING = "nearest")
+# - none: the radar patches are read from the h5 files
+RADAR_CACHE=${RADAR_CACHE:-cube}
+case "$RADAR_CACHE" in
+    cube) python3 radar_cube_creation.py ;;
+    pyramid) python3 radar_pyramid_creation.py ;;
+    none) ;;
+    *) echo "Unknown RADAR_CACHE $RADAR_CACHE (cube, pyramid or none)"; exit 1 ;;
+esac
+
 # create the proper dataset
 python3 hf_dataset_resize.py
 
 # we push it to the hub
+# (with OUTPUT_BACKEND = "parquet" the shards in ../data/hf_dataset/data can be
+# uploaded as is, e.g. huggingface-cli upload, without the zip step)
 cd ../data
 zip -r hf_dataset.zip hf_dataset/
-gsutil cp hf_dataset.zip gs://meteofrance-preprocess/
\ No newline at end of file
+python3 -m meteolibre_dataset.storage cp hf_dataset.zip ${STORAGE_URL:-gs://meteofrance-preprocess}/hf_dataset.zip
\ No newline at end of file
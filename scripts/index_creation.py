@@ -1,74 +1,180 @@
 """
 This script creates an index (parquet file) by reading lists of radar and ground station files.
 It processes filenames to extract dates, filters data based on time frequency,
-and merges radar and ground station dataframes into a final index.
+and merges radar, ground station (and optional satellite / BUFR) dataframes into a final
+index sorted by datetime, with per-source as-of joins (see meteolibre_dataset.multi_source_index).
+
+The data directories are indexed incrementally (see meteolibre_dataset.file_index):
+the file lists are persisted with their mtimes (h5_files.parquet, groundstation_files.parquet)
+and only the new files are added on re-run.
+
+It also precomputes the temporal windows of the dataset generation (frame offsets,
+gap masks and valid window starts, see meteolibre_dataset.temporal_windows) for the
+NB_BACK_STEPS / NB_FUTURE_STEPS spec of hf_dataset_resize.py.
 """
 
 import os
-import pandas as pd
-
-def create_radar_dataframe(h5_dir="../data/h5"):
+import datetime
+
+import polars as pl
+
+from meteolibre_dataset.file_index import DATE_PATTERN, update_file_index
+from meteolibre_dataset.multi_source_index import IndexSource, build_multi_source_index
+from meteolibre_dataset.temporal_windows import (
+    MAX_GAP_MINUTES,
+    compute_windows,
+    default_max_back_age,
+    save_windows,
+)
+
+# temporal window spec (same as hf_dataset_resize.py)
+NB_BACK_STEPS = 5
+NB_FUTURE_STEPS = 4
+
+NUM_SCAN_WORKERS = 8  # directories scanned in parallel
+
+# as-of join of the ground station files on the radar times (nearest within the tolerance)
+GROUNDSTATION_TOLERANCE = datetime.timedelta(minutes=5)
+
+# optional sources, added to the index if their directory exists (file path left null
+# when there is no file within the tolerance)
+OPTIONAL_SOURCES = [
+    {
+        "name": "satellite",
+        "directory": "../data/satellite_npz",
+        "prefix": "satellite_npz/",
+        "suffix": ".npz",
+        # sensing start time of the EUMETSAT products (second date of the name)
+        "date_pattern": r"_C_EUMT_\d{14}.{11}(\d{12})",
+        "file_index_path": "../data/satellite_files.parquet",
+        "tolerance": datetime.timedelta(minutes=15),
+        "strategy": "nearest",
+    },
+    {
+        "name": "bufr",
+        "directory": "../data/bufr",
+        "prefix": "bufr/",
+        "suffix": ".bufr.gz",
+        "date_pattern": DATE_PATTERN,
+        "file_index_path": "../data/bufr_files.parquet",
+        "tolerance": datetime.timedelta(minutes=15),
+        "strategy": "backward",
+    },
+]
+
+def create_radar_dataframe(h5_dir="../data/h5", file_index_path="../data/h5_files.parquet"):
     """
-    Creates a Pandas DataFrame for radar files.
+    Updates the persisted file index of the radar directory (only the new or modified
+    files are scanned, see meteolibre_dataset.file_index) and keeps the radar frames
+    at :00 and :30.
 
     Args:
         h5_dir (str, optional): Path to the directory containing H5 radar files.
                                  Defaults to "../data/h5".
+        file_index_path (str, optional): Path of the persisted file index of h5_dir.
+                                         Defaults to "../data/h5_files.parquet".
 
     Returns:
-        pd.DataFrame: DataFrame containing radar file paths and extracted datetime information.
+        pd.DataFrame: The file index of h5_dir (see update_file_index) with the
+                      file_path_h5 column, relative to the data directory.
     """
-    list_files = os.listdir(h5_dir)
-    list_files = [f for f in list_files if f.endswith(".h5")]
+    df_radar = update_file_index(h5_dir, ".h5", file_index_path, num_workers=NUM_SCAN_WORKERS)
 
-    df_radar = pd.DataFrame(list_files, columns=["file_path"])
     df_radar["file_path_h5"] = "h5/" + df_radar["file_path"]
-    df_radar["date"] = df_radar["file_path"].str.extract(r"(\d{12})")
-    df_radar["datetime"] = pd.to_datetime(df_radar["date"], format="%Y%m%d%H%M", errors="raise")
     df_radar = df_radar[df_radar["datetime"].dt.minute.isin([0, 30])] # filter by frequency
 
     print(f"Radar DataFrame - First 5 rows:\n{df_radar.head()}")
     print(f"Number of rows in Radar DataFrame: {len(df_radar)}")
     return df_radar
 
-def create_groundstation_dataframe(npz_dir="../data/groundstation_npz"):
+def create_groundstation_dataframe(
+    npz_dir="../data/groundstation_npz", file_index_path="../data/groundstation_files.parquet"
+):
     """
-    Creates a Pandas DataFrame for ground station files.
+    Updates the persisted file index of the ground station directory (only the new or
+    modified files are scanned, see meteolibre_dataset.file_index).
 
     Args:
         npz_dir (str, optional): Path to the directory containing NPZ ground station files.
                                   Defaults to "../data/groundstation_npz".
+        file_index_path (str, optional): Path of the persisted file index of npz_dir.
+                                         Defaults to "../data/groundstation_files.parquet".
 
     Returns:
-        pd.DataFrame: DataFrame containing ground station file paths and extracted datetime information.
+        pd.DataFrame: The file index of npz_dir (see update_file_index) with the
+                      file_path_npz column, relative to the data directory.
     """
-    list_files = os.listdir(npz_dir)
-    list_files = [f for f in list_files if f.endswith(".npz")]
+    df_groundstations = update_file_index(
+        npz_dir, ".npz", file_index_path, num_workers=NUM_SCAN_WORKERS
+    )
 
-    df_groundstations = pd.DataFrame(list_files, columns=["file_path"])
     df_groundstations["file_path_npz"] = "groundstation_npz/" + df_groundstations["file_path"]
-    df_groundstations["date"] = df_groundstations["file_path"].str.extract(r"(\d{12})")
-    df_groundstations["datetime"] = pd.to_datetime(df_groundstations["date"], format="%Y%m%d%H%M", errors="raise")
 
     print(f"Ground Station DataFrame - First 5 rows:\n{df_groundstations.head()}")
     return df_groundstations
 
-def merge_dataframes(df_radar, df_groundstations):
+def create_optional_source_dataframes():
+    """
+    Creates the file DataFrames of the optional sources (OPTIONAL_SOURCES) whose directory exists.
+
+    Returns:
+        list: List of (source config, pd.DataFrame with file_path and datetime).
+    """
+    sources = []
+    for source in OPTIONAL_SOURCES:
+        if not os.path.isdir(source["directory"]):
+            continue
+
+        df_source = update_file_index(
+            source["directory"],
+            source["suffix"],
+            source["file_index_path"],
+            num_workers=NUM_SCAN_WORKERS,
+            date_pattern=source["date_pattern"],
+        )
+        df_source["file_path"] = source["prefix"] + df_source["file_path"]
+        sources.append((source, df_source))
+
+    return sources
+
+def merge_dataframes(df_radar, df_groundstations, optional_sources=()):
     """
-    Merges radar and ground station DataFrames based on datetime.
-    Removes redundant columns after merging.
+    Merges radar, ground station and optional source DataFrames with as-of joins on datetime
+    (per-source tolerance, see meteolibre_dataset.multi_source_index).
 
     Args:
         df_radar (pd.DataFrame): DataFrame containing radar data.
         df_groundstations (pd.DataFrame): DataFrame containing ground station data.
+        optional_sources (list, optional): Output of create_optional_source_dataframes.
 
     Returns:
-        pd.DataFrame: Merged DataFrame with selected columns.
+        pd.DataFrame: Merged DataFrame, one row per radar file (datetime, radar_file_path,
+                      then {source}_file_path and {source}_offset_s for every other source).
     """
-    df_radar_renamed = df_radar[['datetime', 'file_path_h5']].rename(columns={'file_path_h5': 'radar_file_path'})
-    df_groundstations_renamed = df_groundstations[['datetime', 'file_path_npz']].rename(columns={'file_path_npz': 'groundstation_file_path'})
-
-    df_merged = pd.merge(df_radar_renamed, df_groundstations_renamed, how="inner", on="datetime")
+    anchor = IndexSource(
+        "radar",
+        pl.from_pandas(df_radar[["datetime", "file_path_h5"]].rename(columns={"file_path_h5": "file_path"})),
+    )
+    sources = [
+        IndexSource(
+            "groundstation",
+            pl.from_pandas(df_groundstations[["datetime", "file_path_npz"]].rename(columns={"file_path_npz": "file_path"})),
+            tolerance=GROUNDSTATION_TOLERANCE,
+            strategy="nearest",
+        )
+    ]
+    for source, df_source in optional_sources:
+        sources.append(
+            IndexSource(
+                source["name"],
+                pl.from_pandas(df_source[["datetime", "file_path"]]),
+                tolerance=source["tolerance"],
+                strategy=source["strategy"],
+                required=False,
+            )
+        )
+
+    df_merged = build_multi_source_index(anchor, sources).to_pandas()
 
     print(f"Merged DataFrame - First 5 rows:\n{df_merged.head()}")
     print(f"Length of the Merged DataFrame: {len(df_merged)}")
@@ -86,8 +192,37 @@ def save_dataframe_to_parquet(df, output_path="../data/index.parquet"):
     df.to_parquet(output_path, index=False)
     print(f"DataFrame saved to parquet file: {output_path}")
 
+def save_temporal_windows(df, output_path="../data/windows.npz"):
+    """
+    Precomputes and saves the temporal windows of the sorted index.
+
+    Args:
+        df (pd.DataFrame): Index sorted by datetime.
+        output_path (str, optional): Path to save the windows.
+                                     Defaults to "../data/windows.npz".
+    """
+    max_back_age_minutes = default_max_back_age(NB_BACK_STEPS)
+    windows = compute_windows(
+        df["datetime"].to_numpy(),
+        NB_BACK_STEPS,
+        NB_FUTURE_STEPS,
+        max_gap_minutes=MAX_GAP_MINUTES,
+        max_back_age_minutes=max_back_age_minutes,
+    )
+    save_windows(
+        output_path,
+        windows,
+        NB_BACK_STEPS,
+        NB_FUTURE_STEPS,
+        MAX_GAP_MINUTES,
+        max_back_age_minutes,
+    )
+    print(f"Valid windows: {windows['valid'].sum()} / {len(windows['valid'])}, saved to: {output_path}")
+
 if __name__ == "__main__":
     df_radar = create_radar_dataframe()
     df_groundstations = create_groundstation_dataframe()
-    df_index = merge_dataframes(df_radar, df_groundstations)
+    optional_sources = create_optional_source_dataframes()
+    df_index = merge_dataframes(df_radar, df_groundstations, optional_sources)
     save_dataframe_to_parquet(df_index)
+    save_temporal_windows(df_index)
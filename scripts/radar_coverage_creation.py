@@ -0,0 +1,38 @@
+"""
+This script precomputes the radar coverage maps (number of valid pixels per block)
+and rain maps (sum of the radar values per block) for every radar file of the
+index (index.parquet), in one pass over the radar frames. The maps of the radar
+files already in radar_coverage.npz are kept, only the new files are read.
+
+The coverage maps are used by hf_dataset_resize.py to pick patch positions that
+are guaranteed to be valid before reading the full radar frames, and the rain maps
+to draw those positions with precipitation-weighted importance sampling.
+"""
+
+import pandas as pd
+
+from meteolibre_dataset.radar_coverage import (
+    COVERAGE_BLOCK_SIZE,
+    update_coverage_index,
+)
+
+MAIN_DIR = "../data/"
+index_file = MAIN_DIR + "index.parquet"
+coverage_file = MAIN_DIR + "radar_coverage.npz"
+
+STRIDE = 2  # same stride as the dataset generation
+
+
+if __name__ == "__main__":
+    index = pd.read_parquet(index_file)
+    radar_file_paths = index["radar_file_path"].astype(str).tolist()
+
+    print(f"Number of radar files to process: {len(radar_file_paths)}")
+
+    coverage, rain, nb_read = update_coverage_index(
+        coverage_file, radar_file_paths, MAIN_DIR, block_size=COVERAGE_BLOCK_SIZE, stride=STRIDE
+    )
+    print(
+        f"Coverage maps saved to: {coverage_file} (shape {coverage.shape}, "
+        f"{nb_read} new frames read)"
+    )
@@ -0,0 +1,41 @@
+"""
+This script repacks the radar frames of the index (index.parquet) into a single
+time series cube (time, x, y) with temporal chunks (radar_cube.h5), so that a
+temporal window of frames at a location is a few chunk reads instead of one h5
+file per frame.
+
+hf_dataset_resize.py then reads the radar window of every patch from the cube.
+The script is incremental: the frames later than the last frame of the cube are
+appended to it. The frames backfilled earlier than the last frame of the cube are
+reported and skipped, set REBUILD_CUBE = True to rebuild the cube with them.
+"""
+
+import pandas as pd
+
+from meteolibre_dataset.radar_cube import CUBE_CHUNKS, build_radar_cube
+
+MAIN_DIR = "../data/"
+index_file = MAIN_DIR + "index.parquet"
+cube_file = MAIN_DIR + "radar_cube.h5"
+
+NUM_WORKERS = 6
+REBUILD_CUBE = False  # rebuild the cube from all the frames (adds the backfilled frames)
+
+
+if __name__ == "__main__":
+    index = pd.read_parquet(index_file)
+    radar_file_paths = index["radar_file_path"].astype(str).tolist()
+    datetimes = pd.to_datetime(index["datetime"]).dt.to_pydatetime().tolist()
+
+    print(f"Number of radar files in the index: {len(radar_file_paths)}")
+
+    nb_added = build_radar_cube(
+        radar_file_paths,
+        datetimes,
+        MAIN_DIR,
+        cube_file,
+        chunks=CUBE_CHUNKS,
+        num_workers=NUM_WORKERS,
+        rebuild=REBUILD_CUBE,
+    )
+    print(f"{nb_added} radar frames appended to: {cube_file}")
@@ -0,0 +1,37 @@
+"""
+This script builds the multi-resolution pyramid cache of the radar frames
+(2x, 4x) for every radar file of the index (index.parquet), in a single
+chunked and compressed store keyed by timestamp (radar_pyramid.h5).
+
+With RADAR_POOLING = "nearest", hf_dataset_resize.py then reads the radar patches from
+the 2x level instead of reading the full resolution h5 files with a stride. The
+script is incremental: the frames already in the store are skipped.
+"""
+
+import pandas as pd
+
+from meteolibre_dataset.radar_pyramid import PYRAMID_LEVELS, build_radar_pyramid
+
+MAIN_DIR = "../data/"
+index_file = MAIN_DIR + "index.parquet"
+pyramid_file = MAIN_DIR + "radar_pyramid.h5"
+
+NUM_WORKERS = 6
+
+
+if __name__ == "__main__":
+    index = pd.read_parquet(index_file)
+    radar_file_paths = index["radar_file_path"].astype(str).tolist()
+    datetimes = pd.to_datetime(index["datetime"]).dt.to_pydatetime().tolist()
+
+    print(f"Number of radar files to process: {len(radar_file_paths)}")
+
+    nb_added = build_radar_pyramid(
+        radar_file_paths,
+        datetimes,
+        MAIN_DIR,
+        pyramid_file,
+        levels=PYRAMID_LEVELS,
+        num_workers=NUM_WORKERS,
+    )
+    print(f"{nb_added} radar frames added to: {pyramid_file}")
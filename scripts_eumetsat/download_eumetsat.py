@@ -18,10 +18,10 @@ import glob
 from nc_to_geotif import nc_to_geotiff
 import rasterio
 from rasterio.merge import merge
-from google.cloud import storage
 from urllib3.exceptions import ProtocolError
 
 from preprocess_eumetsat import preprocess_eumetsat_file
+from meteolibre_dataset.storage import open_storage
 
 
 def download_with_retry(product, max_retries=3, delay=10):
@@ -39,17 +39,15 @@ def download_with_retry(product, max_retries=3, delay=10):
 def upload_to_gcp(bucket_name, source_file_name, destination_blob_name):
     """Uploads a file to the bucket."""
     # The ID of your GCS bucket
-    # bucket_name = "your-bucket-name"
+    # bucket_name = "your-bucket-name" (or a local directory used as a bucket)
     # The path to your file to upload
     # source_file_name = "local/path/to/file"
     # The ID of your GCS object
     # destination_blob_name = "storage-object-name"
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-
-    blob.upload_from_filename(source_file_name)
+    # one storage (and client) per bucket, reused for every upload
+    storage_url = bucket_name if os.path.isabs(bucket_name) else "gs://" + bucket_name
+    open_storage(storage_url).put(source_file_name, destination_blob_name)
 
     print(
         f"File {source_file_name} uploaded to {destination_blob_name}."